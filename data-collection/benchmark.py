@@ -0,0 +1,491 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import clean_data_rough
+import fetch_causes_of_death
+import fetch_enhanced_production as enrich
+from http_client import make_session
+import people_index
+import sparql_enrichment
+from mock_wikidata import (CannedSparql, EnrichmentSparql, MockWikidata, load_fixture, make_synthetic_entities,
+                           people_to_rows, save_fixture)
+
+SCENARIOS = {'1k': 1_000, '10k': 10_000, '100k': 100_000}
+DEFAULT_FIXTURE_DIR = 'benchmark_fixtures'
+DEFAULT_RESULTS_PATH = 'benchmark_results.jsonl'
+
+def bench_enrichment(num_people, latency, workers=1):
+    """Enrich synthetic people against the mock API and count round trips"""
+    entities, people = make_synthetic_entities(num_people)
+    enrich.reset_state()
+
+    with MockWikidata(entities, latency=latency) as mock:
+        enrich.API_URL = mock.url
+        session = make_session(pool_size=max(10, workers))
+
+        start = time.perf_counter()
+        processed = {}
+        for _, _, batch_processed in enrich.enrich_batches(people, session, 25, workers):
+            if batch_processed:
+                processed.update(batch_processed)
+        elapsed = time.perf_counter() - start
+
+    return {
+        'people': num_people,
+        'workers': workers,
+        'processed': len(processed),
+        'api_calls': mock.total_calls,
+        'calls_per_person': mock.total_calls / num_people,
+        'seconds': elapsed,
+        'hierarchy_hit_rate': enrich.hierarchy_hit_rate(),
+    }
+
+def bench_backends(num_people, latency, workers=1):
+    """Enrich the same synthetic people through the wbgetentities and SPARQL backends"""
+    entities, people = make_synthetic_entities(num_people)
+    results = {}
+    records = {}
+
+    with MockWikidata(entities, latency=latency, sparql=EnrichmentSparql(entities)) as mock:
+        enrich.API_URL = mock.url
+        fetch_causes_of_death.ENDPOINT_URL = mock.sparql_url
+        for backend, batch_size in (('api', 25), ('sparql', sparql_enrichment.BLOCK_SIZE)):
+            enrich.reset_state()
+            mock.reset_counts()
+            enrich.use_sparql = backend == 'sparql'
+            session = make_session(pool_size=max(10, workers))
+
+            start = time.perf_counter()
+            processed = {}
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _, _, batch_processed in enrich.enrich_batches(people, session, batch_size, workers):
+                    if batch_processed:
+                        processed.update(batch_processed)
+            elapsed = time.perf_counter() - start
+
+            records[backend] = processed
+            results[backend] = {
+                'processed': len(processed),
+                'seconds': elapsed,
+                'api_calls': mock.total_calls - mock.calls['/sparql'],
+                'sparql_queries': mock.calls['/sparql'],
+            }
+        enrich.use_sparql = False
+
+    identical = sum(1 for qid, record in records['api'].items() if records['sparql'].get(qid) == record)
+    # SPARQL keeps the first three citizenships/occupations by QID, the API path by claim order
+    unordered = {'citizenship', 'occupation'}
+    differ_in_lists = sum(
+        1 for qid, record in records['api'].items()
+        if records['sparql'].get(qid) not in (None, record)
+        and all(records['sparql'][qid].get(key) == value for key, value in record.items() if key not in unordered)
+    )
+    return results, identical, differ_in_lists, len(records['api'])
+
+def write_synthetic_csv(path, num_rows, seed=0):
+    """Write a humans_filtered.csv lookalike whose causes mix allowed and excluded labels"""
+    rng = random.Random(seed)
+    allowed = clean_data_rough.load_allowed_causes()
+    causes = [(f"http://www.wikidata.org/entity/Q{5000 + i}", label) for i, label in enumerate(allowed)]
+    causes += [(f"http://www.wikidata.org/entity/Q{9000 + i}", f"disease {i}") for i in range(300)]
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['person', 'personLabel', 'causeOfDeath', 'causeOfDeathLabel'])
+        for i in range(num_rows):
+            cause_url, label = rng.choice(causes)
+            writer.writerow([f"http://www.wikidata.org/entity/Q{i + 1}", f"Person {i}", cause_url, label])
+
+def measure(func):
+    """Run func, returning (result, seconds, peak traced memory in MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def bench_clean(num_rows):
+    """Compare the old whole-file label filter with the chunked QID filter"""
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'humans_filtered.csv')
+        write_synthetic_csv(csv_path, num_rows)
+
+        def legacy():
+            df = pd.read_csv(csv_path)
+            filtered = df[df["causeOfDeathLabel"].isin(clean_data_rough.load_allowed_causes())]
+            filtered.to_json(os.path.join(tmp, 'legacy.json'), orient="records", indent=2)
+            return len(filtered)
+
+        def chunked():
+            allowlist = clean_data_rough.CauseAllowlist(qids_file=None)
+            return clean_data_rough.filter_csv(csv_path, os.path.join(tmp, 'chunked.json'), allowlist)[1]
+
+        results = {name: measure(func) for name, func in (('legacy', legacy), ('chunked', chunked))}
+        identical = open(os.path.join(tmp, 'legacy.json')).read() == open(os.path.join(tmp, 'chunked.json')).read()
+
+    return results, identical
+
+def make_synthetic_records(num_people, seed=0):
+    """Enriched records with a long-tailed cause distribution, as fetch_enhanced_production writes them"""
+    rng = random.Random(seed)
+    causes = clean_data_rough.load_allowed_causes()
+    # Cause i is 1/(i+1) as common as the first, like heart attacks against rare accidents
+    weights = [1 / (i + 1) for i in range(len(causes))]
+    records = []
+    for i, cause in enumerate(rng.choices(causes, weights, k=num_people)):
+        year = rng.randint(1500, 1990)
+        records.append({
+            'person': f"http://www.wikidata.org/entity/Q{100000 + i}",
+            'personLabel': f"Person {i}",
+            'birthDate': f"+{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00Z",
+            'deathDate': f"+{year + rng.randint(10, 90)}-01-01T00:00:00Z",
+            'citizenship': '|'.join(f"Country {c}" for c in rng.sample(range(150), rng.randint(1, 3))),
+            'occupation': '|'.join(f"occupation {o}" for o in rng.sample(range(2000), rng.randint(1, 3))),
+            'causeOfDeathLabel': cause,
+        })
+    return records
+
+def bench_index(num_people, rounds, size=4):
+    """Build a PeopleIndex over synthetic records and time queries and round sampling"""
+    records = make_synthetic_records(num_people)
+    start = time.perf_counter()
+    index = people_index.PeopleIndex(records)
+    build_seconds = time.perf_counter() - start
+    rng = random.Random(0)
+    century = max(index.values('century'), key=lambda value: index.count(century=value))
+    country = index.countries[0]
+
+    def per_call(func):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            func()
+        return (time.perf_counter() - start) / rounds
+
+    def linear_scan():
+        # What dealing a same-century round took without the index
+        matches = [r for r in records if people_index.parse_year(r['birthDate']) // 100 * 100 == century]
+        by_cause = {}
+        for record in matches:
+            by_cause.setdefault(record['causeOfDeathLabel'], []).append(record)
+        return [rng.choice(by_cause[cause]) for cause in rng.sample(list(by_cause), size)]
+
+    timings = {
+        'round': per_call(lambda: index.sample_round(size, rng=rng)),
+        'round, same century': per_call(lambda: index.sample_round(size, 'century', rng)),
+        'round, same decade': per_call(lambda: index.sample_round(size, 'decade', rng)),
+        f"round, {country}": per_call(lambda: index.sample_round(size, rng=rng, country=country)),
+        f"round, {country}, same century": per_call(lambda: index.sample_round(size, 'century', rng, country=country)),
+        f"select {country} + {century}s": per_call(lambda: index.select(country=country, century=century)),
+        'linear scan, same century': per_call(linear_scan) if rounds <= 100 else None,
+    }
+    return {'people': len(index), 'causes': len(index.causes), 'build_seconds': build_seconds, 'timings': timings}
+
+def fixture_causes():
+    """Causes handed out to fixture rows: 40 allowlisted ones and 10 that clean_data_rough drops"""
+    allowed = clean_data_rough.load_allowed_causes()[:40]
+    causes = [(f"Q{5000 + i}", label) for i, label in enumerate(allowed)]
+    return causes + [(f"Q{9000 + i}", f"disease {i}") for i in range(10)]
+
+def ensure_fixture(num_people, fixture_dir=DEFAULT_FIXTURE_DIR, seed=0):
+    """Path of the synthetic fixture for num_people, generating it on first use"""
+    path = os.path.join(fixture_dir, f"synthetic_{num_people}_seed{seed}.json.gz")
+    if not os.path.exists(path):
+        os.makedirs(fixture_dir, exist_ok=True)
+        print(f"Generating fixture {path}...")
+        entities, people = make_synthetic_entities(num_people, seed)
+        save_fixture(path + '.tmp', entities, people, people_to_rows(entities, people, fixture_causes()))
+        os.replace(path + '.tmp', path)
+    return path
+
+def record_fixture(rows, path, session):
+    """Fetch the people in rows, and every entity their enrichment reads, into a fixture"""
+    people = list(dict.fromkeys(enrich.extract_entity_id(row['person']) for row in rows))
+    entities = {}
+
+    def fetch(entity_ids):
+        missing = [eid for eid in dict.fromkeys(entity_ids) if eid and eid not in entities]
+        for qid, entity in enrich.fetch_entities(missing, session, 'info|labels|claims|sitelinks').items():
+            if 'missing' not in entity:
+                sitelinks = entity.get('sitelinks', {})
+                entity['sitelinks'] = {'enwiki': sitelinks['enwiki']} if 'enwiki' in sitelinks else {}
+                entities[qid] = entity
+        return missing
+
+    fetch(people)
+    label_ids, place_ids = [], []
+    for qid in people:
+        if qid in entities:
+            person_label_ids, person_place_ids = enrich.get_referenced_ids(enrich.extract_person_claims(qid, entities[qid]))
+            label_ids.extend(person_label_ids)
+            place_ids.extend(person_place_ids)
+    fetch(label_ids)
+
+    # Follow P131/P17 as far as the place resolver would
+    frontier = place_ids
+    for _ in range(enrich.MAX_ADMIN_HOPS + 1):
+        frontier = fetch(frontier)
+        frontier = [
+            enrich.extract_claim_value(entities[eid]['claims'], pid, 'entity')
+            for eid in frontier if eid in entities for pid in ('P131', 'P17')
+        ]
+
+    save_fixture(path, entities, people, rows)
+    return len(people), len(entities)
+
+def stage_result(seconds, items, mock):
+    return {
+        'seconds': seconds,
+        'items': items,
+        'items_per_sec': items / seconds if seconds else 0.0,
+        'api_calls': mock.total_calls,
+        'requests_per_sec': mock.total_calls / seconds if seconds else 0.0,
+    }
+
+def run_scenario(fixture_path, latency=0.0, error_rate=0.0, workers=4, seed=0):
+    """Replay a fixture through SPARQL export -> clean -> enrich, timing each stage"""
+    entities, people, rows = load_fixture(fixture_path)
+    enrich.reset_state()
+    stages = {}
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockWikidata(entities, latency, CannedSparql(rows), error_rate, seed) as mock, \
+            contextlib.redirect_stdout(io.StringIO()):
+        fetch_causes_of_death.ENDPOINT_URL = mock.sparql_url
+        fetch_causes_of_death.RETRY_BASE_DELAY = 0.01  # injected errors should cost retries, not sleeps
+        enrich.API_URL = mock.url
+        session = make_session(pool_size=max(10, workers))
+        csv_path = os.path.join(tmp, 'humans_filtered.csv')
+        json_path = os.path.join(tmp, 'humans_filtered_cleaned.json')
+
+        start = time.perf_counter()
+        exported = 0
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=CannedSparql.FIELDS)
+            writer.writeheader()
+            for row in fetch_causes_of_death.iter_rows(workers):
+                writer.writerow(row)
+                exported += 1
+        stages['export'] = stage_result(time.perf_counter() - start, exported, mock)
+        mock.reset_counts()
+
+        start = time.perf_counter()
+        total, kept = clean_data_rough.filter_csv(csv_path, json_path, clean_data_rough.CauseAllowlist(qids_file=None))
+        stages['clean'] = stage_result(time.perf_counter() - start, total, mock)
+        stages['clean']['kept'] = kept
+
+        with open(json_path, 'r') as f:
+            entity_ids = list(dict.fromkeys(enrich.extract_entity_id(row['person']) for row in json.load(f)))
+        start = time.perf_counter()
+        processed = failed = 0
+        for _, batch, batch_processed in enrich.enrich_batches(entity_ids, session, 25, workers):
+            if batch_processed is None:
+                failed += len(batch)
+            else:
+                processed += len(batch_processed)
+        stages['enrich'] = stage_result(time.perf_counter() - start, len(entity_ids), mock)
+        stages['enrich'].update(processed=processed, failed_people=failed)
+
+    return {
+        'people': len(people),
+        'stages': stages,
+        'api_calls': sum(stage['api_calls'] for stage in stages.values()),
+        'seconds': sum(stage['seconds'] for stage in stages.values()),
+        # Includes the fixture and the in-process mock server
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+def git_revision():
+    """(short commit, has uncommitted changes) of this checkout"""
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=cwd,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=cwd,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, bool(status.strip())
+
+def run_suite(scenarios, latency, error_rate, workers, fixture_dir=DEFAULT_FIXTURE_DIR,
+              results_path=DEFAULT_RESULTS_PATH, seed=0):
+    """Run each scenario in a fresh interpreter (so peak RSS is its own) and append the results"""
+    commit, dirty = git_revision()
+    results = []
+    for name in scenarios:
+        fixture = ensure_fixture(SCENARIOS[name], fixture_dir, seed)
+        print(f"Running {name} scenario...")
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), 'scenario', fixture, '--latency', str(latency),
+             '--error-rate', str(error_rate), '--workers', str(workers), '--seed', str(seed)],
+            capture_output=True, text=True, check=True,
+        )
+        result = {
+            'commit': commit,
+            'dirty': dirty,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+            'scenario': name,
+            'latency': latency,
+            'error_rate': error_rate,
+            'workers': workers,
+            'seed': seed,
+            **json.loads(completed.stdout.splitlines()[-1]),
+        }
+        with open(results_path, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        print_scenario(result)
+        results.append(result)
+    print(f"✅ Appended {len(results)} results for {commit}{' (dirty)' if dirty else ''} to {results_path}")
+    return results
+
+def print_scenario(result):
+    print(f"{result['scenario']}: {result['people']} people in {result['seconds']:.1f}s, "
+          f"{result['api_calls']} API calls, peak RSS {result['peak_rss_mb']:.0f} MB")
+    for name, stage in result['stages'].items():
+        print(f"- {name}: {stage['seconds']:.2f}s, {stage['items_per_sec']:.0f} items/s, "
+              f"{stage['api_calls']} calls ({stage['requests_per_sec']:.0f} req/s)")
+
+def compare_results(results_path=DEFAULT_RESULTS_PATH, base=None):
+    """Print the latest result of every commit per scenario, relative to `base` (default: the oldest)"""
+    groups = {}
+    with open(results_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                key = (result['scenario'], result['latency'], result['error_rate'], result['workers'])
+                label = result['commit'] + ('+' if result['dirty'] else '')
+                # Later runs of the same commit replace earlier ones
+                groups.setdefault(key, {}).pop(label, None)
+                groups[key][label] = result
+
+    for (scenario, latency, error_rate, workers), by_commit in groups.items():
+        print(f"\n{scenario} (latency {latency}s, error rate {error_rate:.0%}, {workers} workers)")
+        reference = by_commit.get(base) or next(iter(by_commit.values()))
+        for label, result in by_commit.items():
+            people_per_sec = result['stages']['enrich']['items_per_sec']
+            change = people_per_sec / reference['stages']['enrich']['items_per_sec'] - 1
+            print(f"- {label:>9}: {people_per_sec:7.0f} people/s ({change:+.0%}), "
+                  f"{result['stages']['export']['items_per_sec']:7.0f} rows/s export, "
+                  f"{result['api_calls']:6d} calls, {result['peak_rss_mb']:5.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data-collection scripts offline")
+    subparsers = parser.add_subparsers(dest='command')
+
+    enrich_parser = subparsers.add_parser('enrich', help="Enrichment against a local mock API (default)")
+    enrich_parser.add_argument('--people', type=int, default=1000)
+    enrich_parser.add_argument('--latency', type=float, default=0.0, help="Simulated per-request latency in seconds")
+    enrich_parser.add_argument('--workers', type=int, nargs='+', default=[1], help="Worker counts to compare")
+
+    backends_parser = subparsers.add_parser('backends', help="wbgetentities vs SPARQL enrichment on the same people")
+    backends_parser.add_argument('--people', type=int, default=1000)
+    backends_parser.add_argument('--latency', type=float, default=0.05, help="Simulated per-request latency in seconds")
+    backends_parser.add_argument('--workers', type=int, default=1)
+
+    index_parser = subparsers.add_parser('index', help="People index build time and round sampling latency")
+    index_parser.add_argument('--people', type=int, default=100_000)
+    index_parser.add_argument('--rounds', type=int, default=1000, help="Calls timed per query")
+    index_parser.add_argument('--size', type=int, default=4, help="People per round")
+
+    clean_parser = subparsers.add_parser('clean', help="Cause-of-death allowlist filter on a synthetic CSV")
+    clean_parser.add_argument('--rows', type=int, default=2_000_000)
+
+    suite_parser = subparsers.add_parser('suite', help="Export -> clean -> enrich scenarios, results kept per commit")
+    suite_parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=['1k', '10k'])
+    suite_parser.add_argument('--results', default=DEFAULT_RESULTS_PATH)
+    suite_parser.add_argument('--fixtures', default=DEFAULT_FIXTURE_DIR)
+
+    scenario_parser = subparsers.add_parser('scenario', help="Replay one fixture and print the result as JSON")
+    scenario_parser.add_argument('fixture')
+
+    for subparser in (suite_parser, scenario_parser):
+        subparser.add_argument('--latency', type=float, default=0.0, help="Simulated per-request latency in seconds")
+        subparser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests failing with 503")
+        subparser.add_argument('--workers', type=int, default=4)
+        subparser.add_argument('--seed', type=int, default=0)
+
+    compare_parser = subparsers.add_parser('compare', help="Compare suite results across commits")
+    compare_parser.add_argument('--results', default=DEFAULT_RESULTS_PATH)
+    compare_parser.add_argument('--base', help="Commit to compare against (default: the oldest one)")
+
+    record_parser = subparsers.add_parser('record', help="Record a replayable fixture from the live Wikidata API")
+    record_parser.add_argument('--input', default='humans_filtered_cleaned.json')
+    record_parser.add_argument('--limit', type=int, default=1000)
+    record_parser.add_argument('--output', default=os.path.join(DEFAULT_FIXTURE_DIR, 'recorded.json.gz'))
+
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        run_suite(args.scenarios, args.latency, args.error_rate, args.workers, args.fixtures, args.results, args.seed)
+        return
+
+    if args.command == 'scenario':
+        print(json.dumps(run_scenario(args.fixture, args.latency, args.error_rate, args.workers, args.seed)))
+        return
+
+    if args.command == 'compare':
+        compare_results(args.results, args.base)
+        return
+
+    if args.command == 'record':
+        with open(args.input, 'r') as f:
+            rows = json.load(f)[:args.limit]
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        people, entities = record_fixture(rows, args.output, make_session(rate=10))
+        print(f"✅ Recorded {people} people and {entities} entities to {args.output}")
+        return
+
+    if args.command == 'backends':
+        results, identical, differ_in_lists, total = bench_backends(args.people, args.latency, args.workers)
+        print(f"Enriched {args.people} synthetic people with {args.latency * 1000:.0f}ms simulated latency")
+        for backend, result in results.items():
+            print(f"- {backend}: {result['processed']} records in {result['seconds']:.2f}s, "
+                  f"{result['api_calls']} API calls, {result['sparql_queries']} SPARQL queries")
+        print(f"- {identical}/{total} records identical between backends, {differ_in_lists} more "
+              f"differing only in which citizenships/occupations come first")
+        return
+
+    if args.command == 'index':
+        result = bench_index(args.people, args.rounds, args.size)
+        print(f"Indexed {result['people']} synthetic people ({result['causes']} causes) in "
+              f"{result['build_seconds']:.2f}s")
+        for name, seconds in result['timings'].items():
+            if seconds is not None:
+                print(f"- {name}: {seconds * 1_000_000:.1f} µs")
+        return
+
+    if args.command == 'clean':
+        results, identical = bench_clean(args.rows)
+        print(f"Filtered {args.rows} synthetic rows (outputs {'identical' if identical else 'DIFFER'})")
+        for name, (kept, seconds, peak) in results.items():
+            print(f"- {name}: kept {kept} in {seconds:.2f}s, peak {peak:.0f} MB")
+        return
+
+    if args.command is None:
+        args = enrich_parser.parse_args([])
+
+    for workers in args.workers:
+        result = bench_enrichment(args.people, args.latency, workers)
+        print(f"Enriched {result['processed']}/{result['people']} people with {workers} worker(s) in {result['seconds']:.2f}s")
+        print(f"- API calls: {result['api_calls']} ({result['calls_per_person']:.2f} per person)")
+        print(f"- Place hierarchy hit rate: {result['hierarchy_hit_rate']:.1%}")
+
+if __name__ == "__main__":
+    main()
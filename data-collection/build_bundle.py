@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import commons_images
+from columnar import ENTITY_PREFIX
+from entity_cache import DEFAULT_CACHE_PATH, EntityCache
+from http_client import make_session
+import wikipedia_sections
+from commons_images import filename_from_photo
+from wikipedia_sections import article_title
+
+# Static bundle the Svelte front end loads instead of calling Wikidata and
+# Wikipedia for every card. Layout under static/bundle/:
+#
+#   index.json            causes plus [QID number, cause index] per person
+#   people/<n>.json       compact card records, person Q<id> lives in shard id % shardCount
+#   sections/<n>.json     plaintext Wikipedia sections, shard id % sectionShardCount
+#
+# Shards are picked by QID rather than position, and shard counts are powers
+# of two that never shrink between builds. Adding a person only changes the
+# shard it lands in, except when the bundle outgrows its shard count: then
+# the count doubles and every shard splits in two. src/lib/apiHelpers.ts
+# reads this layout.
+
+BUNDLE_VERSION = 1
+DEFAULT_OUTPUT_DIR = os.path.join('..', 'static', 'bundle')
+PEOPLE_PER_SHARD = 100
+SECTIONS_PER_SHARD = 10  # article text is much bigger than a card
+# Box the card photo is drawn in (.picture in Board.svelte), filled with object-fit: cover
+CARD_IMAGE_WIDTH = 240
+CARD_IMAGE_HEIGHT = 340
+
+# Fields the game shows on a card, as they appear in humans_enhanced_relevant.json
+CARD_FIELDS = ('person', 'personLabel', 'birthDate', 'gender', 'placeOfBirth',
+               'citizenship', 'occupation', 'causeOfDeath', 'causeOfDeathLabel')
+
+def qid_number(person_url):
+    return int(person_url[len(ENTITY_PREFIX):])
+
+def card_thumbnails(image):
+    """(1x URL, 2x URL) of the smallest fixed-width thumbnails that fill the card"""
+    thumbs = image['thumbs']
+    if not thumbs:
+        return None, None
+    width, height = image['width'] or 1, image['height'] or 1
+    # object-fit: cover crops, so a landscape photo has to be as tall as the box
+    needed = max(CARD_IMAGE_WIDTH, CARD_IMAGE_HEIGHT * width / height)
+    widths = sorted(thumbs, key=int)
+
+    def smallest(at_least):
+        return thumbs[next((w for w in widths if int(w) >= at_least), widths[-1])]
+
+    return smallest(needed), smallest(needed * 2)
+
+def compact_record(record, images=None):
+    """Card fields plus ready-to-use thumbnail URLs and an article link"""
+    card = {field: record.get(field) or '' for field in CARD_FIELDS}
+    image = (images or {}).get(filename_from_photo(record.get('photo')))
+    url, retina = card_thumbnails(image) if image else (None, None)
+    if url:
+        card['image'] = url
+        if retina != url:
+            card['imageSrcset'] = f"{url} 1x, {retina} 2x"
+    title = article_title(record.get('article'))
+    if title:
+        card['article'] = {'title': title, 'url': record['article']}
+    return card
+
+def shard_count_for(items, per_shard, previous=0):
+    """Smallest power of two, and at least `previous`, keeping shards to about per_shard items"""
+    count = max(1, previous)
+    while count * per_shard < items:
+        count *= 2
+    return count
+
+def previous_shard_counts(output_dir):
+    """(shardCount, sectionShardCount) of the bundle already in output_dir, or zeros"""
+    try:
+        with open(os.path.join(output_dir, 'index.json'), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return 0, 0
+    return index.get('shardCount', 0), index.get('sectionShardCount', 0)
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+def build_bundle(records, output_dir=DEFAULT_OUTPUT_DIR, sections=None, images=None,
+                 people_per_shard=PEOPLE_PER_SHARD, sections_per_shard=SECTIONS_PER_SHARD):
+    """Write the index and shards for `records`, replacing any previous bundle"""
+    records = sorted(records, key=lambda record: qid_number(record['person']))
+    previous_count, previous_section_count = previous_shard_counts(output_dir)
+    shard_count = shard_count_for(len(records), people_per_shard, previous_count)
+    section_shard_count = (shard_count_for(len(sections), sections_per_shard, previous_section_count)
+                           if sections else 0)
+
+    causes = sorted({record['causeOfDeathLabel'] for record in records})
+    cause_index = {cause: i for i, cause in enumerate(causes)}
+    people_shards = [{} for _ in range(shard_count)]
+    section_shards = [{} for _ in range(section_shard_count)]
+    index_people = []
+
+    for record in records:
+        qid = record['person'].split('/')[-1]
+        number = qid_number(record['person'])
+        index_people.append([number, cause_index[record['causeOfDeathLabel']]])
+        people_shards[number % shard_count][qid] = compact_record(record, images)
+        if sections and qid in sections:
+            section_shards[number % section_shard_count][qid] = sections[qid]
+
+    # Build next to the old bundle and swap, so a half-written bundle is never served
+    staging = output_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(os.path.join(staging, 'people'))
+    os.makedirs(os.path.join(staging, 'sections'))
+
+    for n, shard in enumerate(people_shards):
+        write_json(os.path.join(staging, 'people', f"{n}.json"), shard)
+    for n, shard in enumerate(section_shards):
+        write_json(os.path.join(staging, 'sections', f"{n}.json"), shard)
+    write_json(os.path.join(staging, 'index.json'), {
+        'version': BUNDLE_VERSION,
+        'generated': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'shardCount': shard_count,
+        'sectionShardCount': section_shard_count,
+        'causes': causes,
+        'people': index_people,
+    })
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(staging, output_dir)
+    return shard_count, section_shard_count
+
+def bundle_size(output_dir):
+    total = 0
+    for root, _, files in os.walk(output_dir):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the static people bundle the front end loads")
+    parser.add_argument('input', nargs='?', default='humans_enhanced_relevant.json')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_DIR)
+    parser.add_argument('--no-sections', action='store_true', help="Skip the Wikipedia article text")
+    parser.add_argument('--sections', help="Section store from wikipedia_sections.py, fetched first if "
+                                           "missing (default: <input>_sections.jsonl.gz)")
+    parser.add_argument('--no-images', action='store_true', help="Leave photos out of the cards")
+    parser.add_argument('--workers', type=int, default=4, help="Articles and image batches fetched concurrently")
+    parser.add_argument('--rate', type=float, default=10.0, help="Maximum Wikipedia/Commons requests per second")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="Persistent cache for sections and images")
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as f:
+        records = json.load(f)
+    print(f"Bundling {len(records)} people from {args.input}")
+
+    cache = EntityCache(args.cache)
+    session = make_session(pool_size=max(10, args.workers), rate=args.rate or None)
+
+    sections = None
+    if not args.no_sections:
+        store = args.sections or wikipedia_sections.store_path(args.input)
+        if not os.path.exists(store):
+            print(f"No section store at {store}, fetching articles with {args.workers} worker(s)...")
+            wikipedia_sections.build_store(records, store, session, cache, args.workers)
+        sections = {qid: entry['sections'] for qid, entry in wikipedia_sections.load_store(store).items()}
+
+    images = None
+    if not args.no_images:
+        filenames = [filename_from_photo(record.get('photo')) for record in records]
+        images = commons_images.resolve_images(filenames, session, cache, args.workers)
+    cache.close()
+
+    shard_count, section_shard_count = build_bundle(records, args.output, sections, images)
+    print(f"✅ Wrote {shard_count} people shards and {section_shard_count} section shards "
+          f"({bundle_size(args.output) / 1024:.0f} KB) to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import json
+import os
+
+class CheckpointLog:
+    """Append-only JSONL log of finished enrichment batches
+
+    Each line records the entity IDs of one completed batch and the records
+    it produced, so writing a checkpoint costs O(batch) and a crashed run can
+    pick up where it stopped. A torn final line (crash mid-write) is ignored.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.done_ids = set()
+        self.processed = {}
+        self.batches = 0
+
+        if resume and os.path.exists(path):
+            self._load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def _load(self):
+        good_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line) if line.endswith(b'\n') else None
+                except json.JSONDecodeError:
+                    entry = None
+                if entry is None:
+                    break
+                self.done_ids.update(entry['ids'])
+                self.processed.update(entry['processed'])
+                self.batches += 1
+                good_bytes += len(line)
+
+        # Drop a half-written trailing line so new entries start on a clean line
+        with open(self.path, 'r+b') as f:
+            f.truncate(good_bytes)
+
+    def record(self, batch, processed):
+        """Append one finished batch and make sure it reaches the disk"""
+        entry = {'ids': batch, 'processed': processed}
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done_ids.update(batch)
+        self.batches += 1
+
+    def close(self):
+        self.file.close()
@@ -1,27 +1,143 @@
+import argparse
+import csv
+import io
+import json
+import os
+
 import pandas as pd
 
-# Load the filtered CSV
-df = pd.read_csv("humans_filtered.csv")
+import fetch_causes_of_death
+
+CAUSES_FILE = "causes_of_death.txt"
+CAUSE_QIDS_FILE = "causes_of_death_qids.txt"
+CHUNK_SIZE = 250_000
+
+# Items used as a cause of death (P509) whose English label is one of the allowed ones
+RESOLVE_QUERY = """
+SELECT DISTINCT ?cause ?label
+WHERE {{
+  VALUES ?label {{ {labels} }}
+  ?cause rdfs:label ?label.
+  FILTER EXISTS {{ ?person wdt:P509 ?cause. }}
+}}
+"""
+
+def load_allowed_causes(path=CAUSES_FILE):
+    """Load allowed causes of death from the cleaned file"""
+    allowed_causes = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and " - " in line:
+                # Extract the cause of death (everything after " - ")
+                cause = line.split(" - ", 1)[1]
+                allowed_causes.append(cause)
+    return allowed_causes
+
+def load_cause_qids(path=CAUSE_QIDS_FILE):
+    """Load {QID: label} from the checked-in allowlist of cause QIDs"""
+    qids = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.startswith("#") or " - " not in line:
+                continue
+            qid, label = line.rstrip("\n").split(" - ", 1)
+            qids[qid] = label
+    return qids
+
+def resolve_cause_qids(labels, session=None):
+    """Return {QID: label} for every cause of death on Wikidata whose English label is in labels"""
+    values = " ".join(json.dumps(label, ensure_ascii=False) + "@en" for label in sorted(labels))
+    text = fetch_causes_of_death.run_query(RESOLVE_QUERY.format(labels=values), post=True, session=session)
+    return {row["cause"].rsplit("/", 1)[-1]: row["label"] for row in csv.DictReader(io.StringIO(text))}
+
+def save_cause_qids(qids, path=CAUSE_QIDS_FILE):
+    with open(path, "w") as f:
+        f.write("# QID - English label of each allowed cause of death, rebuilt with "
+                "`python clean_data_rough.py --resolve-qids`\n")
+        for qid, label in sorted(qids.items(), key=lambda item: int(item[0][1:])):
+            f.write(f"{qid} - {label}\n")
+
+class CauseAllowlist:
+    """Allowed causes of death, matched by QID
+
+    causes_of_death_qids.txt lists the QIDs of the causes named in
+    causes_of_death.txt, so a cause renamed on Wikidata keeps its people.
+    Only labels that have no QID in it yet are matched by label.
+    """
+
+    def __init__(self, causes_file=CAUSES_FILE, qids_file=CAUSE_QIDS_FILE):
+        allowed = set(load_allowed_causes(causes_file))
+        self.qids = load_cause_qids(qids_file) if qids_file and os.path.exists(qids_file) else {}
+        self.labels = allowed - set(self.qids.values())
+
+    def allows(self, cause_url, label):
+        return cause_url.rsplit("/", 1)[-1] in self.qids or label in self.labels
+
+    def mask(self, chunk):
+        """Vectorized allows() over a DataFrame chunk with category-typed cause columns"""
+        # Only the (few hundred) distinct categories need checking, not every row
+        causes = chunk["causeOfDeath"]
+        allowed = [url for url in causes.cat.categories if url.rsplit("/", 1)[-1] in self.qids]
+        return causes.isin(allowed) | chunk["causeOfDeathLabel"].isin(self.labels)
+
+def iter_allowed_rows(rows, allowlist):
+    """Stream only the rows whose cause of death is in the allowlist"""
+    for row in rows:
+        if allowlist.allows(row["causeOfDeath"], row["causeOfDeathLabel"]):
+            yield row
+
+def filter_csv(input_path, output_path, allowlist, chunk_size=CHUNK_SIZE):
+    """Filter the SPARQL CSV chunk by chunk into a JSON list, returning (rows read, rows kept)"""
+    total = kept = 0
+    dtypes = {"person": "string", "personLabel": "string",
+              "causeOfDeath": "category", "causeOfDeathLabel": "category"}
+
+    with open(output_path, "w") as f_out:
+        f_out.write("[")
+        for chunk in pd.read_csv(input_path, dtype=dtypes, chunksize=chunk_size):
+            total += len(chunk)
+            filtered = chunk[allowlist.mask(chunk)]
+            if filtered.empty:
+                continue
+
+            # Splice each chunk's records into one list with the same layout as before
+            body = filtered.to_json(orient="records", indent=2)
+            body = body.strip()[1:-1].strip("\n")
+            f_out.write(",\n" if kept else "\n")
+            f_out.write(body)
+            kept += len(filtered)
+        f_out.write("\n]" if kept else "]")
+
+    return total, kept
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep only people whose cause of death is in the allowlist")
+    parser.add_argument("--resolve-qids", action="store_true",
+                        help=f"Look up the QIDs of the causes in {CAUSES_FILE} and rewrite {CAUSE_QIDS_FILE}")
+    args = parser.parse_args()
+
+    if args.resolve_qids:
+        labels = set(load_allowed_causes())
+        qids = resolve_cause_qids(labels)
+        save_cause_qids(qids)
+        unresolved = labels - set(qids.values())
+        print(f"✅ Saved {len(qids)} cause QIDs to {CAUSE_QIDS_FILE}")
+        if unresolved:
+            print(f"  -> {len(unresolved)} labels matched no cause of death: {', '.join(sorted(unresolved)[:10])}...")
+        return
 
-# Load allowed causes of death from the cleaned file
-allowed_causes = []
-with open("causes_of_death.txt", "r") as f:
-    for line in f:
-        line = line.strip()
-        if line and " - " in line:
-            # Extract the cause of death (everything after " - ")
-            cause = line.split(" - ", 1)[1]
-            allowed_causes.append(cause)
+    allowlist = CauseAllowlist()
 
-print(f"📋 Loaded {len(allowed_causes)} allowed causes of death")
+    print(f"📋 Loaded {len(allowlist.qids)} allowed cause QIDs ({len(allowlist.labels)} causes still matched by label)")
 
-# Filter to only include people who died from causes in our allowlist
-filtered_df = df[df["causeOfDeathLabel"].isin(allowed_causes)]
+    # Filter to only include people who died from causes in our allowlist
+    total, kept = filter_csv("humans_filtered.csv", "humans_filtered_cleaned.json", allowlist)
 
-print(f"🔍 Found {len(filtered_df)} people with interesting causes of death")
-print(f"📉 Filtered out {len(df) - len(filtered_df)} people with boring medical causes")
+    print(f"🔍 Found {kept} people with interesting causes of death")
+    print(f"📉 Filtered out {total - kept} people with boring medical causes")
 
-# Export to JSON
-filtered_df.to_json("humans_filtered_cleaned.json", orient="records", indent=2)
+    print(f"✅ Filtered dataset saved to JSON with {kept} people")
 
-print(f"✅ Filtered dataset saved to JSON with {len(filtered_df)} people")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+import zlib
+from array import array
+
+# Compact column-oriented export of the enriched people dataset.
+#
+# File layout: MAGIC, a 4-byte little-endian header length, a JSON header
+# describing every column, then one zlib-compressed payload per column.
+# Columns can be decoded independently, and any value the typed encoding
+# cannot reproduce exactly is kept verbatim in the header's overrides, so
+# load_records() always gives back the original JSON records.
+
+MAGIC = b'WGCOL1\n'
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/Q'
+COMMONS_PREFIX = 'https://commons.wikimedia.org/wiki/File:'
+WIKIPEDIA_PREFIX = 'https://en.wikipedia.org/wiki/'
+
+# Column kinds for the fields process_entity_data produces; anything else
+# falls back to a dictionary-encoded column
+SCHEMA = {
+    'person': ('entity', None),
+    'personLabel': ('text', None),
+    'birthDate': ('date', None),
+    'deathDate': ('date', None),
+    'gender': ('dict', None),
+    'photo': ('text', COMMONS_PREFIX),
+    'coords': ('point', None),
+    'placeOfBirth': ('dict', None),
+    'placeOfDeath': ('dict', None),
+    'citizenship': ('dict_list', None),
+    'occupation': ('dict_list', None),
+    'article': ('text', WIKIPEDIA_PREFIX),
+    'causeOfDeath': ('entity', None),
+    'causeOfDeathLabel': ('dict', None),
+}
+
+DATE_RE = re.compile(r'([+-])(\d{4,})-(\d\d)-(\d\d)T00:00:00Z')
+POINT_RE = re.compile(r'Point\((\S+) (\S+)\)')
+_ABSENT = object()
+
+def format_date(year, month, day):
+    sign = '-' if year < 0 else '+'
+    return f"{sign}{abs(year):04d}-{month:02d}-{day:02d}T00:00:00Z"
+
+def parse_date(value):
+    """Split a Wikidata time string into (year, month, day), or None if it isn't a plain date"""
+    match = DATE_RE.fullmatch(value) if isinstance(value, str) else None
+    if not match:
+        return None
+    year = int(match.group(2)) * (-1 if match.group(1) == '-' else 1)
+    date = (year, int(match.group(3)), int(match.group(4)))
+    return date if format_date(*date) == value else None
+
+def _pack_strings(strings):
+    """Encode strings as an offsets array plus one UTF-8 blob"""
+    blobs = [s.encode('utf-8') for s in strings]
+    offsets = array('I', [0])
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return offsets.tobytes() + b''.join(blobs), len(offsets)
+
+def _unpack_strings(payload, count):
+    offsets = array('I')
+    offsets.frombytes(payload[:count * offsets.itemsize])
+    data = payload[count * offsets.itemsize:]
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(count - 1)]
+
+def _codes_array(count):
+    return array('H') if count <= 0xFFFF else array('I')
+
+class _Dictionary:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        key = json.dumps(value, ensure_ascii=False)
+        if key not in self.codes:
+            self.codes[key] = len(self.values)
+            self.values.append(value)
+        return self.codes[key]
+
+def encode_column(name, values):
+    """Encode one column, returning (header entry, raw payload bytes)"""
+    kind, prefix = SCHEMA.get(name, ('dict', None))
+    header = {'name': name, 'kind': kind, 'rows': len(values), 'overrides': {}, 'absent': []}
+    if prefix:
+        header['prefix'] = prefix
+
+    def override(row, value):
+        if value is _ABSENT:
+            header['absent'].append(row)
+        else:
+            header['overrides'][str(row)] = value
+
+    if kind == 'entity':
+        ids = array('Q')
+        for row, value in enumerate(values):
+            qid = value[len(ENTITY_PREFIX):] if isinstance(value, str) and value.startswith(ENTITY_PREFIX) else ''
+            if qid.isdigit() and f"{ENTITY_PREFIX}{int(qid)}" == value:
+                ids.append(int(qid))
+            else:
+                ids.append(0)
+                override(row, value)
+        payload = ids.tobytes()
+
+    elif kind == 'text':
+        strings = []
+        for row, value in enumerate(values):
+            if isinstance(value, str) and (not prefix or value.startswith(prefix)):
+                strings.append(value[len(prefix):] if prefix else value)
+            elif value == '':
+                strings.append('')
+            else:
+                strings.append('')
+                override(row, value)
+        payload, header['offsets'] = _pack_strings(strings)
+        # An empty stored string means '' (no prefix) for prefixed columns
+        if prefix:
+            for row, value in enumerate(values):
+                if value == prefix:
+                    override(row, value)
+
+    elif kind == 'date':
+        years, months, days = array('i'), array('b'), array('b')
+        for row, value in enumerate(values):
+            date = parse_date(value)
+            if date is None:
+                date = (0, 0, 0)
+                override(row, value)
+            years.append(date[0])
+            months.append(date[1])
+            days.append(date[2])
+        payload = years.tobytes() + months.tobytes() + days.tobytes()
+
+    elif kind == 'point':
+        coords = array('d')
+        for row, value in enumerate(values):
+            match = POINT_RE.fullmatch(value) if isinstance(value, str) else None
+            if match and f"Point({float(match.group(1))} {float(match.group(2))})" == value:
+                coords.extend((float(match.group(1)), float(match.group(2))))
+            else:
+                coords.extend((math.nan, math.nan))
+                if value is not None:
+                    override(row, value)
+        payload = coords.tobytes()
+
+    elif kind == 'dict_list':
+        dictionary = _Dictionary()
+        offsets, codes = array('I', [0]), []
+        for row, value in enumerate(values):
+            if isinstance(value, str):
+                items = value.split('|') if value else []
+                codes.extend(dictionary.code(item) for item in items)
+            else:
+                override(row, value)
+            offsets.append(len(codes))
+        code_array = _codes_array(len(dictionary.values))
+        code_array.extend(codes)
+        header.update(dictionary=dictionary.values, typecode=code_array.typecode, offsets=len(offsets))
+        payload = offsets.tobytes() + code_array.tobytes()
+
+    else:
+        dictionary = _Dictionary()
+        codes = [dictionary.code(None if value is _ABSENT else value) for value in values]
+        for row, value in enumerate(values):
+            if value is _ABSENT:
+                override(row, value)
+        code_array = _codes_array(len(dictionary.values))
+        code_array.extend(codes)
+        header.update(dictionary=dictionary.values, typecode=code_array.typecode)
+        payload = code_array.tobytes()
+
+    return header, payload
+
+def decode_column(header, payload):
+    """Decode a column back into a list of the original Python values"""
+    kind, rows, prefix = header['kind'], header['rows'], header.get('prefix', '')
+
+    if kind == 'entity':
+        ids = array('Q')
+        ids.frombytes(payload)
+        values = [f"{ENTITY_PREFIX}{qid}" for qid in ids]
+
+    elif kind == 'text':
+        strings = _unpack_strings(payload, header['offsets'])
+        values = [prefix + s if s and prefix else s for s in strings]
+
+    elif kind == 'date':
+        years, months, days = array('i'), array('b'), array('b')
+        years.frombytes(payload[:rows * years.itemsize])
+        months.frombytes(payload[rows * years.itemsize:rows * (years.itemsize + 1)])
+        days.frombytes(payload[rows * (years.itemsize + 1):])
+        values = [format_date(y, m, d) for y, m, d in zip(years, months, days)]
+
+    elif kind == 'point':
+        coords = array('d')
+        coords.frombytes(payload)
+        values = [
+            None if math.isnan(coords[i]) else f"Point({coords[i]} {coords[i + 1]})"
+            for i in range(0, len(coords), 2)
+        ]
+
+    elif kind == 'dict_list':
+        offsets, codes = array('I'), array(header['typecode'])
+        split = header['offsets'] * offsets.itemsize
+        offsets.frombytes(payload[:split])
+        codes.frombytes(payload[split:])
+        dictionary = header['dictionary']
+        values = ['|'.join(dictionary[c] for c in codes[offsets[i]:offsets[i + 1]]) for i in range(rows)]
+
+    else:
+        codes = array(header['typecode'])
+        codes.frombytes(payload)
+        dictionary = header['dictionary']
+        values = [dictionary[c] for c in codes]
+
+    for row, value in header['overrides'].items():
+        values[int(row)] = value
+    for row in header['absent']:
+        values[row] = _ABSENT
+    return values
+
+def write_columnar(records, path):
+    """Write enriched person records to a columnar file"""
+    names = list(dict.fromkeys(name for record in records for name in record))
+    headers, payloads = [], []
+    offset = 0
+    for name in names:
+        header, payload = encode_column(name, [record.get(name, _ABSENT) for record in records])
+        compressed = zlib.compress(payload, 9)
+        header.update(offset=offset, length=len(compressed))
+        offset += len(compressed)
+        headers.append(header)
+        payloads.append(compressed)
+
+    header_bytes = json.dumps({'rows': len(records), 'byteorder': sys.byteorder, 'columns': headers},
+                              ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, 'little'))
+        f.write(header_bytes)
+        for payload in payloads:
+            f.write(payload)
+
+def load_columns(path, names=None):
+    """Load the requested columns (all by default) as {name: list of values}"""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a columnar people file")
+        header = json.loads(f.read(int.from_bytes(f.read(4), 'little')))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written on a {header['byteorder']}-endian machine")
+        start = f.tell()
+
+        columns = {}
+        for column in header['columns']:
+            if names is not None and column['name'] not in names:
+                continue
+            f.seek(start + column['offset'])
+            columns[column['name']] = decode_column(column, zlib.decompress(f.read(column['length'])))
+    return columns
+
+def load_records(path):
+    """Load the file back into the list of dicts it was written from"""
+    columns = load_columns(path)
+    rows = len(next(iter(columns.values()))) if columns else 0
+    return [
+        {name: values[row] for name, values in columns.items() if values[row] is not _ABSENT}
+        for row in range(rows)
+    ]
+
+def compare(json_path, output_path):
+    """Print size and load-time numbers for the JSON file against its columnar copy"""
+    with open(json_path, 'r') as f:
+        records = json.load(f)
+    write_columnar(records, output_path)
+
+    start = time.perf_counter()
+    with open(json_path, 'r') as f:
+        json.load(f)
+    json_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = load_records(output_path)
+    columnar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    load_columns(output_path, ['causeOfDeathLabel', 'birthDate'])
+    partial_seconds = time.perf_counter() - start
+
+    json_size = os.path.getsize(json_path)
+    columnar_size = os.path.getsize(output_path)
+    print(f"Records: {len(records)} (round trip {'ok' if loaded == records else 'MISMATCH'})")
+    print(f"- JSON: {json_size / 1024:.0f} KB, loads in {json_seconds * 1000:.1f} ms")
+    print(f"- Columnar: {columnar_size / 1024:.0f} KB ({columnar_size / json_size:.1%}), "
+          f"full load {columnar_seconds * 1000:.1f} ms, 2 columns {partial_seconds * 1000:.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert enriched people JSON to the compact columnar format")
+    parser.add_argument('input', help="Enriched JSON list (e.g. humans_enhanced_relevant.json)")
+    parser.add_argument('output', nargs='?', help="Defaults to the input name with a .wgcol extension")
+    parser.add_argument('--compare', action='store_true', help="Report size and load time against the JSON")
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.input)[0] + '.wgcol'
+    if args.compare:
+        compare(args.input, output)
+        return
+
+    with open(args.input, 'r') as f:
+        records = json.load(f)
+    write_columnar(records, output)
+    print(f"✅ Wrote {len(records)} records to {output}")
+
+if __name__ == "__main__":
+    main()
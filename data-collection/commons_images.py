@@ -0,0 +1,159 @@
+import argparse
+import json
+import re
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from columnar import COMMONS_PREFIX
+from entity_cache import DEFAULT_CACHE_PATH, EntityCache
+from http_client import get_json, make_session
+import instrumentation
+from instrumentation import metrics
+from wikipedia_sections import load_records
+
+# Direct image URLs for the P18 photos. get_full_image_url stores the Commons
+# File: page, which is HTML, so here each distinct file is looked up once with
+# prop=imageinfo (50 per request) and turned into thumbnail URLs at fixed
+# widths plus the original's dimensions and MIME type:
+#
+#   {"url": original, "width": 2000, "height": 3000, "mime": "image/jpeg",
+#    "thumbs": {"250": url, "500": url, ...}}
+#
+# Results are cached as "image_<File name>"; files that don't exist cache as None.
+
+COMMONS_API_URL = "https://commons.wikimedia.org/w/api.php"
+MAX_TITLES_PER_REQUEST = 50  # action=query limit for non-bot clients
+# Wikimedia's standard thumbnail widths, which its CDN keeps pre-rendered
+THUMBNAIL_WIDTHS = (250, 330, 500, 960, 1280)
+# Formats a browser shows as they are, so a thumbnail is never wider than the original
+WEB_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+# The width in the last path segment of a thumbnail URL: 250px-X.jpg, page1-250px-X.pdf.jpg, ...
+THUMB_WIDTH_RE = re.compile(r'(^|-)\d+px-')
+
+_MISSING = object()
+
+def normalize_filename(name):
+    """Commons file name the way the API titles it: no File: prefix, spaces, capital first letter"""
+    name = urllib.parse.unquote(name) if '%' in name else name
+    if name.startswith('File:'):
+        name = name[len('File:'):]
+    name = ' '.join(name.replace('_', ' ').split())
+    return name[:1].upper() + name[1:]
+
+def filename_from_photo(photo_url):
+    """File name from the File: page URL get_full_image_url builds"""
+    if not photo_url or not photo_url.startswith(COMMONS_PREFIX):
+        return None
+    return normalize_filename(photo_url[len(COMMONS_PREFIX):])
+
+def thumbnail_at(thumb_url, width):
+    """The same thumbnail URL rendered at another width"""
+    base, _, name = thumb_url.rpartition('/')
+    return f"{base}/{THUMB_WIDTH_RE.sub(lambda m: f'{m.group(1)}{width}px-', name, count=1)}"
+
+def image_info(info, widths=THUMBNAIL_WIDTHS):
+    """Turn one imageinfo entry (requested at the smallest width) into our image record"""
+    image = {'url': info['url'], 'width': info.get('width'), 'height': info.get('height'),
+             'mime': info.get('mime', ''), 'thumbs': {}}
+    thumb = info.get('thumburl')
+    scalable = thumb and thumb != info['url'] and THUMB_WIDTH_RE.search(thumb.rpartition('/')[2])
+    for width in widths:
+        if scalable and not (image['mime'] in WEB_MIME_TYPES and width >= (image['width'] or 0)):
+            image['thumbs'][str(width)] = thumbnail_at(thumb, width)
+        elif image['mime'] in WEB_MIME_TYPES:
+            image['thumbs'][str(width)] = info['url']  # original is already small enough
+    return image
+
+@metrics.stage('images')
+def fetch_image_batch(filenames, session, widths=THUMBNAIL_WIDTHS):
+    """Return {file name: image record or None} for up to 50 files in one request"""
+    params = {
+        'action': 'query',
+        'titles': '|'.join(f"File:{name}" for name in filenames),
+        'prop': 'imageinfo',
+        'iiprop': 'url|size|mime',
+        'iiurlwidth': min(widths),
+        'redirects': 1,
+        'format': 'json',
+        'formatversion': 2,
+    }
+    query = get_json(session, COMMONS_API_URL, params, timeout=30).get('query', {})
+
+    renamed = {entry['from']: entry['to'] for entry in query.get('normalized', [])}
+    redirects = {entry['from']: entry['to'] for entry in query.get('redirects', [])}
+    pages = {page['title']: page for page in query.get('pages', [])}
+
+    images = {}
+    for name in filenames:
+        title = renamed.get(f"File:{name}", f"File:{name}")
+        title = redirects.get(title, title)
+        info = pages.get(title, {}).get('imageinfo')
+        images[name] = image_info(info[0], widths) if info else None
+    return images
+
+def resolve_images(filenames, session, cache=None, workers=4, widths=THUMBNAIL_WIDTHS):
+    """Return {file name: image record or None}, looking each distinct file up at most once
+
+    People sharing a photo share the lookup; batches of up to 50 uncached
+    files are fetched by at most `workers` threads.
+    """
+    images = {}
+    missing = []
+    for name in dict.fromkeys(name for name in filenames if name):
+        cached = cache.get(f"image_{name}", _MISSING) if cache is not None else _MISSING
+        if cached is _MISSING:
+            missing.append(name)
+        else:
+            images[name] = cached
+
+    batches = [missing[i:i + MAX_TITLES_PER_REQUEST] for i in range(0, len(missing), MAX_TITLES_PER_REQUEST)]
+    print(f"Resolving {len(missing)} images in {len(batches)} requests ({len(images)} cached)...")
+
+    def fetch(batch):
+        try:
+            return fetch_image_batch(batch, session, widths)
+        except requests.exceptions.RequestException as e:
+            print(f"  -> Skipping {len(batch)} images: {e}")
+            return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for resolved in executor.map(fetch, batches):
+            for name, image in resolved.items():
+                images[name] = image
+                if cache is not None:
+                    cache[f"image_{name}"] = image
+    return images
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve P18 photos to direct Commons thumbnail URLs")
+    parser.add_argument('input', nargs='?', default='humans_enhanced_relevant.json',
+                        help="Enriched records (.json list or .jsonl)")
+    parser.add_argument('--output', default='images.json', help="Where to write {file name: image}")
+    parser.add_argument('--workers', type=int, default=4, help="Batches fetched concurrently")
+    parser.add_argument('--rate', type=float, default=10.0, help="Maximum Commons requests per second")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="Persistent cache for image lookups")
+    parser.add_argument('--no-cache', action='store_true')
+    instrumentation.add_arguments(parser, 'images_run_report.json')
+    args = parser.parse_args()
+
+    records = load_records(args.input)
+    filenames = [filename_from_photo(record.get('photo')) for record in records]
+    print(f"{sum(1 for name in filenames if name)} photos for {len(records)} people in {args.input}")
+
+    with instrumentation.instrumented_run(args.report, args.profile_path if args.profile else None):
+        cache = None if args.no_cache else EntityCache(args.cache)
+        session = make_session(pool_size=max(10, args.workers), rate=args.rate or None)
+        images = resolve_images(filenames, session, cache, args.workers)
+        if cache is not None:
+            cache.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(images, f, ensure_ascii=False, indent=2)
+    found = sum(1 for image in images.values() if image)
+    print(f"✅ Resolved {found} of {len(images)} distinct images to {args.output}")
+
+if __name__ == "__main__":
+    main()
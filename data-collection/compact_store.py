@@ -0,0 +1,300 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+
+import fetch_enhanced_production as enrich
+from columnar import ENTITY_PREFIX
+
+# Compaction of enrichment outputs into one canonical people store. Progress
+# snapshots (humans_enhanced_progress_<n>.json), final outputs, JSONL
+# records, checkpoint logs and work_queue.py shards are all read as streams
+# and deduplicated by QID, the newest record winning:
+#
+#   - between two records that both carry a lastrevid, the higher one
+#   - otherwise the one from the later input (inputs are oldest first)
+#
+# Checkpoint and shard lines hold people as enriched, before the merge that
+# writes the outputs, so they are finished the same way first: irrelevant
+# people are dropped and the cause of death from humans_filtered_cleaned.json
+# is added.
+#
+# File layout: MAGIC, then zlib-compressed blocks of BLOCK_SIZE records (one
+# JSON object per line) in QID order, then the index: a JSON header, the
+# sorted QID numbers and the byte offset of every block, compressed. The
+# last 8 bytes give the index offset, so a lookup is one binary search and
+# one block decompression.
+
+MAGIC = b'WGSTORE1\n'
+DEFAULT_STORE_PATH = 'humans_enhanced_store.wgstore'
+BLOCK_SIZE = 64  # records per compressed block: bigger compresses better, smaller reads less per lookup
+SNAPSHOT_RE = re.compile(r'_(\d+)\.json')
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+def iter_json_list(f, chunk_size=1 << 20):
+    """Yield the items of a top-level JSON list of objects without reading the whole file"""
+    decoder = json.JSONDecoder()
+    buffer = f.read(chunk_size).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError(f"{getattr(f, 'name', 'input')} is not a JSON list")
+    pos = 1
+    while True:
+        # Skip whitespace and commas, refilling as needed, up to the next item or the closing bracket
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer):
+                break
+            buffer, pos = f.read(chunk_size), 0
+            if not buffer:
+                raise ValueError("JSON list ends without a closing bracket")
+        if buffer[pos] == ']':
+            return
+
+        while True:
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+                break
+            except json.JSONDecodeError:
+                # The item runs past the buffer (an object can't end early), so read on
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+        yield item
+
+def finish_processed(cause_of_death_map):
+    """finish(QID, record) for checkpoint and shard records: the output record, or None for an irrelevant person"""
+    def finish(entity_id, record):
+        relevant = enrich.select_relevant({entity_id: record}, cause_of_death_map)
+        return relevant[0] if relevant else None
+    return finish
+
+def iter_jsonl(f, finish=None):
+    """Yield records from JSONL, unpacking checkpoint and shard lines into their finished processed records"""
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            if line.endswith('\n'):
+                raise
+            return  # torn last line of a log that was being written
+        if 'processed' in entry:
+            if finish is None:
+                raise ValueError(f"{getattr(f, 'name', 'input')} holds checkpoint or shard lines, "
+                                 "which need the cause of death list")
+            for entity_id, record in entry['processed'].items():
+                record = finish(entity_id, record)
+                if record is not None:
+                    yield record
+        else:
+            yield entry
+
+def iter_records(path, finish=None):
+    """Every person record in one snapshot, output or log, as a stream"""
+    with open_text(path) as f:
+        if path.endswith('.jsonl') or path.endswith('.jsonl.gz'):
+            yield from iter_jsonl(f, finish)
+        else:
+            yield from iter_json_list(f)
+
+def qid_number(person_url):
+    return int(person_url[len(ENTITY_PREFIX):])
+
+def snapshot_order(path):
+    """Sort key putting humans_enhanced_progress_100.json before _700.json"""
+    match = SNAPSHOT_RE.search(os.path.basename(path))
+    return (int(match.group(1)) if match else 0, path)
+
+def collect_newest(paths, finish=None):
+    """Return ({QID number: (lastrevid, record as JSON bytes)}, records read), newest record per QID
+
+    Only the winning copy of each person is held, already serialized, so
+    memory grows with the number of distinct people, not with the inputs.
+    `finish` (from finish_processed) is applied to checkpoint and shard records.
+    """
+    newest = {}
+    read = 0
+    for path in paths:
+        for record in iter_records(path, finish):
+            read += 1
+            number = qid_number(record['person'])
+            revision = record.get('lastrevid')
+            current = newest.get(number)
+            # Later inputs are newer unless both copies say otherwise by revision
+            if current is not None and revision is not None and current[0] is not None and revision < current[0]:
+                continue
+            newest[number] = (revision, json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    return newest, read
+
+def write_store(newest, path, block_size=BLOCK_SIZE):
+    """Write {QID number: (_, JSON bytes)} as a QID-sorted store, returning its size in bytes"""
+    qids = array('I', sorted(newest))
+    offsets = array('Q')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(MAGIC)
+        for start in range(0, len(qids), block_size):
+            offsets.append(f.tell())
+            block = b'\n'.join(newest[qid][1] for qid in qids[start:start + block_size])
+            f.write(zlib.compress(block, 9))
+        offsets.append(f.tell())  # end of the last block
+
+        index_offset = f.tell()
+        header = json.dumps({'records': len(qids), 'blockSize': block_size, 'byteorder': sys.byteorder}).encode()
+        f.write(len(header).to_bytes(4, 'little'))
+        f.write(header)
+        f.write(zlib.compress(qids.tobytes() + offsets.tobytes(), 9))
+        f.write(index_offset.to_bytes(8, 'little'))
+        size = f.tell()
+    os.replace(path + '.tmp', path)
+    return size
+
+class CompactStore:
+    """Random access by QID into a store written by write_store"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a compacted people store")
+        self.file.seek(-8, os.SEEK_END)
+        end = self.file.tell()
+        index_offset = int.from_bytes(self.file.read(8), 'little')
+        self.file.seek(index_offset)
+        header = json.loads(self.file.read(int.from_bytes(self.file.read(4), 'little')))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError(f"{path} was written on a {header['byteorder']}-endian machine")
+
+        index = zlib.decompress(self.file.read(end - self.file.tell()))
+        self.block_size = header['blockSize']
+        self.qids = array('I')
+        self.qids.frombytes(index[:header['records'] * self.qids.itemsize])
+        self.offsets = array('Q')
+        self.offsets.frombytes(index[header['records'] * self.qids.itemsize:])
+        self._block_number = None
+        self._block = None
+
+    def __len__(self):
+        return len(self.qids)
+
+    def _row(self, qid):
+        number = int(qid[1:]) if isinstance(qid, str) else qid
+        row = bisect_left(self.qids, number)
+        return row if row < len(self.qids) and self.qids[row] == number else None
+
+    def __contains__(self, qid):
+        return self._row(qid) is not None
+
+    def _read_block(self, block_number):
+        """Lines of one block, keeping the last one decompressed for neighbouring lookups"""
+        if block_number != self._block_number:
+            start, end = self.offsets[block_number], self.offsets[block_number + 1]
+            self.file.seek(start)
+            self._block = zlib.decompress(self.file.read(end - start)).split(b'\n')
+            self._block_number = block_number
+        return self._block
+
+    def get(self, qid, default=None):
+        """The record for "Q42" (or 42), or `default` if the store doesn't have it"""
+        row = self._row(qid)
+        if row is None:
+            return default
+        return json.loads(self._read_block(row // self.block_size)[row % self.block_size])
+
+    def __iter__(self):
+        """Every record in QID order, one block in memory at a time"""
+        for block_number in range(len(self.offsets) - 1):
+            for line in self._read_block(block_number):
+                yield json.loads(line)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def measure_lookups(path, count=1000, seed=0):
+    """Mean and 99th percentile seconds of random lookups on a freshly opened store"""
+    start = time.perf_counter()
+    store = CompactStore(path)
+    open_seconds = time.perf_counter() - start
+
+    rng = random.Random(seed)
+    qids = [f"Q{rng.choice(store.qids)}" for _ in range(count)] if len(store) else []
+    timings = []
+    for qid in qids:
+        start = time.perf_counter()
+        store.get(qid)
+        timings.append(time.perf_counter() - start)
+    store.close()
+
+    timings.sort()
+    mean = sum(timings) / len(timings) if timings else 0
+    p99 = timings[int(len(timings) * 0.99)] if timings else 0
+    return open_seconds, mean, p99
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge enrichment snapshots and logs into one deduplicated store")
+    parser.add_argument('inputs', nargs='*',
+                        help="Snapshots, outputs (.json), records or logs (.jsonl), oldest first "
+                             "(default: every humans_enhanced_progress_*.json)")
+    parser.add_argument('--output', default=DEFAULT_STORE_PATH)
+    parser.add_argument('--causes', default='humans_filtered_cleaned.json',
+                        help="Cause of death list the checkpoint and shard records are finished with")
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE, help="Records per compressed block")
+    parser.add_argument('--lookups', type=int, default=1000, help="Random lookups timed for the report")
+    parser.add_argument('--get', metavar='QID', help="Just print one person from an existing store")
+    args = parser.parse_args()
+
+    if args.get:
+        with CompactStore(args.output) as store:
+            record = store.get(args.get)
+        print(json.dumps(record, ensure_ascii=False, indent=2) if record else f"❌ {args.get} is not in {args.output}")
+        return
+
+    inputs = args.inputs or sorted(glob.glob('humans_enhanced_progress_*.json'), key=snapshot_order)
+    if not inputs:
+        print("❌ No inputs given and no humans_enhanced_progress_*.json snapshots found")
+        sys.exit(1)
+    input_bytes = sum(os.path.getsize(path) for path in inputs)
+    print(f"Compacting {len(inputs)} files ({input_bytes / 1024 / 1024:.1f} MB)...")
+
+    finish = None
+    if any(path.endswith('.jsonl') or path.endswith('.jsonl.gz') for path in inputs):
+        if not os.path.exists(args.causes):
+            print(f"❌ {args.causes} not found, it is needed to finish checkpoint and shard records")
+            sys.exit(1)
+        with open(args.causes, 'r') as f:
+            _, cause_of_death_map = enrich.map_causes_of_death(json.load(f))
+        finish = finish_processed(cause_of_death_map)
+
+    start = time.perf_counter()
+    newest, read = collect_newest(inputs, finish)
+    size = write_store(newest, args.output, args.block_size)
+    elapsed = time.perf_counter() - start
+    open_seconds, mean, p99 = measure_lookups(args.output, args.lookups)
+
+    print(f"✅ Wrote {len(newest)} people to {args.output} in {elapsed:.1f}s")
+    print(f"  -> {read} records read, {read - len(newest)} duplicates dropped")
+    print(f"  -> {input_bytes / 1024:.0f} KB -> {size / 1024:.0f} KB ({1 - size / input_bytes:.1%} smaller)")
+    print(f"  -> Open {open_seconds * 1000:.2f} ms, lookup mean {mean * 1_000_000:.0f} µs, "
+          f"p99 {p99 * 1_000_000:.0f} µs over {args.lookups} random QIDs")
+
+if __name__ == "__main__":
+    main()
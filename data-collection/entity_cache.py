@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = 'entity_cache.sqlite'
+DEFAULT_TTL = 30 * 24 * 3600  # Labels and places rarely change, a month is plenty
+DEFAULT_MAX_ENTRIES = 1_000_000
+WRITE_BATCH = 1000  # buffered writes per transaction
+BUSY_TIMEOUT = 60   # seconds to wait for another process's write transaction
+
+_MISSING = object()
+
+def split_key(key):
+    """Split a label_cache key like "place_Q90" into (kind, qid); bare QIDs are labels"""
+    kind, sep, qid = key.rpartition('_')
+    return (kind, qid) if sep else ('label', key)
+
+class EntityCache:
+    """SQLite-backed replacement for the label_cache dict that survives between runs
+
+    Entries are keyed by (kind, QID), expire after `ttl` seconds and the least
+    recently used ones are evicted once the cache grows past `max_entries`.
+    Supports the handful of dict operations fetch_enhanced_production uses.
+
+    Writes and access times are buffered in memory and written in one short
+    transaction every WRITE_BATCH writes or on flush(), so several processes
+    can share the file: no write lock is held between flushes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                kind TEXT NOT NULL,
+                qid TEXT NOT NULL,
+                value TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (kind, qid)
+            )
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)')
+        self.conn.commit()
+        self._written = {}   # (kind, qid) -> value as JSON, not yet in the database
+        self._accessed = {}  # (kind, qid) -> time of the last hit, not yet in the database
+
+    def _lookup(self, key):
+        kind, qid = split_key(key)
+        with self.lock:
+            if (kind, qid) in self._written:
+                return json.loads(self._written[(kind, qid)])
+            row = self.conn.execute(
+                'SELECT value, fetched_at FROM entries WHERE kind = ? AND qid = ?', (kind, qid)
+            ).fetchone()
+            if row is None:
+                return _MISSING
+            now = time.time()
+            if self.ttl and now - row[1] > self.ttl:
+                return _MISSING
+            self._accessed[(kind, qid)] = now
+            self._note_write()
+        return json.loads(row[0])
+
+    def _note_write(self):
+        if len(self._written) + len(self._accessed) >= WRITE_BATCH:
+            self._write_buffered()
+
+    def _write_buffered(self):
+        """Write the buffered entries and access times in one transaction (caller holds the lock)"""
+        if not self._written and not self._accessed:
+            return
+        now = time.time()
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO entries (kind, qid, value, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+            [(kind, qid, value, now, now) for (kind, qid), value in self._written.items()]
+        )
+        self.conn.executemany(
+            'UPDATE entries SET accessed_at = ? WHERE kind = ? AND qid = ?',
+            [(accessed_at, kind, qid) for (kind, qid), accessed_at in self._accessed.items()]
+        )
+        self._evict()
+        self.conn.commit()
+        self._written.clear()
+        self._accessed.clear()
+
+    def _evict(self):
+        count = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if self.max_entries and count > self.max_entries:
+            self.conn.execute(
+                'DELETE FROM entries WHERE rowid IN '
+                '(SELECT rowid FROM entries ORDER BY accessed_at LIMIT ?)',
+                (count - self.max_entries,)
+            )
+
+    def __contains__(self, key):
+        return self._lookup(key) is not _MISSING
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __setitem__(self, key, value):
+        kind, qid = split_key(key)
+        with self.lock:
+            self._written[(kind, qid)] = json.dumps(value, ensure_ascii=False)
+            self._accessed.pop((kind, qid), None)
+            self._note_write()
+
+    def setdefault(self, key, default=None):
+        value = self._lookup(key)
+        if value is _MISSING:
+            self[key] = default
+            return default
+        return value
+
+    def __len__(self):
+        with self.lock:
+            self._write_buffered()
+            return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self):
+        with self.lock:
+            self._written.clear()
+            self._accessed.clear()
+            self.conn.execute('DELETE FROM entries')
+            self.conn.commit()
+
+    def prune(self):
+        """Drop expired entries and enforce the size cap, returning how many rows were removed"""
+        with self.lock:
+            self._write_buffered()
+            before = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            if self.ttl:
+                self.conn.execute('DELETE FROM entries WHERE fetched_at < ?', (time.time() - self.ttl,))
+            self._evict()
+            self.conn.commit()
+            after = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        self.conn.execute('VACUUM')
+        return before - after
+
+    def stats(self):
+        """Summarize entries per kind, including how many have expired"""
+        cutoff = time.time() - self.ttl if self.ttl else 0
+        with self.lock:
+            self._write_buffered()
+            rows = self.conn.execute(
+                'SELECT kind, COUNT(*), SUM(value = \'null\' OR value = \'""\'), SUM(fetched_at < ?) '
+                'FROM entries GROUP BY kind ORDER BY kind', (cutoff,)
+            ).fetchall()
+        return {kind: {'entries': n, 'empty': empty, 'expired': expired} for kind, n, empty, expired in rows}
+
+    def flush(self):
+        with self.lock:
+            self._write_buffered()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+def warm(cache, input_file, rate):
+    """Resolve every label and place referenced by the people in input_file"""
+    import fetch_enhanced_production as enrich
+    from http_client import TransientError, make_session
+    from instrumentation import CountingCache
+
+    with open(input_file, 'r') as f:
+        entity_ids = [enrich.extract_entity_id(item['person']) for item in json.load(f)]
+
+    enrich.label_cache = CountingCache(cache)
+    session = make_session(rate=rate or None)
+    batch_size = 25
+    total_batches = (len(entity_ids) + batch_size - 1) // batch_size
+
+    for i in range(0, len(entity_ids), batch_size):
+        print(f"Warming batch {i // batch_size + 1}/{total_batches}")
+        entity_data = enrich.fetch_entity_data(entity_ids[i:i + batch_size], batch_size, session)
+        if entity_data:
+            people = [enrich.extract_person_claims(entity_id, data)
+                      for entity_id, data in entity_data.get('entities', {}).items() if 'missing' not in data]
+            try:
+                enrich.prefetch_referenced_entities(people, session)
+            except TransientError as e:
+                # Nothing was cached for what failed, so a later warm or run fetches it
+                print(f"  -> Skipping the rest of this batch: {e}")
+    cache.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and maintain the persistent Wikidata entity cache")
+    parser.add_argument('--db', default=DEFAULT_CACHE_PATH, help="Cache database path")
+    parser.add_argument('--ttl', type=float, default=DEFAULT_TTL, help="Entry lifetime in seconds")
+    parser.add_argument('--max-entries', type=int, default=DEFAULT_MAX_ENTRIES)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('inspect', help="Show entry counts per kind")
+    subparsers.add_parser('prune', help="Remove expired entries and enforce the size cap")
+    warm_parser = subparsers.add_parser('warm', help="Prefetch labels and places for an input file")
+    warm_parser.add_argument('input', nargs='?', default='humans_filtered_cleaned.json')
+    warm_parser.add_argument('--rate', type=float, default=10.0)
+
+    args = parser.parse_args()
+    cache = EntityCache(args.db, ttl=args.ttl, max_entries=args.max_entries)
+
+    if args.command == 'inspect':
+        size = os.path.getsize(args.db) if os.path.exists(args.db) else 0
+        print(f"{args.db}: {len(cache)} entries, {size / 1024 / 1024:.1f} MB")
+        for kind, info in cache.stats().items():
+            print(f"- {kind}: {info['entries']} entries ({info['empty']} empty, {info['expired']} expired)")
+    elif args.command == 'prune':
+        removed = cache.prune()
+        print(f"✅ Removed {removed} entries, {len(cache)} left")
+    elif args.command == 'warm':
+        warm(cache, args.input, args.rate)
+        print(f"✅ Cache warmed: {len(cache)} entries")
+
+    cache.close()
+
+if __name__ == "__main__":
+    main()
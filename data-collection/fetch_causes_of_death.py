@@ -1,11 +1,22 @@
-import requests
-import urllib.parse
-import time
+import argparse
 import csv
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import instrumentation
+from http_client import RETRY_STATUSES, USER_AGENT, TransientError, make_session, parse_retry_after, retry_with_backoff
+from instrumentation import metrics
 
 ENDPOINT_URL = "https://query.wikidata.org/sparql"
-BATCH_SIZE = 5000  # adjust if needed
+PAGE_SIZE = 5000  # rows per query, adjust if needed
+MAX_RETRIES = 6
+RETRY_BASE_DELAY = 2.0  # seconds, doubled after every failed attempt
+TIMEOUT = 60  # seconds, the endpoint's own query time limit
 OUTPUT_FILE = "humans_filtered.csv"
+HEADERS = {"Accept": "text/csv", "User-Agent": USER_AGENT}
 
 # QIDs to exclude (disease/cancer-related causes)
 EXCLUDE_QIDS = [
@@ -27,68 +38,163 @@ EXCLUDE_QIDS = [
 # Convert to SPARQL VALUES format
 exclude_values = ", ".join(f"wd:{qid}" for qid in EXCLUDE_QIDS)
 
-BASE_QUERY = f"""
-SELECT ?person ?personLabel ?causeOfDeath ?causeOfDeathLabel
+# One cheap aggregate query tells us how many people each cause has, so the
+# export can be split into independent partitions of roughly PAGE_SIZE rows
+# instead of paging with an ever-growing OFFSET.
+CAUSE_COUNTS_QUERY = f"""
+SELECT ?causeOfDeath (COUNT(?person) AS ?count)
 WHERE {{
   ?person wdt:P31 wd:Q5.  # human
   ?person wdt:P509 ?causeOfDeath.  # cause of death
 
   # Exclude disease/cancer causes
   FILTER(?causeOfDeath NOT IN ({exclude_values}))
+}}
+GROUP BY ?causeOfDeath
+"""
 
+PARTITION_QUERY = """
+SELECT ?person ?personLabel ?causeOfDeath ?causeOfDeathLabel
+WHERE {{
+  VALUES ?causeOfDeath {{ {causes} }}
+  ?person wdt:P509 ?causeOfDeath.  # cause of death
+  ?person wdt:P31 wd:Q5.  # human
+  {after}
   SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
 }}
-LIMIT {BATCH_SIZE}
-OFFSET {{offset}}
+ORDER BY STR(?person)
+LIMIT {limit}
 """
 
-def fetch_batch(offset):
-    query = BASE_QUERY.replace("{offset}", str(offset))
-    url = ENDPOINT_URL + "?query=" + urllib.parse.quote(query)
-    headers = {"Accept": "text/csv"}
-    r = requests.get(url, headers=headers, timeout=60)
-    r.raise_for_status()
-    return r.text
-
-def main():
-    offset = 0
-    first_batch = True
+def run_query(query, post=False, session=None):
+    """Run a SPARQL query and return the CSV text, backing off on failures
+
+    Long queries (e.g. big VALUES blocks) should be POSTed to stay clear of URL length limits.
+    Pass the session from make_session to share its rate limit and circuit breaker.
+    Raises TransientError once retries run out and HTTPError for a rejected query.
+    """
+    session = session or make_session()
+    breaker = getattr(session, "breaker", None)
+
+    @metrics.stage("sparql")
+    def request():
+        if breaker:
+            breaker.before_request()
+        try:
+            if post:
+                r = session.post(ENDPOINT_URL, data={"query": query}, headers=HEADERS, timeout=TIMEOUT)
+            else:
+                r = session.get(ENDPOINT_URL, params={"query": query}, headers=HEADERS, timeout=TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if breaker:
+                breaker.record_failure()
+            raise TransientError(str(e)) from e
+        if r.status_code in RETRY_STATUSES:
+            if breaker:
+                breaker.record_failure()
+            raise TransientError(f"HTTP {r.status_code} from the SPARQL endpoint", parse_retry_after(r))
+        r.raise_for_status()
+        if breaker:
+            breaker.record_success()
+        return r.text
+
+    return retry_with_backoff(request, retries=MAX_RETRIES, base_delay=RETRY_BASE_DELAY, exceptions=(TransientError,))
+
+def fetch_cause_counts(session=None):
+    """Return [(cause QID, number of people)] for every non-excluded cause"""
+    reader = csv.DictReader(io.StringIO(run_query(CAUSE_COUNTS_QUERY, session=session)))
+    counts = [(row["causeOfDeath"].split("/")[-1], int(row["count"])) for row in reader]
+    return sorted(counts)
+
+def plan_partitions(cause_counts, page_size=None):
+    """Group causes into partitions of at most page_size people each
+
+    A cause bigger than a page gets a partition of its own and is paged with
+    a keyset on ?person by iter_rows.
+    """
+    page_size = page_size or PAGE_SIZE
+    partitions = []
+    current, current_size = [], 0
+    for qid, count in cause_counts:
+        if current and current_size + count > page_size:
+            partitions.append(current)
+            current, current_size = [], 0
+        current.append(qid)
+        current_size += count
+    if current:
+        partitions.append(current)
+    return partitions
+
+def fetch_page(causes, after=None, limit=None, session=None):
+    """Fetch one page of a partition, starting after the given person URI"""
+    query = PARTITION_QUERY.format(
+        causes=" ".join(f"wd:{qid}" for qid in causes),
+        after=f'FILTER(STR(?person) > "{after}")' if after else "",
+        limit=limit or PAGE_SIZE,
+    )
+    return list(csv.DictReader(io.StringIO(run_query(query, session=session))))
+
+def iter_rows(workers=1, rate=None):
+    """Yield result rows as dicts, page by page, in partition order
+
+    At most `workers` pages are being fetched or waiting to be consumed at
+    any time, so the export streams in constant memory. A partition's next
+    page depends on the last person of the one before, so it is queued
+    right after the page that ends full. All queries share one session, so
+    `rate` (requests per second) and the circuit breaker cover every worker.
+    """
+    session = make_session(pool_size=max(1, workers), rate=rate)
+    print("Counting people per cause of death...")
+    partitions = plan_partitions(fetch_cause_counts(session))
+    print(f"Fetching {len(partitions)} partitions with {workers} worker(s)...")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        pending = enumerate(partitions, 1)
+        in_flight = deque()
+
+        def top_up():
+            while len(in_flight) < max(1, workers):
+                number, causes = next(pending, (None, None))
+                if causes is None:
+                    return
+                in_flight.append((number, causes, 0, executor.submit(fetch_page, causes, session=session)))
+
+        top_up()
+        while in_flight:
+            number, causes, fetched, future = in_flight.popleft()
+            page = future.result()
+            fetched += len(page)
+            if len(page) == PAGE_SIZE:
+                in_flight.appendleft((number, causes, fetched,
+                                      executor.submit(fetch_page, causes, page[-1]["person"], session=session)))
+            else:
+                print(f"Partition {number}/{len(partitions)}: {fetched} rows")
+            top_up()
+            yield from page
 
+def export(workers, rate=None):
+    """Stream every partition into OUTPUT_FILE"""
     with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f_out:
         writer = None
 
-        while True:
-            print(f"Fetching rows {offset}–{offset+BATCH_SIZE} ...")
-            try:
-                csv_data = fetch_batch(offset)
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching batch: {e}. Retrying in 10s...")
-                time.sleep(10)
-                continue
-
-            lines = csv_data.strip().split("\n")
-            if len(lines) <= 1:  # no results
-                print("No more results. Done!")
-                break
-
+        for row in iter_rows(workers, rate):
             # Initialize CSV writer with headers
-            if first_batch:
-                reader = csv.DictReader(lines)
-                writer = csv.DictWriter(f_out, fieldnames=reader.fieldnames)
+            if writer is None:
+                writer = csv.DictWriter(f_out, fieldnames=list(row))
                 writer.writeheader()
-                first_batch = False
-            else:
-                lines = lines[1:]  # skip header for subsequent batches
-                reader = csv.DictReader(lines, fieldnames=writer.fieldnames)
-
-            # Write rows
-            for row in reader:
-                writer.writerow(row)
-
-            offset += BATCH_SIZE
-            time.sleep(1)  # be kind to Wikidata
+            writer.writerow(row)
 
     print(f"✅ Saved filtered data to {OUTPUT_FILE}")
 
+def main():
+    parser = argparse.ArgumentParser(description="Export humans with a non-medical cause of death from Wikidata")
+    parser.add_argument("--workers", type=int, default=1, help="Partitions fetched in parallel")
+    parser.add_argument("--rate", type=float, default=0, help="Maximum SPARQL queries per second across all workers (0 for unlimited)")
+    instrumentation.add_arguments(parser, "causes_of_death_run_report.json")
+    args = parser.parse_args()
+
+    with instrumentation.instrumented_run(args.report, args.profile_path if args.profile else None):
+        export(args.workers, args.rate or None)
+
 if __name__ == "__main__":
     main()
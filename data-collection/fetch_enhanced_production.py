@@ -1,35 +1,54 @@
+import argparse
 import json
+import os
 import requests
-import time
-import sys
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from checkpoint import CheckpointLog
+from columnar import write_columnar
+from entity_cache import DEFAULT_CACHE_PATH, EntityCache
+from http_client import MAXLAG, TransientError, get_json, make_session
+import instrumentation
+from instrumentation import CountingCache, metrics
+import sparql_enrichment
+from wikidata_dump import DumpEntitySource
+
+API_URL = "https://www.wikidata.org/w/api.php"
+MAX_IDS_PER_REQUEST = 50  # wbgetentities limit for non-bot clients
+
+# Set to a wikidata_dump.DumpEntitySource to answer lookups offline from a dump
+entity_source = None
+
+# Set to True to enrich people from the SPARQL endpoint (see sparql_enrichment.py)
+use_sparql = False
 
 def extract_entity_id(wikidata_url):
     """Extract entity ID from Wikidata URL"""
     return wikidata_url.split('/')[-1]
 
-def fetch_entity_data(entity_ids, batch_size=50):
+@metrics.stage('fetch')
+def fetch_entity_data(entity_ids, batch_size=50, session=None):
     """Fetch entity data using Wikidata API"""
+    if entity_source is not None:
+        return {'entities': entity_source.get_entities(entity_ids[:batch_size], 'info|labels|claims|sitelinks')}
     
     # Use the wikibase API to get entity data
-    url = "https://www.wikidata.org/w/api.php"
+    url = API_URL
     
     params = {
         'action': 'wbgetentities',
         'ids': '|'.join(entity_ids[:batch_size]),
         'format': 'json',
-        'props': 'labels|claims',
-        'languages': 'en'
-    }
-    
-    headers = {
-        'User-Agent': 'WikiGame Data Fetcher 1.0'
+        'props': 'info|labels|claims|sitelinks',
+        'sitefilter': 'enwiki',
+        'languages': 'en',
+        'maxlag': MAXLAG
     }
     
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=30)
-        response.raise_for_status()
-        return response.json()
-    except Exception as e:
+        return get_json(session or make_session(), url, params, timeout=30)
+    except requests.exceptions.RequestException as e:
         print(f"Error fetching data: {e}")
         return None
 
@@ -76,107 +95,129 @@ def extract_multiple_claim_values(claims, property_id, value_type='entity'):
     
     return values
 
-# Cache for entity labels to avoid repeated API calls
-label_cache = {}
+# Cache for entity labels to avoid repeated API calls. main() swaps in a
+# persistent EntityCache so lookups survive between runs.
+label_cache = CountingCache({})
+_MISSING = object()
 
-def get_entity_label(entity_id, session):
-    """Get label for an entity ID with caching"""
-    if entity_id in label_cache:
-        return label_cache[entity_id]
-    
-    url = "https://www.wikidata.org/w/api.php"
-    params = {
-        'action': 'wbgetentities',
-        'ids': entity_id,
-        'format': 'json',
-        'props': 'labels',
-        'languages': 'en'
-    }
+# P17/P131 of every place and administrative entity seen so far, shared by
+# all people so a hierarchy level is only ever fetched once per run
+place_nodes = {}
+hierarchy_stats = Counter()
+MAX_ADMIN_HOPS = 6
+
+# How many people the claim-only prefilter rejected before any secondary lookup
+pruning_stats = Counter()
+
+# lastrevid of every person built or pruned this run, saved next to the
+# output so --refresh can skip people nobody has edited since
+entity_revisions = {}
+
+def reset_state():
+    """Forget everything memoized by an earlier run in this process (benchmarks and tests)"""
+    label_cache.clear()
+    place_nodes.clear()
+    hierarchy_stats.clear()
+    pruning_stats.clear()
+    entity_revisions.clear()
+
+def fetch_entities(entity_ids, session, props='labels'):
+    """Fetch many entities with as few wbgetentities calls as possible
+    
+    Raises TransientError if the API stays unavailable, so callers never
+    mistake an outage for entities that have no label or country.
+    """
+    if entity_source is not None:
+        return entity_source.get_entities(entity_ids, props)
+    
+    entities = {}
+    unique_ids = list(dict.fromkeys(entity_ids))
+    
+    for i in range(0, len(unique_ids), MAX_IDS_PER_REQUEST):
+        params = {
+            'action': 'wbgetentities',
+            'ids': '|'.join(unique_ids[i:i + MAX_IDS_PER_REQUEST]),
+            'format': 'json',
+            'props': props,
+            'languages': 'en',
+            'maxlag': MAXLAG
+        }
+        
+        try:
+            entities.update(get_json(session, API_URL, params, timeout=30).get('entities', {}))
+        except requests.exceptions.HTTPError as e:
+            # Permanent (e.g. a malformed ID), so retrying later would not help either
+            print(f"Error fetching entities: {e}")
     
-    try:
-        response = session.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if 'entities' in data and entity_id in data['entities']:
-            labels = data['entities'][entity_id].get('labels', {})
-            if 'en' in labels:
-                label = labels['en']['value']
-                label_cache[entity_id] = label
-                return label
-    except:
-        pass
-    
-    label_cache[entity_id] = None
-    return None
+    return entities
+
+@metrics.stage('labels')
+def prefetch_labels(entity_ids, session):
+    """Resolve labels for all uncached entity IDs in batched requests"""
+    missing = [eid for eid in dict.fromkeys(entity_ids) if eid and eid not in label_cache]
+    if not missing:
+        return
+    
+    entities = fetch_entities(missing, session, props='labels')
+    for entity_id, entity in entities.items():
+        labels = entity.get('labels', {})
+        label_cache[entity_id] = labels['en']['value'] if 'en' in labels else None
+
+@metrics.stage('places')
+def prefetch_places(place_ids, session):
+    """Resolve "place, country" strings for all uncached places in batched requests"""
+    missing = [pid for pid in dict.fromkeys(place_ids) if pid and f"place_{pid}" not in label_cache]
+    if not missing:
+        return
+    
+    places = fetch_entities(missing, session, props='labels|claims')
+    
+    # The places themselves are the first level of the hierarchy walk
+    for place_id, entity in places.items():
+        remember_place_node(place_id, entity)
+    prefetch_countries(places.keys(), session)
+    
+    for place_id, entity in places.items():
+        labels = entity.get('labels', {})
+        place_name = labels['en']['value'] if 'en' in labels else ''
+        country_name = label_cache.peek(f"country_{place_id}") or ''
+        label_cache[f"place_{place_id}"] = format_place(place_name, country_name)
 
+def format_place(place_name, country_name):
+    """Format a place as "place, country", or just the place when the country adds nothing"""
+    if place_name and country_name and place_name != country_name:
+        return f"{place_name}, {country_name}"
+    elif place_name:
+        return place_name
+    else:
+        return ''
+
+@metrics.stage('labels')
+def get_entity_label(entity_id, session):
+    """Get label for an entity ID with caching
+    
+    The cache hit or miss was counted by the prefetch that precedes every
+    call, so the cache is only peeked at here.
+    """
+    label = label_cache.peek(entity_id, _MISSING)
+    if label is _MISSING:
+        prefetch_labels([entity_id], session)
+        # Not cached when the API failed to return the entity, so a later run asks again
+        label = label_cache.peek(entity_id)
+    return label
+
+@metrics.stage('places')
 def get_place_with_country(place_id, session):
     """Get place label with country information"""
     if not place_id:
         return ''
     
     cache_key = f"place_{place_id}"
-    if cache_key in label_cache:
-        return label_cache[cache_key]
-    
-    url = "https://www.wikidata.org/w/api.php"
-    params = {
-        'action': 'wbgetentities',
-        'ids': place_id,
-        'format': 'json',
-        'props': 'labels|claims',
-        'languages': 'en'
-    }
-    
-    try:
-        response = session.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if 'entities' in data and place_id in data['entities']:
-            entity = data['entities'][place_id]
-            labels = entity.get('labels', {})
-            claims = entity.get('claims', {})
-            
-            place_name = ''
-            if 'en' in labels:
-                place_name = labels['en']['value']
-            
-            # Try to get country information
-            country_name = ''
-            # Check for country (P17)
-            if 'P17' in claims:
-                try:
-                    country_id = claims['P17'][0]['mainsnak']['datavalue']['value']['id']
-                    country_name = get_entity_label(country_id, session) or ''
-                except:
-                    pass
-            
-            # If no direct country, try administrative territorial entity (P131) and traverse up
-            if not country_name and 'P131' in claims:
-                try:
-                    admin_id = claims['P131'][0]['mainsnak']['datavalue']['value']['id']
-                    # Get the administrative entity and check if it has a country
-                    admin_data = get_entity_with_country(admin_id, session)
-                    if admin_data and admin_data.get('country'):
-                        country_name = admin_data['country']
-                except:
-                    pass
-            
-            # Format the result
-            if place_name and country_name and place_name != country_name:
-                result = f"{place_name}, {country_name}"
-            elif place_name:
-                result = place_name
-            else:
-                result = ''
-            
-            label_cache[cache_key] = result
-            return result
-    except:
-        pass
-    
-    label_cache[cache_key] = ''
-    return ''
+    place = label_cache.peek(cache_key, _MISSING)
+    if place is _MISSING:
+        prefetch_places([place_id], session)
+        place = label_cache.peek(cache_key, '')
+    return place
 
 def get_full_image_url(filename):
     """Convert Wikimedia Commons filename to full URL"""
@@ -194,167 +235,301 @@ def get_full_image_url(filename):
     # Generate the full Commons URL
     return f"https://commons.wikimedia.org/wiki/File:{encoded_filename}"
 
-def get_entity_with_country(entity_id, session):
-    """Get entity data including country information"""
-    url = "https://www.wikidata.org/w/api.php"
-    params = {
-        'action': 'wbgetentities',
-        'ids': entity_id,
-        'format': 'json',
-        'props': 'labels|claims',
-        'languages': 'en'
-    }
-    
-    try:
-        response = session.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+def remember_place_node(entity_id, entity):
+    """Keep the country (P17) and parent (P131) of a hierarchy node for later walks"""
+    claims = entity.get('claims', {})
+    place_nodes[entity_id] = (
+        extract_claim_value(claims, 'P17', 'entity'),
+        extract_claim_value(claims, 'P131', 'entity')
+    )
+
+@metrics.stage('places')
+def prefetch_countries(entity_ids, session):
+    """Resolve the country of many entities by walking P131 upwards, one level per request batch
+    
+    Every node on a resolved chain is memoized under country_<QID>, so a town
+    shares its region's, and the region its province's, answer with every
+    other person born nearby.
+    """
+    walks = {eid: [eid] for eid in dict.fromkeys(entity_ids) if eid and f"country_{eid}" not in label_cache}
+    finished = {}  # start entity -> (chain, country QID or None)
+    
+    for _ in range(MAX_ADMIN_HOPS):
+        if not walks:
+            break
         
-        if 'entities' in data and entity_id in data['entities']:
-            entity = data['entities'][entity_id]
-            claims = entity.get('claims', {})
-            
-            # Check for country (P17)
-            if 'P17' in claims:
-                try:
-                    country_id = claims['P17'][0]['mainsnak']['datavalue']['value']['id']
-                    country_name = get_entity_label(country_id, session)
-                    return {'country': country_name}
-                except:
-                    pass
-    except:
-        pass
-    
-    return None
-    """Get entity data including country information"""
-    url = "https://www.wikidata.org/w/api.php"
-    params = {
-        'action': 'wbgetentities',
-        'ids': entity_id,
-        'format': 'json',
-        'props': 'labels|claims',
-        'languages': 'en'
-    }
-    
-    try:
-        response = session.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        heads = {chain[-1] for chain in walks.values()}
+        unknown = [h for h in heads if h not in place_nodes and label_cache.peek(f"country_{h}", _MISSING) is _MISSING]
+        hierarchy_stats['node_hits'] += len(heads) - len(unknown)
+        hierarchy_stats['node_fetches'] += len(unknown)
+        for node_id, entity in fetch_entities(unknown, session, props='claims').items():
+            remember_place_node(node_id, entity)
         
-        if 'entities' in data and entity_id in data['entities']:
-            entity = data['entities'][entity_id]
-            claims = entity.get('claims', {})
-            
-            # Check for country (P17)
-            if 'P17' in claims:
-                try:
-                    country_id = claims['P17'][0]['mainsnak']['datavalue']['value']['id']
-                    country_name = get_entity_label(country_id, session)
-                    return {'country': country_name}
-                except:
-                    pass
-    except:
-        pass
-    
+        next_walks = {}
+        for start, chain in walks.items():
+            head = chain[-1]
+            country_name = label_cache.peek(f"country_{head}", _MISSING)
+            if country_name is not _MISSING:
+                # Another chain already resolved this node
+                finished[start] = (chain[:-1], ('label', country_name))
+                continue
+            country_id, parent_id = place_nodes.get(head, (None, None))
+            if country_id:
+                finished[start] = (chain, ('qid', country_id))
+            elif parent_id and parent_id not in chain:
+                next_walks[start] = chain + [parent_id]
+            elif head in place_nodes:
+                # Reached the top of the hierarchy without finding a country
+                finished[start] = (chain, ('label', None))
+        walks = next_walks
+    
+    prefetch_labels([value for _, (kind, value) in finished.values() if kind == 'qid'], session)
+    
+    for chain, (kind, value) in finished.values():
+        country_name = label_cache.peek(value) if kind == 'qid' else value
+        for node_id in chain:
+            label_cache[f"country_{node_id}"] = country_name
+
+def hierarchy_hit_rate():
+    """Share of hierarchy nodes answered from memory instead of the API"""
+    total = hierarchy_stats['node_hits'] + hierarchy_stats['node_fetches']
+    return hierarchy_stats['node_hits'] / total if total else 0.0
+
+@metrics.stage('places')
+def get_entity_with_country(entity_id, session):
+    """Get entity data including country information"""
+    cache_key = f"country_{entity_id}"
+    country_name = label_cache.peek(cache_key, _MISSING)
+    if country_name is _MISSING:
+        prefetch_countries([entity_id], session)
+        country_name = label_cache.peek(cache_key)
+    return {'country': country_name} if country_name else None
+
+def get_article_url(sitelinks):
+    """Build the English Wikipedia URL from an entity's sitelinks"""
+    if 'enwiki' in sitelinks:
+        title = sitelinks['enwiki']['title']
+        return f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
     return None
 
+@metrics.stage('article')
 def get_wikipedia_article(entity_id, session):
     """Get English Wikipedia article URL"""
-    url = "https://www.wikidata.org/w/api.php"
+    cache_key = f"article_{entity_id}"
+    if cache_key in label_cache:
+        return label_cache[cache_key]
+    
+    url = API_URL
     params = {
         'action': 'wbgetentities',
         'ids': entity_id,
         'format': 'json',
         'props': 'sitelinks',
-        'sitefilter': 'enwiki'
+        'sitefilter': 'enwiki',
+        'maxlag': MAXLAG
     }
     
+    # Transient failures propagate so the batch is retried instead of cached without an article
     try:
-        response = session.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if 'entities' in data and entity_id in data['entities']:
-            sitelinks = data['entities'][entity_id].get('sitelinks', {})
-            if 'enwiki' in sitelinks:
-                title = sitelinks['enwiki']['title']
-                return f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
-    except:
-        pass
+        data = get_json(session, url, params, timeout=10)
+    except requests.exceptions.HTTPError:
+        return None
+    
+    if 'entities' in data and entity_id in data['entities']:
+        article = get_article_url(data['entities'][entity_id].get('sitelinks', {}))
+        label_cache[cache_key] = article
+        return article
     
     return None
 
-def process_entity_data(entity_data, session):
-    """Process entity data into structured format"""
-    processed = {}
-    
-    if 'entities' not in entity_data:
-        return processed
+# Everything process_entity_data needs from one person's entity, small enough
+# to be cheap to send back from a worker process
+PersonClaims = namedtuple('PersonClaims', [
+    'entity_id', 'label', 'birth_date', 'death_date', 'photo', 'coords',
+    'place_of_birth', 'place_of_death', 'gender', 'citizenship', 'occupation',
+    'has_sitelinks', 'article', 'lastrevid', 'modified'
+])
+
+def extract_person_claims(entity_id, data):
+    """Pull the fields we use out of a raw entity"""
+    claims = data.get('claims', {})
+    has_sitelinks = 'sitelinks' in data
+    return PersonClaims(
+        entity_id=entity_id,
+        label=data.get('labels', {}).get('en', {}).get('value', ''),
+        birth_date=extract_claim_value(claims, 'P569', 'time'),
+        death_date=extract_claim_value(claims, 'P570', 'time'),
+        photo=extract_claim_value(claims, 'P18', 'string'),
+        coords=extract_claim_value(claims, 'P625', 'coordinate'),
+        place_of_birth=extract_claim_value(claims, 'P19', 'entity'),
+        place_of_death=extract_claim_value(claims, 'P20', 'entity'),
+        gender=extract_claim_value(claims, 'P21', 'entity'),
+        citizenship=tuple(extract_multiple_claim_values(claims, 'P27', 'entity')[:3]),
+        occupation=tuple(extract_multiple_claim_values(claims, 'P106', 'entity')[:3]),
+        has_sitelinks=has_sitelinks,
+        article=get_article_url(data['sitelinks']) if has_sitelinks else None,
+        lastrevid=data.get('lastrevid'),
+        modified=data.get('modified')
+    )
+
+def extract_person_claims_json(raw_entity):
+    """extract_person_claims for an entity still in JSON text form (used by worker processes)"""
+    data = json.loads(raw_entity)
+    return extract_person_claims(data['id'], data)
+
+def get_referenced_ids(person):
+    """Return the (label IDs, place IDs) a person needs resolved"""
+    label_ids = [person.gender, *person.citizenship, *person.occupation]
+    place_ids = [person.place_of_birth, person.place_of_death]
+    return [eid for eid in label_ids if eid], [pid for pid in place_ids if pid]
+
+def is_candidate_person(person):
+    """Claim-only version of is_relevant_person, run before any secondary lookup
+    
+    Never rejects someone is_relevant_person would accept: the optional field
+    count is an upper bound, since a referenced label can only resolve to
+    something or nothing.
+    """
+    if not (person.label and person.birth_date and person.death_date and person.photo):
+        return False
+    
+    possible_optional = sum(1 for value in (person.place_of_birth, person.place_of_death,
+                                            person.citizenship, person.occupation, person.gender) if value)
+    if not person.has_sitelinks or person.article:
+        possible_optional += 1
+    
+    return possible_optional >= 2
+
+def prefetch_referenced_entities(people, session):
+    """Resolve every label and place referenced by the candidates in a batch up front"""
+    label_ids = []
+    place_ids = []
     
-    for entity_id, data in entity_data['entities'].items():
-        # Skip if entity not found
-        if 'missing' in data:
+    for person in people:
+        if not is_candidate_person(person):
             continue
-            
-        claims = data.get('claims', {})
-        labels = data.get('labels', {})
         
-        person_label = labels.get('en', {}).get('value', '')
+        person_label_ids, person_place_ids = get_referenced_ids(person)
+        label_ids.extend(person_label_ids)
+        place_ids.extend(person_place_ids)
+    
+    prefetch_labels(label_ids, session)
+    prefetch_places(place_ids, session)
+
+def build_person_records(people, session):
+    """Turn extracted PersonClaims into output records, resolving labels and places"""
+    prefetch_referenced_entities(people, session)
+    return records_from_claims(
+        people,
+        lambda entity_id: get_entity_label(entity_id, session),
+        lambda place_id: get_place_with_country(place_id, session),
+        session
+    )
+
+def build_sparql_records(people, session):
+    """build_person_records for people from sparql_enrichment, who bring their labels and places along"""
+    claims = [PersonClaims(**{field: person[field] for field in PersonClaims._fields}) for person in people]
+    labels = {}
+    places = {}
+    for person in people:
+        labels.update(person['labels'])
+        places.update(person['places'])
+    
+    # Places without a direct country still need the P131 walk, batched like the API path
+    prefetch_places([
+        place_id for person in claims if is_candidate_person(person)
+        for place_id in (person.place_of_birth, person.place_of_death)
+        if place_id and places.get(place_id) is None
+    ], session)
+    
+    def place_of(place_id):
+        if places.get(place_id) is None:
+            return get_place_with_country(place_id, session)
+        return format_place(*places[place_id])
+    
+    return records_from_claims(claims, labels.get, place_of, session)
+
+def records_from_claims(people, label_of, place_of, session):
+    """Build output records for the candidates among people, naming entities with label_of/place_of"""
+    processed = {}
+    
+    for person in people:
+        entity_revisions[person.entity_id] = person.lastrevid
+        
+        # Skip people who would fail is_relevant_person anyway, before paying for lookups
+        pruning_stats['checked'] += 1
+        if not is_candidate_person(person):
+            label_ids, place_ids = get_referenced_ids(person)
+            pruning_stats['pruned'] += 1
+            pruning_stats['lookups_avoided'] += len(label_ids) + len(place_ids)
+            continue
         
         # Extract basic info
         person_info = {
-            'person': f"http://www.wikidata.org/entity/{entity_id}",
-            'personLabel': person_label,
-            'birthDate': extract_claim_value(claims, 'P569', 'time'),
-            'deathDate': extract_claim_value(claims, 'P570', 'time'),
+            'person': f"http://www.wikidata.org/entity/{person.entity_id}",
+            'personLabel': person.label,
+            'birthDate': person.birth_date,
+            'deathDate': person.death_date,
             'gender': '',
-            'photo': get_full_image_url(extract_claim_value(claims, 'P18', 'string')),
-            'coords': extract_claim_value(claims, 'P625', 'coordinate'),
+            'photo': get_full_image_url(person.photo),
+            'coords': person.coords,
             'placeOfBirth': '',
             'placeOfDeath': '',
             'citizenship': '',
             'occupation': '',
-            'article': ''
+            'article': '',
+            'lastrevid': person.lastrevid,
+            'modified': person.modified
         }
         
         # Get place labels with country information
-        place_of_birth_id = extract_claim_value(claims, 'P19', 'entity')
-        if place_of_birth_id:
-            person_info['placeOfBirth'] = get_place_with_country(place_of_birth_id, session)
+        if person.place_of_birth:
+            person_info['placeOfBirth'] = place_of(person.place_of_birth)
             
-        place_of_death_id = extract_claim_value(claims, 'P20', 'entity')
-        if place_of_death_id:
-            person_info['placeOfDeath'] = get_place_with_country(place_of_death_id, session)
+        if person.place_of_death:
+            person_info['placeOfDeath'] = place_of(person.place_of_death)
         
         # Get gender label
-        gender_id = extract_claim_value(claims, 'P21', 'entity')
-        if gender_id:
-            person_info['gender'] = get_entity_label(gender_id, session) or ''
-        
-        # Get citizenship (can be multiple)
-        citizenship_ids = extract_multiple_claim_values(claims, 'P27', 'entity')
-        citizenship_labels = []
-        for cid in citizenship_ids[:3]:  # Limit to 3 to avoid too many API calls
-            label = get_entity_label(cid, session)
-            if label:
-                citizenship_labels.append(label)
-        person_info['citizenship'] = '|'.join(citizenship_labels)
+        if person.gender:
+            person_info['gender'] = label_of(person.gender) or ''
         
-        # Get occupation (can be multiple)
-        occupation_ids = extract_multiple_claim_values(claims, 'P106', 'entity')
-        occupation_labels = []
-        for oid in occupation_ids[:3]:  # Limit to 3
-            label = get_entity_label(oid, session)
-            if label:
-                occupation_labels.append(label)
-        person_info['occupation'] = '|'.join(occupation_labels)
+        # Get citizenship and occupation (first 3 of each to avoid too many API calls)
+        for field, entity_ids in (('citizenship', person.citizenship), ('occupation', person.occupation)):
+            labels = []
+            for entity_id in entity_ids:
+                label = label_of(entity_id)
+                if label:
+                    labels.append(label)
+            person_info[field] = '|'.join(labels)
         
-        # Get Wikipedia article
-        person_info['article'] = get_wikipedia_article(entity_id, session) or ''
+        # Get Wikipedia article, normally from the sitelinks of the batch fetch
+        if person.has_sitelinks:
+            person_info['article'] = person.article or ''
+        else:
+            person_info['article'] = get_wikipedia_article(person.entity_id, session) or ''
         
-        processed[entity_id] = person_info
+        processed[person.entity_id] = person_info
     
     return processed
 
+def process_entity_data(entity_data, session):
+    """Process entity data into structured format"""
+    if 'entities' not in entity_data:
+        return {}
+    
+    with metrics.stage('parse'):
+        people = [
+            extract_person_claims(entity_id, data)
+            for entity_id, data in entity_data['entities'].items()
+            if 'missing' not in data  # Skip if entity not found
+        ]
+    return build_person_records(people, session)
+
+@metrics.stage('parse')
+def extract_people_parallel(raw_entities, pool, chunksize=64):
+    """Shard raw entity JSON across a process pool, getting PersonClaims back in order"""
+    return list(pool.map(extract_person_claims_json, raw_entities, chunksize=chunksize))
+
 def is_relevant_person(person_data):
     """Check if a person has enough relevant information"""
     required_fields = ['personLabel', 'birthDate', 'deathDate', 'photo']
@@ -371,28 +546,186 @@ def is_relevant_person(person_data):
     
     return filled_optional >= 2  # Must have at least 2 optional fields filled (reduced from 3 since photo is now required)
 
-def main():
-    # Get limit from command line argument
-    limit = None
-    if len(sys.argv) > 1:
+def enrich_batch(batch, session, pool=None):
+    """Fetch and process one batch of people, returning None if it failed and should be re-driven"""
+    # Hold new batches back while the circuit is open instead of failing them straight away
+    breaker = getattr(session, 'breaker', None)
+    
+    if use_sparql:
+        if breaker:
+            breaker.wait()
         try:
-            limit = int(sys.argv[1])
-        except ValueError:
-            print("Usage: python script.py [limit]")
-            sys.exit(1)
-    
-    print("Loading filtered causes of death data...")
+            people = sparql_enrichment.fetch_people(batch, session)
+        except requests.exceptions.RequestException as e:
+            print(f"  -> SPARQL query failed, leaving the batch for later: {e}")
+            return None
+        try:
+            return build_sparql_records(list(people.values()), session)
+        except TransientError as e:
+            print(f"  -> Lookups failed, leaving the batch for later: {e}")
+            return None
     
-    with open('humans_filtered_cleaned.json', 'r') as f:
-        filtered_data = json.load(f)
+    if pool is not None and entity_source is not None:
+        # Dump mode: parsing is the bottleneck, so hand the JSON text to worker processes
+        raw_entities = entity_source.get_raw_people(batch)
+        return build_person_records(extract_people_parallel(raw_entities.values(), pool), session)
     
-    if limit:
-        filtered_data = filtered_data[:limit]
-        print(f"Processing {len(filtered_data)} people (limited)")
-    else:
-        print(f"Processing {len(filtered_data)} people (full dataset)")
+    if breaker:
+        breaker.wait()
     
-    # Extract entity IDs and create cause of death mapping
+    entity_data = fetch_entity_data(batch, len(batch), session)
+    if not entity_data:
+        return None
+    try:
+        return process_entity_data(entity_data, session)
+    except TransientError as e:
+        print(f"  -> Lookups failed, leaving the batch for later: {e}")
+        return None
+
+def iter_batches(entity_ids, batch_size):
+    """Group any iterable of entity IDs into lists of batch_size"""
+    batch = []
+    for entity_id in entity_ids:
+        batch.append(entity_id)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def enrich_batches(entity_ids, session, batch_size=25, workers=1, pool=None):
+    """Yield (batch_num, batch, processed) in input order, optionally using a thread pool"""
+    batches = enumerate(iter_batches(entity_ids, batch_size), 1)
+    
+    if workers <= 1:
+        for batch_num, batch in batches:
+            yield batch_num, batch, enrich_batch(batch, session, pool)
+        return
+    
+    # Results are handed back in submission order, so the output is identical
+    # to the serial path no matter which worker finishes first. Only a couple
+    # of batches per worker are in flight, so entity_ids can be a stream.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for batch_num, batch in batches:
+            in_flight.append((batch_num, batch, executor.submit(enrich_batch, batch, session, pool)))
+            if len(in_flight) >= workers * 2:
+                batch_num, batch, future = in_flight.popleft()
+                yield batch_num, batch, future.result()
+        while in_flight:
+            batch_num, batch, future = in_flight.popleft()
+            yield batch_num, batch, future.result()
+
+def redrive(dead_letters, session, batch_size=25, workers=1, pool=None, rounds=2):
+    """Retry dead-lettered entity IDs once the API has had time to recover
+    
+    Yields (batch, processed) for every batch that now succeeds; whatever
+    still fails is left in dead_letters.
+    """
+    for round_num in range(1, rounds + 1):
+        if not dead_letters:
+            return
+        print(f"Re-driving {len(dead_letters)} dead-lettered people (round {round_num}/{rounds})...")
+        breaker = getattr(session, 'breaker', None)
+        if breaker:
+            breaker.wait()
+        
+        retry_ids = list(dead_letters)
+        dead_letters.clear()
+        for _, batch, processed in enrich_batches(retry_ids, session, batch_size, workers, pool):
+            if processed is None:
+                dead_letters.extend(batch)
+            else:
+                yield batch, processed
+
+def iter_enriched(rows, session, batch_size=25, workers=1, redrive_rounds=2):
+    """Stream relevant enriched people for rows carrying person and cause of death"""
+    pending_rows = {}
+    seen = set()
+    dead_letters = []
+    
+    def entity_ids():
+        for row in rows:
+            entity_id = extract_entity_id(row['person'])
+            # The export has one row per (person, cause); keep the first
+            if entity_id not in seen:
+                seen.add(entity_id)
+                pending_rows[entity_id] = row
+                yield entity_id
+    
+    def relevant(batch, processed):
+        for entity_id in batch:
+            # Nothing here saves revisions, so don't let them pile up over the stream
+            entity_revisions.pop(entity_id, None)
+            row = pending_rows.pop(entity_id)
+            person_data = processed.get(entity_id)
+            if person_data and is_relevant_person(person_data):
+                person_data.update({
+                    'causeOfDeath': row['causeOfDeath'],
+                    'causeOfDeathLabel': row['causeOfDeathLabel']
+                })
+                yield person_data
+    
+    for batch_num, batch, processed in enrich_batches(entity_ids(), session, batch_size, workers):
+        if processed is None:
+            dead_letters.extend(batch)
+            continue
+        yield from relevant(batch, processed)
+    
+    for batch, processed in redrive(dead_letters, session, batch_size, workers, rounds=redrive_rounds):
+        yield from relevant(batch, processed)
+    for entity_id in dead_letters:
+        entity_revisions.pop(entity_id, None)
+    if dead_letters:
+        print(f"⚠️  Gave up on {len(dead_letters)} people after {redrive_rounds} re-drive rounds: "
+              f"{', '.join(dead_letters[:10])}{'...' if len(dead_letters) > 10 else ''}")
+
+@metrics.stage('revisions')
+def fetch_revisions(entity_ids, session):
+    """Return {QID: lastrevid} from a cheap info-only fetch, None for anything not found
+    
+    A chunk the API keeps failing on also comes back as None, so an outage
+    during --refresh only means re-enriching those people.
+    """
+    breaker = getattr(session, 'breaker', None)
+    unique_ids = list(dict.fromkeys(entity_ids))
+    entities = {}
+    for i in range(0, len(unique_ids), MAX_IDS_PER_REQUEST):
+        chunk = unique_ids[i:i + MAX_IDS_PER_REQUEST]
+        if breaker:
+            breaker.wait()
+        try:
+            entities.update(fetch_entities(chunk, session, props='info'))
+        except TransientError as e:
+            print(f"  -> Could not check {len(chunk)} revisions, treating them as changed: {e}")
+    return {entity_id: entities.get(entity_id, {}).get('lastrevid') for entity_id in entity_ids}
+
+def load_revisions(revisions_file, records):
+    """Revisions saved by the last run, falling back to the lastrevid on its records"""
+    revisions = {
+        extract_entity_id(record['person']): record['lastrevid']
+        for record in records if record.get('lastrevid') is not None
+    }
+    if os.path.exists(revisions_file):
+        with open(revisions_file, 'r') as f:
+            revisions.update(json.load(f))
+    return revisions
+
+def plan_refresh(entity_ids, known_revisions, session):
+    """Split entity_ids into (new or edited, unchanged) by comparing lastrevid"""
+    current = fetch_revisions(entity_ids, session)
+    changed, unchanged = [], []
+    for entity_id in entity_ids:
+        revision = current.get(entity_id)
+        # Unknown, deleted or redirected entities are reprocessed to be safe
+        if revision is not None and revision == known_revisions.get(entity_id):
+            unchanged.append(entity_id)
+        else:
+            changed.append(entity_id)
+    return changed, unchanged
+
+def map_causes_of_death(filtered_data):
+    """Return the entity IDs in filtered_data, in order, and {QID: cause of death fields}"""
     entity_ids = []
     cause_of_death_map = {}
     
@@ -403,83 +736,210 @@ def main():
             'causeOfDeath': item['causeOfDeath'],
             'causeOfDeathLabel': item['causeOfDeathLabel']
         }
+    return entity_ids, cause_of_death_map
+
+def select_relevant(all_processed, cause_of_death_map):
+    """Relevant people in all_processed order, with their cause of death added"""
+    relevant_people = []
+    for entity_id, person_data in all_processed.items():
+        if is_relevant_person(person_data):
+            # Add cause of death info
+            if entity_id in cause_of_death_map:
+                person_data.update(cause_of_death_map[entity_id])
+                relevant_people.append(person_data)
+    return relevant_people
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Enrich filtered people with Wikidata details")
+    parser.add_argument('limit', nargs='?', type=int, help="Only process the first N people")
+    parser.add_argument('--workers', type=int, default=1, help="Number of batches fetched concurrently")
+    parser.add_argument('--rate', type=float, default=10.0, help="Maximum API requests per second (0 for unlimited)")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="Persistent entity cache database")
+    parser.add_argument('--no-cache', action='store_true', help="Keep lookups in memory only for this run")
+    parser.add_argument('--resume', action='store_true', help="Skip people already enriched in the checkpoint log")
+    parser.add_argument('--columnar', action='store_true', help="Also write the results in the compact columnar format")
+    parser.add_argument('--dump-index', help="Read entities from an index built by wikidata_dump.py instead of the API")
+    parser.add_argument('--processes', type=int, default=1, help="Worker processes for claim extraction in dump mode")
+    parser.add_argument('--batch-size', type=int,
+                        help="People per batch (default 25, or 200 per SPARQL query; larger suits dump mode)")
+    parser.add_argument('--backend', choices=['api', 'sparql'], default='api',
+                        help="Fetch people with wbgetentities (api) or one SPARQL query per batch (sparql)")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Only re-enrich people edited since the last run and merge them into its output")
+    parser.add_argument('--redrive', type=int, default=2,
+                        help="Rounds of retrying dead-lettered batches at the end of the run")
+    instrumentation.add_arguments(parser, 'humans_enhanced_run_report.json')
+    return parser.parse_args(argv)
+
+def run(args):
+    global label_cache, entity_source, use_sparql
+    
+    limit = args.limit
+    if not args.no_cache:
+        label_cache = CountingCache(EntityCache(args.cache))
+    if args.dump_index:
+        entity_source = DumpEntitySource(args.dump_index)
+    use_sparql = args.backend == 'sparql'
+    
+    print("Loading filtered causes of death data...")
+    
+    with metrics.stage('load'), open('humans_filtered_cleaned.json', 'r') as f:
+        filtered_data = json.load(f)
+    
+    if limit:
+        filtered_data = filtered_data[:limit]
+        print(f"Processing {len(filtered_data)} people (limited)")
+    else:
+        print(f"Processing {len(filtered_data)} people (full dataset)")
+    
+    entity_ids, cause_of_death_map = map_causes_of_death(filtered_data)
+    
+    session = make_session(pool_size=max(10, args.workers), rate=args.rate or None)
+    
+    output_file = 'humans_enhanced_relevant.json'
+    if limit:
+        output_file = f'humans_enhanced_relevant_{limit}.json'
+    revisions_file = output_file.replace('.json', '_revisions.json')
+    dead_letters_file = output_file.replace('.json', '_dead_letters.json')
+    
+    all_ids = entity_ids
+    previous_records = {}
+    unchanged_ids = set()
+    if args.refresh:
+        print("Checking revisions against the last run...")
+        if os.path.exists(output_file):
+            with open(output_file, 'r') as f:
+                previous_records = {extract_entity_id(record['person']): record for record in json.load(f)}
+        known_revisions = load_revisions(revisions_file, previous_records.values())
+        entity_ids, unchanged = plan_refresh(entity_ids, known_revisions, session)
+        unchanged_ids = set(unchanged)
+        for entity_id in unchanged:
+            entity_revisions[entity_id] = known_revisions[entity_id]
+        print(f"  -> {len(unchanged_ids)} people unchanged, {len(entity_ids)} new or edited")
     
     print("Fetching Wikidata information...")
     
-    session = requests.Session()
-    session.headers.update({'User-Agent': 'WikiGame Data Fetcher 1.0'})
+    checkpoint_file = 'humans_enhanced_checkpoint.jsonl'
+    if limit:
+        checkpoint_file = f'humans_enhanced_checkpoint_{limit}.jsonl'
+    checkpoint = CheckpointLog(checkpoint_file, resume=args.resume)
+    
+    all_processed = dict(checkpoint.processed)
+    if checkpoint.done_ids:
+        entity_ids = [eid for eid in entity_ids if eid not in checkpoint.done_ids]
+        print(f"Resuming: {len(checkpoint.done_ids)} people already enriched, {len(entity_ids)} to go")
     
-    all_processed = {}
-    batch_size = 25  # Smaller batches for stability
+    # Claim extraction only moves to worker processes when reading from a dump
+    pool = None
+    if entity_source is not None and args.processes > 1:
+        pool = ProcessPoolExecutor(max_workers=args.processes)
+    
+    batch_size = args.batch_size or (sparql_enrichment.BLOCK_SIZE if use_sparql else 25)
     total_batches = (len(entity_ids) + batch_size - 1) // batch_size
     
-    for i in range(0, len(entity_ids), batch_size):
-        batch = entity_ids[i:i + batch_size]
-        batch_num = i // batch_size + 1
-        
+    dead_letters = []
+    for batch_num, batch, processed in enrich_batches(entity_ids, session, batch_size, args.workers, pool):
         print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} people)")
         
-        entity_data = fetch_entity_data(batch, batch_size)
-        if entity_data:
-            processed = process_entity_data(entity_data, session)
+        if processed is not None:
             all_processed.update(processed)
+            with metrics.stage('checkpoint'):
+                checkpoint.record(batch, processed)
             print(f"  -> Got data for {len(processed)} people")
         else:
-            print(f"  -> Failed to get data for batch {batch_num}")
+            dead_letters.extend(batch)
+            print(f"  -> Failed to get data for batch {batch_num}, will retry it at the end")
         
-        # Save progress every 100 batches
         if batch_num % 100 == 0:
-            relevant_people = []
-            for entity_id, person_data in all_processed.items():
-                if is_relevant_person(person_data):
-                    if entity_id in cause_of_death_map:
-                        person_data.update(cause_of_death_map[entity_id])
-                        relevant_people.append(person_data)
-            
-            with open(f'humans_enhanced_progress_{batch_num}.json', 'w') as f:
-                json.dump(relevant_people, f, indent=2, ensure_ascii=False)
-            print(f"  -> Saved progress: {len(relevant_people)} relevant people so far")
-        
-        time.sleep(0.5)  # Be respectful to the API
+            print(f"  -> Checkpointed {checkpoint.batches} batches to {checkpoint_file}")
     
-    print("Filtering for relevant people...")
+    for batch, processed in redrive(dead_letters, session, batch_size, args.workers, pool, args.redrive):
+        all_processed.update(processed)
+        with metrics.stage('checkpoint'):
+            checkpoint.record(batch, processed)
+        print(f"  -> Got data for {len(processed)} people on retry")
+    
+    # Never checkpointed, so --resume picks these up again
+    if dead_letters:
+        with open(dead_letters_file, 'w') as f:
+            json.dump(dead_letters, f)
+        print(f"⚠️  {len(dead_letters)} people still failing, listed in {dead_letters_file}; rerun with --resume")
+    elif os.path.exists(dead_letters_file):
+        os.remove(dead_letters_file)
+    
+    checkpoint.close()
+    if pool is not None:
+        pool.shutdown()
+    
+    if not args.no_cache:
+        label_cache.close()
     
-    relevant_people = []
     for entity_id, person_data in all_processed.items():
-        if is_relevant_person(person_data):
-            # Add cause of death info
-            if entity_id in cause_of_death_map:
-                person_data.update(cause_of_death_map[entity_id])
-                relevant_people.append(person_data)
+        if person_data.get('lastrevid') is not None:
+            entity_revisions.setdefault(entity_id, person_data['lastrevid'])
+    
+    # Back to input order (re-driven batches finish last), merging the
+    # delta into the last run's output for --refresh
+    merged = {}
+    for entity_id in all_ids:
+        if entity_id in all_processed:
+            merged[entity_id] = all_processed[entity_id]
+        elif entity_id in unchanged_ids and entity_id in previous_records:
+            merged[entity_id] = previous_records[entity_id]
+    all_processed = merged
+    
+    print("Filtering for relevant people...")
+    
+    relevant_people = select_relevant(all_processed, cause_of_death_map)
     
-    success_rate = (len(relevant_people) / len(all_processed)) * 100 if all_processed else 0
+    # People rejected by the claim-only prefilter never made it into all_processed
+    data_fetched = len(all_processed) + pruning_stats['pruned']
+    success_rate = (len(relevant_people) / data_fetched) * 100 if data_fetched else 0
     print(f"Found {len(relevant_people)} relevant people with sufficient data ({success_rate:.1f}% success rate)")
     
     # Save final results
-    output_file = 'humans_enhanced_relevant.json'
-    if limit:
-        output_file = f'humans_enhanced_relevant_{limit}.json'
+    with metrics.stage('serialize'):
+        with open(output_file, 'w') as f:
+            json.dump(relevant_people, f, indent=2, ensure_ascii=False)
+        
+        with open(revisions_file, 'w') as f:
+            json.dump({eid: entity_revisions[eid] for eid in dict.fromkeys(all_ids)
+                       if entity_revisions.get(eid) is not None}, f)
         
-    with open(output_file, 'w') as f:
-        json.dump(relevant_people, f, indent=2, ensure_ascii=False)
+        if args.columnar:
+            columnar_file = output_file.replace('.json', '.wgcol')
+            write_columnar(relevant_people, columnar_file)
     
     print(f"✅ Enhanced dataset saved to {output_file}")
+    if args.columnar:
+        print(f"✅ Columnar copy saved to {columnar_file}")
     
     # Show statistics
     stats = {
         'total_processed': len(entity_ids),
-        'data_fetched': len(all_processed),
+        'data_fetched': data_fetched,
         'relevant_people': len(relevant_people),
         'with_photo': sum(1 for p in relevant_people if p.get('photo', '')),
         'with_coords': sum(1 for p in relevant_people if p.get('coords', '')),
         'with_article': sum(1 for p in relevant_people if p.get('article', '')),
         'with_citizenship': sum(1 for p in relevant_people if p.get('citizenship', '')),
         'with_occupation': sum(1 for p in relevant_people if p.get('occupation', '')),
+        'place_hierarchy_hit_rate': f"{hierarchy_hit_rate():.1%}",
+        'pruned_before_lookups': pruning_stats['pruned'],
+        'lookups_avoided': pruning_stats['lookups_avoided'],
+        'unchanged_since_last_run': len(unchanged_ids),
+        'dead_lettered': len(dead_letters),
     }
     
     print("\\nFinal Statistics:")
     for key, value in stats.items():
         print(f"- {key.replace('_', ' ').title()}: {value}")
+    metrics.extra['stats'] = stats
+
+def main():
+    args = parse_args()
+    with instrumentation.instrumented_run(args.report, args.profile_path if args.profile else None):
+        run(args)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import metrics
+
+USER_AGENT = 'WikiGame Data Fetcher 1.0'
+MAXLAG = 5  # seconds of replication lag we tolerate, see https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# MediaWiki error codes (in a 200 response) worth retrying; internal_api_error_<Exception> too
+RETRY_API_ERRORS = {'ratelimited', 'readonly'}
+
+class TransientError(requests.exceptions.RequestException):
+    """A failure worth trying again later (429, 5xx, maxlag, timeouts, truncated responses)"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class ApiError(requests.exceptions.HTTPError):
+    """A MediaWiki {"error": ...} response that retrying will not fix (bad parameters, no such entity, ...)"""
+
+    def __init__(self, code, info):
+        super().__init__(f"API error {code}: {info}")
+        self.code = code
+
+class CircuitOpenError(TransientError):
+    """Raised without sending anything while the circuit breaker is open"""
+
+class CircuitBreaker:
+    """Stops all requests for `cooldown` seconds after `threshold` consecutive failures
+
+    Once the cooldown has passed requests go through again (half-open): the
+    first success closes the circuit, the first failure restarts the cooldown.
+    """
+
+    def __init__(self, threshold=10, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds until requests are allowed again (0 when closed or half-open)"""
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def before_request(self):
+        with self.lock:
+            remaining = self.remaining()
+        if remaining > 0:
+            raise CircuitOpenError(f"circuit open for another {remaining:.0f}s", retry_after=remaining)
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                print("  -> API reachable again, closing the circuit")
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"  -> {self.failures} failures in a row, pausing requests for {self.cooldown:.0f}s")
+                self.opened_at = time.monotonic()
+
+    def wait(self):
+        """Sleep until requests are allowed again"""
+        remaining = self.remaining()
+        if remaining:
+            time.sleep(remaining)
+
+class TokenBucket:
+    """Thread-safe token bucket limiting how many requests start per second"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RateLimitedSession(requests.Session):
+    """requests.Session that takes a token from a shared bucket before every request"""
+
+    def __init__(self, bucket=None):
+        super().__init__()
+        self.bucket = bucket
+
+    def request(self, *args, **kwargs):
+        if self.bucket:
+            self.bucket.acquire()
+        return super().request(*args, **kwargs)
+
+def make_session(pool_size=10, rate=None):
+    """Create a pooled, optionally rate-limited session shared by all workers"""
+    session = RateLimitedSession(TokenBucket(rate) if rate else None)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT})
+    session.hooks['response'].append(metrics.record_response)
+    session.breaker = CircuitBreaker()
+    return session
+
+def parse_retry_after(response):
+    """Seconds to wait according to a Retry-After header (delta or HTTP date), or None"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def retry_with_backoff(func, retries=5, base_delay=2.0, max_delay=60.0,
+                       exceptions=(requests.exceptions.RequestException,)):
+    """Call func(), retrying failures with jittered exponential backoff at most `retries` times
+
+    A server-provided wait (the retry_after of a TransientError) wins over the
+    backoff; an open circuit is never retried here.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except CircuitOpenError:
+            raise
+        except exceptions as e:
+            if attempt == retries:
+                raise
+            delay = getattr(e, 'retry_after', None)
+            if delay is None:
+                # Equal jitter: at least half the backoff, so parallel workers spread out
+                backoff = min(max_delay, base_delay * 2 ** attempt)
+                delay = backoff / 2 + random.uniform(0, backoff / 2)
+            delay = min(max_delay, delay)
+            print(f"  -> {e}. Retrying in {delay:.1f}s ({attempt + 1}/{retries})...")
+            time.sleep(delay)
+
+def get_json(session, url, params, timeout=30, retries=5, base_delay=1.0, max_delay=60.0):
+    """GET a MediaWiki API URL and return the decoded JSON, retrying transient failures
+
+    Raises TransientError when retries run out (CircuitOpenError straight away
+    while the session's breaker is open) and HTTPError for permanent failures,
+    including ApiError for an error body the API sends with HTTP 200.
+    """
+    breaker = getattr(session, 'breaker', None)
+
+    def attempt():
+        if breaker:
+            breaker.before_request()
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if breaker:
+                breaker.record_failure()
+            raise TransientError(str(e)) from e
+
+        if response.status_code in RETRY_STATUSES:
+            if breaker:
+                breaker.record_failure()
+            raise TransientError(f"HTTP {response.status_code} from {url}", parse_retry_after(response))
+        response.raise_for_status()
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise TransientError(f"Unreadable response from {url}: {e}") from e
+
+        error = data.get('error') if isinstance(data, dict) else None
+        if error and error.get('code') == 'maxlag':
+            # The servers are fine, just lagging: back off without tripping the breaker
+            retry_after = parse_retry_after(response)
+            raise TransientError(f"maxlag: {error.get('info', 'replication lag')}",
+                                 MAXLAG if retry_after is None else retry_after)
+        if error:
+            code, info = error.get('code', 'unknown'), error.get('info', '')
+            if code in RETRY_API_ERRORS or code.startswith('internal_api_error_'):
+                if breaker:
+                    breaker.record_failure()
+                raise TransientError(f"API error {code}: {info}", parse_retry_after(response))
+            raise ApiError(code, info)
+
+        if breaker:
+            breaker.record_success()
+        return data
+
+    return retry_with_backoff(attempt, retries, base_delay, max_delay, exceptions=(TransientError,))
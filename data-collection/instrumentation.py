@@ -0,0 +1,220 @@
+import cProfile
+import json
+import pstats
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from entity_cache import split_key
+
+# Run instrumentation shared by the data-collection scripts: wall time per
+# stage (fetch, parse, labels, places, article, serialize, ...) excluding the
+# stages nested inside it, HTTP request counts, bytes and latency histograms
+# keyed by the stage that sent them, and label_cache hit rates. Everything
+# lands in one JSON run report.
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_MISSING = object()
+
+class Metrics:
+    """Thread-safe counters for one run"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.started = time.perf_counter()
+            self.stages = {}
+            self.http = {}
+            self.cache = {}
+            self.extra = {}
+
+    def current_stage(self):
+        stack = getattr(self.local, 'stack', None)
+        return stack[-1] if stack else 'other'
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block (or, used as a decorator, a function) as part of stage `name`
+
+        Stages nest (labels inside places, ...). `seconds` is the time spent
+        in the stage itself, nested stages excluded, so the stages of one
+        thread add up to its wall time; `inclusive_seconds` keeps the total.
+        """
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+            self.local.nested = []  # seconds spent in nested stages, one slot per open stage
+        stack, nested = self.local.stack, self.local.nested
+        # Re-entering the stage we're already in (get_place_with_country ->
+        # prefetch_places) must not count the same time twice
+        if stack and stack[-1] == name:
+            yield
+            return
+
+        stack.append(name)
+        nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            exclusive = elapsed - nested.pop()
+            if nested:
+                nested[-1] += elapsed
+            with self.lock:
+                entry = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'inclusive_seconds': 0.0})
+                entry['calls'] += 1
+                entry['seconds'] += exclusive
+                entry['inclusive_seconds'] += elapsed
+
+    def record_response(self, response, *args, **kwargs):
+        """requests response hook: count the request against the current stage"""
+        start = time.perf_counter()
+        size = len(response.content)
+        seconds = response.elapsed.total_seconds() + (time.perf_counter() - start)
+        latency_ms = seconds * 1000
+        bucket = next((f"<={limit}ms" for limit in LATENCY_BUCKETS_MS if latency_ms <= limit),
+                      f">{LATENCY_BUCKETS_MS[-1]}ms")
+
+        with self.lock:
+            entry = self.http.setdefault(self.current_stage(), {
+                'requests': 0, 'errors': 0, 'bytes': 0, 'seconds': 0.0, 'max_ms': 0.0, 'histogram': Counter()
+            })
+            entry['requests'] += 1
+            entry['errors'] += response.status_code >= 400
+            entry['bytes'] += size
+            entry['seconds'] += seconds
+            entry['max_ms'] = max(entry['max_ms'], latency_ms)
+            entry['histogram'][bucket] += 1
+        return response
+
+    def record_cache(self, key, hit):
+        kind = split_key(key)[0] if isinstance(key, str) else 'other'
+        with self.lock:
+            self.cache.setdefault(kind, Counter())['hits' if hit else 'misses'] += 1
+
+    def report(self):
+        """The run so far as a JSON-serialisable dict"""
+        wall = time.perf_counter() - self.started
+        with self.lock:
+            stages = {
+                name: {**entry, 'share': entry['seconds'] / wall if wall else 0.0}
+                for name, entry in sorted(self.stages.items(), key=lambda item: -item[1]['seconds'])
+            }
+            http = {}
+            for name, entry in self.http.items():
+                http[name] = {
+                    **entry,
+                    'mean_ms': entry['seconds'] * 1000 / entry['requests'],
+                    'histogram': {bucket: entry['histogram'][bucket]
+                                  for bucket in [f"<={limit}ms" for limit in LATENCY_BUCKETS_MS]
+                                  + [f">{LATENCY_BUCKETS_MS[-1]}ms"] if entry['histogram'][bucket]},
+                }
+            cache = {
+                kind: {'hits': counts['hits'], 'misses': counts['misses'],
+                       'hit_rate': counts['hits'] / (counts['hits'] + counts['misses'])}
+                for kind, counts in self.cache.items()
+            }
+            return {
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started_at)),
+                'wall_seconds': wall,
+                'stages': stages,
+                'http': http,
+                'http_totals': {
+                    'requests': sum(entry['requests'] for entry in http.values()),
+                    'errors': sum(entry['errors'] for entry in http.values()),
+                    'bytes': sum(entry['bytes'] for entry in http.values()),
+                },
+                'cache': cache,
+                **self.extra,
+            }
+
+metrics = Metrics()
+
+class CountingCache:
+    """Wraps label_cache (a dict or EntityCache) and counts hits and misses per key kind
+
+    `in` and get() count a lookup; peek() reads without counting, for code
+    that rereads a key whose lookup was already counted.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __contains__(self, key):
+        hit = key in self.cache
+        metrics.record_cache(key, hit)
+        return hit
+
+    def get(self, key, default=None):
+        value = self.cache.get(key, _MISSING)
+        metrics.record_cache(key, value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def peek(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def __getitem__(self, key):
+        return self.cache[key]
+
+    def __setitem__(self, key, value):
+        self.cache[key] = value
+
+    def setdefault(self, key, default=None):
+        return self.cache.setdefault(key, default)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __getattr__(self, name):
+        # close(), flush(), clear(), ... go straight to the wrapped cache
+        return getattr(self.cache, name)
+
+def add_arguments(parser, default_report):
+    parser.add_argument('--report', default=default_report,
+                        help="Where to write the JSON run report (stage timings, HTTP and cache stats)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Run under cProfile (main thread only) and save the stats to --profile-path")
+    parser.add_argument('--profile-path', default='profile.pstats')
+
+@contextmanager
+def instrumented_run(report_path=None, profile_path=None):
+    """Reset the metrics, optionally profile, and write the report when the run ends"""
+    metrics.reset()
+    profiler = cProfile.Profile() if profile_path else None
+    if profiler:
+        profiler.enable()
+    try:
+        yield metrics
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+            print(f"\n🔬 Profile saved to {profile_path}, top functions by cumulative time:")
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
+
+        report = metrics.report()
+        print_summary(report)
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"📊 Run report saved to {report_path}")
+
+def print_summary(report):
+    print(f"\n⏱️  {report['wall_seconds']:.1f}s wall time (stage times are summed over threads)")
+    for name, entry in report['stages'].items():
+        nested = entry['inclusive_seconds'] - entry['seconds']
+        print(f"- {name}: {entry['seconds']:.2f}s over {entry['calls']} calls ({entry['share']:.0%})"
+              + (f", plus {nested:.2f}s in nested stages" if nested >= 0.005 else ''))
+    totals = report['http_totals']
+    if totals['requests']:
+        print(f"- HTTP: {totals['requests']} requests, {totals['errors']} errors, {totals['bytes'] / 1024:.0f} KB")
+    for kind, entry in report['cache'].items():
+        print(f"- cache {kind}: {entry['hit_rate']:.1%} hit rate ({entry['hits']} hits, {entry['misses']} misses)")
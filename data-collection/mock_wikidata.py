@@ -0,0 +1,466 @@
+import bz2
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import sparql_enrichment
+
+# Local stand-in for the Wikidata API, used by benchmark.py to measure
+# request counts and throughput without touching the real service.
+
+def make_synthetic_entities(num_people, seed=0):
+    """Build a fake Wikidata graph of people, places, countries and occupations"""
+    rng = random.Random(seed)
+    entities = {}
+
+    def item(qid, label, claims=None):
+        entities[qid] = {
+            'type': 'item',
+            'id': qid,
+            'labels': {'en': {'language': 'en', 'value': label}},
+            'claims': claims or {},
+            'sitelinks': {},
+            'lastrevid': 1_000_000 + len(entities),
+            'modified': "2024-01-01T00:00:00Z",
+        }
+        return qid
+
+    def entity_claim(qid):
+        return {'mainsnak': {'datavalue': {'value': {'id': qid}}}}
+
+    def value_claim(value):
+        return {'mainsnak': {'datavalue': {'value': value}}}
+
+    countries = [item(f"Q{1000 + i}", f"Country {i}") for i in range(40)]
+    provinces = [
+        item(f"Q{1500 + i}", f"Province {i}", {'P17': [entity_claim(rng.choice(countries))]})
+        for i in range(100)
+    ]
+    regions = []
+    for i in range(200):
+        # A few regions sit below a province, giving towns a two-hop path to their country
+        if rng.random() < 0.3:
+            claims = {'P131': [entity_claim(rng.choice(provinces))]}
+        else:
+            claims = {'P17': [entity_claim(rng.choice(countries))]}
+        regions.append(item(f"Q{2000 + i}", f"Region {i}", claims))
+    places = []
+    for i in range(2000):
+        # Some towns only know their region, so the country has to be found via P131
+        if rng.random() < 0.3:
+            claims = {'P131': [entity_claim(rng.choice(regions))]}
+        else:
+            claims = {'P17': [entity_claim(rng.choice(countries))]}
+        places.append(item(f"Q{10000 + i}", f"Town {i}", claims))
+    occupations = [item(f"Q{3000 + i}", f"occupation {i}") for i in range(300)]
+    genders = [item("Q6581097", "male"), item("Q6581072", "female")]
+
+    people = []
+    for i in range(num_people):
+        qid = f"Q{100000 + i}"
+        year = rng.randint(1500, 1990)
+        claims = {
+            'P569': [value_claim({'time': f"+{year}-01-01T00:00:00Z"})],
+            'P570': [value_claim({'time': f"+{year + rng.randint(10, 90)}-01-01T00:00:00Z"})],
+            'P21': [entity_claim(rng.choice(genders))],
+            'P19': [entity_claim(rng.choice(places))],
+            'P20': [entity_claim(rng.choice(places))],
+            'P27': [entity_claim(c) for c in rng.sample(countries, rng.randint(1, 3))],
+            'P106': [entity_claim(o) for o in rng.sample(occupations, rng.randint(1, 4))],
+        }
+        if rng.random() < 0.8:
+            claims['P18'] = [value_claim(f"Person {i}.jpg")]
+        item(qid, f"Person {i}", claims)
+        if rng.random() < 0.9:
+            entities[qid]['sitelinks']['enwiki'] = {'site': 'enwiki', 'title': f"Person {i}"}
+        people.append(qid)
+
+    return entities, people
+
+def people_to_rows(entities, people, causes=None):
+    """Build humans_filtered_cleaned.json style rows for synthetic people
+
+    `causes` is a list of (cause QID, label) handed out round robin; by
+    default everyone died of a gunshot wound.
+    """
+    causes = causes or [("Q2140674", "gunshot wound")]
+    return [
+        {
+            'person': f"http://www.wikidata.org/entity/{qid}",
+            'personLabel': entities[qid]['labels']['en']['value'],
+            'causeOfDeath': f"http://www.wikidata.org/entity/{causes[i % len(causes)][0]}",
+            'causeOfDeathLabel': causes[i % len(causes)][1],
+        }
+        for i, qid in enumerate(people)
+    ]
+
+def write_dump(entities, path):
+    """Write entities in the one-entity-per-line layout of the Wikidata JSON dumps"""
+    opener = gzip.open if path.endswith('.gz') else bz2.open if path.endswith('.bz2') else open
+    with opener(path, 'wt', encoding='utf-8') as f:
+        f.write('[\n')
+        lines = [json.dumps(entity, ensure_ascii=False, separators=(',', ':')) for entity in entities.values()]
+        f.write(',\n'.join(lines))
+        f.write('\n]\n')
+
+def load_pages(directory):
+    """{title: html} from a directory of saved pages (wikipedia_sections.py --save-html)"""
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                pages[urllib.parse.unquote(name[:-len('.html')]).replace('_', ' ')] = f.read()
+    return pages
+
+def save_fixture(path, entities, people, rows):
+    """Save a replayable fixture: the entity graph, the people in it and their SPARQL rows"""
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=1) as f:
+        json.dump({'people': people, 'rows': rows, 'entities': entities}, f, ensure_ascii=False)
+
+def load_fixture(path):
+    """Load a fixture written by save_fixture, returning (entities, people, rows)"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        fixture = json.load(f)
+    return fixture['entities'], fixture['people'], fixture['rows']
+
+class CannedSparql:
+    """Answers the cause-count and partition queries of fetch_causes_of_death from canned rows"""
+
+    FIELDS = ['person', 'personLabel', 'causeOfDeath', 'causeOfDeathLabel']
+
+    def __init__(self, rows):
+        self.rows = sorted(rows, key=lambda row: row['person'])
+
+    def __call__(self, query):
+        out = io.StringIO()
+        if 'COUNT(' in query:
+            counts = {}
+            for row in self.rows:
+                counts[row['causeOfDeath']] = counts.get(row['causeOfDeath'], 0) + 1
+            writer = csv.writer(out)
+            writer.writerow(['causeOfDeath', 'count'])
+            writer.writerows(sorted(counts.items()))
+            return out.getvalue()
+
+        causes = set(re.findall(r'wd:(Q\d+)', re.search(r'VALUES \?causeOfDeath \{([^}]*)\}', query).group(1)))
+        after = re.search(r'STR\(\?person\) > "([^"]+)"', query)
+        limit = re.search(r'LIMIT (\d+)', query)
+
+        rows = [row for row in self.rows if row['causeOfDeath'].split('/')[-1] in causes]
+        if after:
+            rows = [row for row in rows if row['person'] > after.group(1)]
+        if limit:
+            rows = rows[:int(limit.group(1))]
+
+        writer = csv.DictWriter(out, fieldnames=self.FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+
+class EnrichmentSparql:
+    """Answers sparql_enrichment's people query by evaluating it over an entity dict
+
+    Follows the query's semantics (first value for SAMPLE, direct P17 only,
+    the QID standing in for a missing label). Like the real endpoint,
+    GROUP_CONCAT comes back in a different order from one query to the next.
+    """
+
+    def __init__(self, entities, seed=0):
+        self.entities = entities
+        self.rng = random.Random(seed)
+
+    def group_concat(self, entity, prop):
+        pairs = list(dict.fromkeys(self.pair(value['id']) for value in self.values(entity, prop)))
+        self.rng.shuffle(pairs)
+        return sparql_enrichment.LIST_SEPARATOR.join(pairs)
+
+    def label(self, qid):
+        labels = self.entities.get(qid, {}).get('labels', {})
+        return labels['en']['value'] if 'en' in labels else qid
+
+    def values(self, entity, prop):
+        return [claim['mainsnak']['datavalue']['value'] for claim in entity['claims'].get(prop, [])
+                if 'datavalue' in claim.get('mainsnak', {})]
+
+    def pair(self, qid):
+        return f"{qid}={self.label(qid)}"
+
+    def place(self, entity, prop):
+        place_ids = [value['id'] for value in self.values(entity, prop)]
+        if not place_ids:
+            return ''
+        place = self.entities.get(place_ids[0], {'claims': {}})
+        countries = [value['id'] for value in self.values(place, 'P17')]
+        return f"{self.pair(place_ids[0])}={self.label(countries[0]) if countries else ''}"
+
+    def time(self, entity, prop):
+        times = self.values(entity, prop)
+        if not times:
+            return ''
+        # RDF renders the JSON "+1900-00-00T00:00:00Z" as an xsd:dateTime with precision alongside
+        sign, year, month, day, clock = re.match(r'([+-])(\d+)-(\d\d)-(\d\d)T(.*)', times[0]['time']).groups()
+        year = int(year) if sign == '+' else 1 - int(year)
+        rdf_year = f"{year:04d}" if year >= 0 else f"-{-year:04d}"
+        precision = times[0].get('precision', 11)
+        return f"{rdf_year}-{month if month != '00' else '01'}-{day if day != '00' else '01'}T{clock}/{precision}"
+
+    def __call__(self, query):
+        ids = re.findall(r'wd:(Q\d+)', re.search(r'VALUES \?person \{([^}]*)\}', query).group(1))
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(sparql_enrichment.COLUMNS)
+        for qid in dict.fromkeys(ids):
+            entity = self.entities.get(qid)
+            if entity is None:
+                continue
+            photos = self.values(entity, 'P18')
+            coords = self.values(entity, 'P625')
+            genders = [value['id'] for value in self.values(entity, 'P21')]
+            enwiki = entity.get('sitelinks', {}).get('enwiki')
+            writer.writerow([
+                f"http://www.wikidata.org/entity/{qid}",
+                entity['lastrevid'],
+                entity['modified'],
+                self.label(qid),
+                self.time(entity, 'P569'),
+                self.time(entity, 'P570'),
+                f"{sparql_enrichment.FILE_PATH_PREFIX}{urllib.parse.quote(photos[0])}" if photos else '',
+                f"Point({coords[0]['longitude']} {coords[0]['latitude']})" if coords else '',
+                self.pair(genders[0]) if genders else '',
+                self.place(entity, 'P19'),
+                self.place(entity, 'P20'),
+                self.group_concat(entity, 'P27'),
+                self.group_concat(entity, 'P106'),
+                enwiki['title'] if enwiki else '',
+            ])
+        return out.getvalue()
+
+class MockWikidata:
+    """Threaded HTTP server answering wbgetentities from an in-memory entity dict
+
+    Requests to /sparql are passed to `sparql`, a callable returning CSV text.
+    `error_rate` makes that fraction of requests fail with a 503 and
+    `maxlag_rate` that fraction of API requests answer with a maxlag error;
+    both carry a Retry-After header when `retry_after` is set. `pages` maps
+    Wikipedia article titles to the HTML that action=parse returns, and
+    `redirects` maps redirect titles to the pages they point at. `images`
+    maps Commons file names to (width, height, mime) for prop=imageinfo.
+    """
+
+    def __init__(self, entities, latency=0.0, sparql=None, error_rate=0.0, seed=0, maxlag_rate=0.0,
+                 retry_after=None, pages=None, redirects=None, images=None):
+        self.entities = entities
+        self.pages = pages or {}
+        self.redirects = redirects or {}
+        self.images = images or {}
+        self.page_revisions = {title: 2_000_000 + i for i, title in enumerate(sorted(self.pages))}
+        self.latency = latency
+        self.sparql = sparql
+        self.error_rate = error_rate
+        self.maxlag_rate = maxlag_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.revision = max((entity.get('lastrevid', 0) for entity in entities.values()), default=0)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def url(self):
+        return f"{self.base_url}/w/api.php"
+
+    @property
+    def sparql_url(self):
+        return f"{self.base_url}/sparql"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+
+    def edit_entity(self, qid, label=None, claims=None):
+        """Simulate an edit on Wikidata: optionally change the entity and bump its revision"""
+        entity = self.entities[qid]
+        if label is not None:
+            entity['labels']['en']['value'] = label
+        if claims:
+            entity['claims'].update(claims)
+        with self._lock:
+            self.revision = max(self.revision, entity['lastrevid']) + 1
+            entity['lastrevid'] = self.revision
+        entity['modified'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    def handle_api(self, params):
+        """Return the JSON body for a parsed api.php query"""
+        action = params.get('action', '')
+        if action == 'parse':
+            return self.handle_parse(params)
+        if action == 'query':
+            return self.handle_query(params)
+        if action != 'wbgetentities':
+            return 400, {'error': {'code': 'badvalue', 'info': f"Unsupported action {action}"}}
+
+        props = params.get('props', 'info|sitelinks|aliases|labels|descriptions|claims').split('|')
+        result = {}
+        for qid in params.get('ids', '').split('|'):
+            entity = self.entities.get(qid)
+            if entity is None:
+                result[qid] = {'id': qid, 'missing': ''}
+                continue
+            result[qid] = {'type': entity['type'], 'id': qid}
+            for prop in props:
+                if prop in entity:
+                    result[qid][prop] = entity[prop]
+            if 'info' in props:
+                result[qid].update(lastrevid=entity['lastrevid'], modified=entity['modified'],
+                                   title=qid, ns=0)
+            if 'sitelinks' in result[qid] and 'sitefilter' in params:
+                sites = params['sitefilter'].split('|')
+                result[qid]['sitelinks'] = {
+                    site: link for site, link in entity['sitelinks'].items() if site in sites
+                }
+        return 200, {'entities': result, 'success': 1}
+
+    def image_info(self, name, thumb_width):
+        """imageinfo for a file, with URLs laid out like upload.wikimedia.org's"""
+        width, height, mime = self.images[name]
+        filename = name.replace(' ', '_')
+        digest = hashlib.md5(filename.encode('utf-8')).hexdigest()
+        url = f"https://upload.wikimedia.org/wikipedia/commons/{digest[0]}/{digest[:2]}/{filename}"
+        info = {'url': url, 'descriptionurl': f"https://commons.wikimedia.org/wiki/File:{filename}",
+                'width': width, 'height': height, 'mime': mime, 'size': width * height}
+        if thumb_width:
+            if mime == 'image/svg+xml':
+                thumb = f"{thumb_width}px-{filename}.png"
+            elif mime in ('image/tiff', 'application/pdf'):
+                thumb = f"page1-{thumb_width}px-{filename}.jpg"
+            elif thumb_width < width:
+                thumb = f"{thumb_width}px-{filename}"
+            else:
+                thumb = None  # MediaWiki doesn't upscale bitmaps
+            scale = min(thumb_width, width) / width
+            info.update(thumburl=url.replace('/commons/', '/commons/thumb/', 1) + f"/{thumb}" if thumb else url,
+                        thumbwidth=round(width * scale), thumbheight=round(height * scale))
+        return info
+
+    def handle_query(self, params):
+        """action=query&titles=...&prop=info|imageinfo, with normalisation and redirects like MediaWiki"""
+        normalized, redirects, pages = [], [], []
+        imageinfo = params.get('prop') == 'imageinfo'
+        for title in params.get('titles', '').split('|'):
+            name = title.replace('_', ' ')
+            name = name[:1].upper() + name[1:]
+            if name != title:
+                normalized.append({'from': title, 'to': name})
+            if name in self.redirects and 'redirects' in params:
+                redirects.append({'from': name, 'to': self.redirects[name]})
+                name = self.redirects[name]
+            if imageinfo:
+                file_name = name[len('File:'):]
+                if name.startswith('File:') and file_name in self.images:
+                    pages.append({'ns': 6, 'title': name, 'imagerepository': 'local',
+                                  'imageinfo': [self.image_info(file_name, int(params.get('iiurlwidth', 0)))]})
+                else:
+                    pages.append({'ns': 6, 'title': name, 'missing': True})
+            elif name in self.pages:
+                pages.append({'ns': 0, 'title': name, 'pageid': self.page_revisions[name] - 2_000_000 + 1,
+                              'lastrevid': self.page_revisions[name]})
+            else:
+                pages.append({'ns': 0, 'title': name, 'missing': True})
+        query = {'pages': pages}
+        if normalized:
+            query['normalized'] = normalized
+        if redirects:
+            query['redirects'] = redirects
+        return 200, {'batchcomplete': True, 'query': query}
+
+    def handle_parse(self, params):
+        title = params.get('page', '')
+        if 'oldid' in params:
+            revid = int(params['oldid'])
+            title = next((name for name, rev in self.page_revisions.items() if rev == revid), None)
+            if title is None:
+                return 200, {'error': {'code': 'nosuchrevid', 'info': f"There is no revision with ID {revid}."}}
+        if title not in self.pages:
+            return 200, {'error': {'code': 'missingtitle', 'info': "The page you specified doesn't exist."}}
+        return 200, {'parse': {'title': title, 'pageid': 1, 'text': self.pages[title]}}
+
+    def edit_page(self, title, page_html):
+        """Simulate an edit on Wikipedia: replace the page HTML and give it a new revision"""
+        self.pages[title] = page_html
+        with self._lock:
+            self.page_revisions[title] = max(self.page_revisions.values(), default=2_000_000) + 1
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                self.handle_request(parsed, dict(urllib.parse.parse_qsl(parsed.query)))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                self.handle_request(urllib.parse.urlparse(self.path), dict(urllib.parse.parse_qsl(body)))
+
+            def handle_request(self, parsed, params):
+                with mock._lock:
+                    mock.calls[params.get('action', parsed.path)] += 1
+                    fail = mock.error_rate and mock.rng.random() < mock.error_rate
+                    lagged = mock.maxlag_rate and mock.rng.random() < mock.maxlag_rate
+                if mock.latency:
+                    time.sleep(mock.latency)
+
+                if fail:
+                    self.respond(503, 'text/plain', b'Service Unavailable', throttled=True)
+                elif lagged and parsed.path != '/sparql':
+                    body = {'error': {'code': 'maxlag', 'info': 'Waiting for a server: 6 seconds lagged', 'lag': 6}}
+                    self.respond(200, 'application/json', json.dumps(body).encode('utf-8'), throttled=True)
+                elif parsed.path == '/sparql' and mock.sparql:
+                    self.respond(200, 'text/csv', mock.sparql(params.get('query', '')).encode('utf-8'))
+                else:
+                    status, body = mock.handle_api(params)
+                    self.respond(status, 'application/json', json.dumps(body).encode('utf-8'))
+
+            def respond(self, status, content_type, payload, throttled=False):
+                self.send_response(status)
+                self.send_header('Content-Type', f"{content_type}; charset=utf-8")
+                self.send_header('Content-Length', str(len(payload)))
+                if throttled and mock.retry_after is not None:
+                    self.send_header('Retry-After', str(mock.retry_after))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
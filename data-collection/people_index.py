@@ -0,0 +1,272 @@
+import argparse
+import json
+import random
+import re
+from array import array
+
+import columnar
+from columnar import ENTITY_PREFIX
+from compact_store import CompactStore
+
+# In-memory index over the enriched people for dealing game rounds. The
+# dataset is loaded once into array-backed columns (birth and death year,
+# cause code, citizenship and occupation codes) with inverted indexes from
+# every cause, country, occupation, birth decade and birth century to the
+# sorted rows of the people it covers.
+#
+# Rounds are balanced over causes: a round of N people has N distinct causes,
+# each picked with equal chance however many people died of it, optionally
+# all from the same century (or decade, country, occupation). Per facet
+# value the people are also grouped by cause, so an unfiltered round costs a
+# few random picks rather than a scan.
+
+FACETS = ('cause', 'country', 'occupation', 'decade', 'century')
+NO_YEAR = -2 ** 31  # birth/death year column value for an unknown or unparseable date
+YEAR_RE = re.compile(r'([+-]?)(\d+)-')
+
+# Only these fields are read from the enriched records
+INDEXED_FIELDS = ('person', 'personLabel', 'birthDate', 'deathDate', 'causeOfDeathLabel', 'citizenship',
+                  'occupation')
+
+def parse_year(value):
+    """Year of a Wikidata time string like "+1912-11-15T00:00:00Z", or None"""
+    match = YEAR_RE.match(value) if isinstance(value, str) else None
+    if not match:
+        return None
+    return -int(match.group(2)) if match.group(1) == '-' else int(match.group(2))
+
+def split_list(value):
+    """Values of a pipe-joined field such as citizenship"""
+    return [item for item in value.split('|') if item] if value else []
+
+class _Codes:
+    """Dictionary encoding of the distinct values in one column"""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        if value not in self.codes:
+            self.codes[value] = len(self.values)
+            self.values.append(value)
+        return self.codes[value]
+
+class PeopleIndex:
+    """Columns and inverted indexes over a list of enriched person records"""
+
+    def __init__(self, records):
+        self.qids = array('I')
+        self.labels = []
+        self.birth_years = array('i')
+        self.death_years = array('i')
+        self.cause_codes = array('H')
+        # Multi-valued columns: row i's codes are codes[offsets[i]:offsets[i + 1]]
+        self.country_offsets, self.country_codes = array('I', [0]), array('I')
+        self.occupation_offsets, self.occupation_codes = array('I', [0]), array('I')
+
+        causes, countries, occupations = _Codes(), _Codes(), _Codes()
+        postings = {facet: {} for facet in FACETS}
+        by_cause = {facet: {} for facet in FACETS if facet != 'cause'}
+
+        for row, record in enumerate(records):
+            self.qids.append(int(record['person'][len(ENTITY_PREFIX):]))
+            self.labels.append(record.get('personLabel') or '')
+            birth_year = parse_year(record.get('birthDate'))
+            death_year = parse_year(record.get('deathDate'))
+            self.birth_years.append(NO_YEAR if birth_year is None else birth_year)
+            self.death_years.append(NO_YEAR if death_year is None else death_year)
+
+            cause = record.get('causeOfDeathLabel') or ''
+            cause_code = causes.code(cause)
+            self.cause_codes.append(cause_code)
+            citizenship = list(dict.fromkeys(split_list(record.get('citizenship'))))
+            occupation = list(dict.fromkeys(split_list(record.get('occupation'))))
+            self.country_codes.extend(countries.code(country) for country in citizenship)
+            self.country_offsets.append(len(self.country_codes))
+            self.occupation_codes.extend(occupations.code(job) for job in occupation)
+            self.occupation_offsets.append(len(self.occupation_codes))
+
+            keys = {'cause': [cause], 'country': citizenship, 'occupation': occupation, 'decade': [], 'century': []}
+            if birth_year is not None:
+                keys['decade'] = [birth_year // 10 * 10]
+                keys['century'] = [birth_year // 100 * 100]
+            for facet, values in keys.items():
+                for value in values:
+                    postings[facet].setdefault(value, array('I')).append(row)
+                    if facet != 'cause':
+                        by_cause[facet].setdefault(value, {}).setdefault(cause_code, array('I')).append(row)
+
+        self.causes = causes.values
+        self.countries = countries.values
+        self.occupations = occupations.values
+        self.postings = postings  # rows were appended in order, so every list is sorted
+        self.by_cause = by_cause
+        self.all_causes = {code: postings['cause'][cause] for code, cause in enumerate(self.causes)}
+        self._eligible = {}
+        self._sets = {}  # (facet, value) -> frozenset of rows, built the first time an intersection needs it
+
+    def __len__(self):
+        return len(self.qids)
+
+    def values(self, facet):
+        """Every value of a facet, e.g. all causes or all birth centuries"""
+        return list(self.postings[facet])
+
+    def person(self, row):
+        """The indexed fields of one row as a plain dict"""
+        birth_year, death_year = self.birth_years[row], self.death_years[row]
+        return {
+            'qid': f"Q{self.qids[row]}",
+            'label': self.labels[row],
+            'birthYear': None if birth_year == NO_YEAR else birth_year,
+            'deathYear': None if death_year == NO_YEAR else death_year,
+            'causeOfDeathLabel': self.causes[self.cause_codes[row]],
+            'citizenship': self._facet_values(row, 'country'),
+            'occupation': self._facet_values(row, 'occupation'),
+        }
+
+    def select(self, **filters):
+        """Sorted rows matching every facet=value filter, e.g. select(country='France', century=1800)"""
+        lists = []
+        for facet, value in filters.items():
+            if facet not in self.postings:
+                raise ValueError(f"Unknown facet {facet!r}, expected one of {', '.join(FACETS)}")
+            if value not in self.postings[facet]:
+                return []
+            lists.append((facet, value, self.postings[facet][value]))
+        if not lists:
+            return list(range(len(self)))
+
+        # Test the shortest list against (cached) sets of the others
+        lists.sort(key=lambda item: len(item[2]))
+        rows = lists[0][2]
+        for facet, value, other in lists[1:]:
+            rows = self._row_set(facet, value, other).intersection(rows)
+        return sorted(rows)
+
+    def _row_set(self, facet, value, rows):
+        key = (facet, value)
+        if key not in self._sets:
+            self._sets[key] = frozenset(rows)
+        return self._sets[key]
+
+    def count(self, **filters):
+        if len(filters) == 1:
+            (facet, value), = filters.items()
+            if facet in self.postings:
+                return len(self.postings[facet].get(value, ()))
+        return len(self.select(**filters))
+
+    def sample(self, size, rng=random, **filters):
+        """`size` random people matching the filters, fewer if not that many match"""
+        rows = self.select(**filters) if filters else range(len(self))
+        return [self.person(row) for row in rng.sample(rows, min(size, len(rows)))]
+
+    def _facet_values(self, row, facet):
+        """Values of a multi-valued or year facet for one row"""
+        if facet == 'country':
+            codes = self.country_codes[self.country_offsets[row]:self.country_offsets[row + 1]]
+            return [self.countries[code] for code in codes]
+        if facet == 'occupation':
+            codes = self.occupation_codes[self.occupation_offsets[row]:self.occupation_offsets[row + 1]]
+            return [self.occupations[code] for code in codes]
+        year = self.birth_years[row]
+        if year == NO_YEAR:
+            return []
+        return [year // 10 * 10] if facet == 'decade' else [year // 100 * 100]
+
+    def _eligible_values(self, facet, size):
+        """Values of `facet` with people of at least `size` distinct causes, cached per round size"""
+        key = (facet, size)
+        if key not in self._eligible:
+            self._eligible[key] = [value for value, pools in self.by_cause[facet].items() if len(pools) >= size]
+        return self._eligible[key]
+
+    def _filtered_pools(self, same, size, rng, filters):
+        """{cause code: rows} for the filtered people, all sharing one random value of `same`"""
+        if same is None or same in filters:
+            values = [None]
+        else:
+            # The first value in random order with enough causes is a uniform pick among those that have
+            values = rng.sample(self.values(same), len(self.postings[same]))
+        for value in values:
+            pools = {}
+            for row in self.select(**filters) if value is None else self.select(**{**filters, same: value}):
+                pools.setdefault(self.cause_codes[row], []).append(row)
+            if len(pools) >= size:
+                return pools
+        return {}
+
+    def sample_round(self, size, same=None, rng=random, **filters):
+        """`size` people with distinct causes, every cause equally likely
+
+        `same` names a facet (century, decade, country or occupation) all the
+        people share; its value is picked at random among those with enough
+        causes. Other facet=value filters narrow the people first. Raises
+        ValueError if no round of that size can be dealt.
+        """
+        if same is not None and same not in self.by_cause:
+            raise ValueError(f"Can't deal a round from the same {same!r}")
+        if same is None and len(filters) == 1 and 'cause' not in filters:
+            (facet, value), = filters.items()
+            if facet not in self.by_cause:
+                raise ValueError(f"Unknown facet {facet!r}, expected one of {', '.join(FACETS)}")
+            pools = self.by_cause[facet].get(value, {})
+        elif filters:
+            pools = self._filtered_pools(same, size, rng, filters)
+        elif same is None:
+            pools = self.all_causes
+        else:
+            eligible = self._eligible_values(same, size)
+            pools = self.by_cause[same][rng.choice(eligible)] if eligible else {}
+
+        if len(pools) < size:
+            raise ValueError(f"Not enough distinct causes for a round of {size}")
+        return [self.person(rng.choice(pools[cause])) for cause in rng.sample(list(pools), size)]
+
+def load_index(path):
+    """Build an index from enriched records in a .json list, .jsonl, columnar .wgcol or .wgstore file"""
+    if path.endswith('.wgstore'):
+        with CompactStore(path) as store:
+            return PeopleIndex(store)
+    if path.endswith('.wgcol'):
+        columns = columnar.load_columns(path, INDEXED_FIELDS)
+        rows = len(columns['person'])
+        records = ({name: values[row] for name, values in columns.items()} for row in range(rows))
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                records = [json.loads(line) for line in f if line.strip()]
+            else:
+                records = json.load(f)
+    return PeopleIndex(records)
+
+def main():
+    parser = argparse.ArgumentParser(description="Deal a balanced game round from the enriched people")
+    parser.add_argument('input', nargs='?', default='humans_enhanced_relevant.json',
+                        help="Enriched records (.json list, .jsonl, .wgcol or .wgstore)")
+    parser.add_argument('--size', type=int, default=4, help="People (and distinct causes) in the round")
+    parser.add_argument('--same', choices=['century', 'decade', 'country', 'occupation'],
+                        help="Facet every person in the round shares")
+    parser.add_argument('--seed', type=int)
+    for facet in FACETS:
+        parser.add_argument(f"--{facet}", type=int if facet in ('decade', 'century') else str,
+                            help=f"Only people with this {facet}")
+    args = parser.parse_args()
+
+    index = load_index(args.input)
+    filters = {facet: getattr(args, facet) for facet in FACETS if getattr(args, facet) is not None}
+    print(f"Indexed {len(index)} people: {len(index.causes)} causes, {len(index.countries)} countries, "
+          f"{len(index.occupations)} occupations, {len(index.postings['century'])} centuries")
+    try:
+        people = index.sample_round(args.size, args.same, random.Random(args.seed), **filters)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return
+    for person in people:
+        born = person['birthYear'] if person['birthYear'] is not None else '?'
+        print(f"- {person['qid']} {person['label']} (born {born}): {person['causeOfDeathLabel']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import csv
+import json
+
+import clean_data_rough
+import fetch_causes_of_death
+import fetch_enhanced_production as enrich
+import instrumentation
+import wikipedia_sections
+from entity_cache import DEFAULT_CACHE_PATH, EntityCache
+from http_client import make_session
+from instrumentation import metrics
+
+# Streaming version of fetch_causes_of_death -> clean_data_rough ->
+# fetch_enhanced_production. Every stage is a generator over row dicts, so
+# only the batches currently being enriched are held in memory.
+
+def source_sparql(_path=None):
+    """Rows straight from the Wikidata SPARQL endpoint"""
+    return fetch_causes_of_death.iter_rows()
+
+def source_csv(path='humans_filtered.csv'):
+    """Rows from a previously saved SPARQL CSV export"""
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+def source_json(path='humans_filtered_cleaned.json'):
+    """Rows from an already cleaned JSON list (loaded whole, kept for compatibility)"""
+    with open(path, 'r') as f:
+        yield from json.load(f)
+
+def source_jsonl(path):
+    """Rows from a JSONL file, one object per line"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+SOURCES = {
+    'sparql': source_sparql,
+    'csv': source_csv,
+    'json': source_json,
+    'jsonl': source_jsonl,
+}
+
+def stage_allowlist(rows, causes_file='causes_of_death.txt'):
+    """Keep only people whose cause of death is in the allowlist, matching by QID where known"""
+    allowlist = clean_data_rough.CauseAllowlist(causes_file)
+    yield from clean_data_rough.iter_allowed_rows(rows, allowlist)
+
+def stage_limit(rows, limit):
+    """Stop after the first `limit` rows"""
+    for i, row in enumerate(rows):
+        if i >= limit:
+            return
+        yield row
+
+def stage_enrich(rows, workers=1, rate=10.0):
+    """Enrich rows with Wikidata details, yielding only relevant people"""
+    session = make_session(pool_size=max(10, workers), rate=rate or None)
+    return enrich.iter_enriched(rows, session, workers=workers)
+
+def stage_sections(records, path, workers=4, rate=10.0, cache_path=DEFAULT_CACHE_PATH):
+    """Pass records through, saving their Wikipedia sections to a compressed store at `path`"""
+    session = make_session(pool_size=max(10, workers), rate=rate or None)
+    cache = EntityCache(cache_path) if cache_path else None
+    try:
+        with wikipedia_sections.SectionStore(path) as store:
+            for record, entry in wikipedia_sections.iter_sections(records, session, cache, workers=workers):
+                if entry is not None:
+                    store.write(entry)
+                yield record
+        print(f"📝 Saved sections for {store.count} people to {path}")
+    finally:
+        if cache is not None:
+            cache.close()
+
+def write_jsonl(records, path):
+    """Write records as they arrive, one JSON object per line"""
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            with metrics.stage('serialize'):
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+def build_pipeline(source, source_path=None, causes_file='causes_of_death.txt', limit=None,
+                   enrich_rows=True, workers=1, rate=10.0, sections_path=None):
+    """Chain the configured stages into one generator of output records"""
+    rows = SOURCES[source](source_path) if source_path else SOURCES[source]()
+    if causes_file:
+        rows = stage_allowlist(rows, causes_file)
+    if limit:
+        rows = stage_limit(rows, limit)
+    if enrich_rows:
+        rows = stage_enrich(rows, workers, rate)
+        if sections_path:
+            rows = stage_sections(rows, sections_path, max(workers, 4), rate)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SPARQL -> allowlist -> enrichment pipeline as a stream")
+    parser.add_argument('--source', choices=sorted(SOURCES), default='sparql')
+    parser.add_argument('--input', help="Input file for csv/json/jsonl sources")
+    parser.add_argument('--causes', default='causes_of_death.txt', help="Cause of death allowlist")
+    parser.add_argument('--no-filter', action='store_true', help="Skip the allowlist stage")
+    parser.add_argument('--no-enrich', action='store_true', help="Stop after filtering")
+    parser.add_argument('--limit', type=int, help="Only pass the first N filtered rows on")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=10.0)
+    parser.add_argument('--output', default='humans_enhanced_relevant.jsonl')
+    parser.add_argument('--sections', nargs='?', const='', metavar='PATH',
+                        help="Also extract Wikipedia sections into a gzipped store "
+                             "(default: <output>_sections.jsonl.gz)")
+    instrumentation.add_arguments(parser, 'pipeline_run_report.json')
+    args = parser.parse_args()
+
+    with instrumentation.instrumented_run(args.report, args.profile_path if args.profile else None):
+        records = build_pipeline(
+            args.source,
+            source_path=args.input,
+            causes_file=None if args.no_filter else args.causes,
+            limit=args.limit,
+            enrich_rows=not args.no_enrich,
+            workers=args.workers,
+            rate=args.rate,
+            sections_path=None if args.sections is None else args.sections or wikipedia_sections.store_path(args.output),
+        )
+        count = write_jsonl(records, args.output)
+    print(f"✅ Streamed {count} records to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import csv
+import io
+import re
+import urllib.parse
+
+import fetch_causes_of_death
+from instrumentation import metrics
+
+# Enrichment backend that asks the SPARQL endpoint for everything the game
+# needs about a block of people in one query, instead of wbgetentities plus
+# label, place and article lookups. fetch_enhanced_production --backend sparql
+# turns the people returned here into the same records process_entity_data
+# builds.
+#
+# Values come from truthy (best rank) statements. Where a property has several,
+# SPARQL has no notion of claim order and may return them in any order from
+# one query to the next: citizenships and occupations are sorted by QID
+# before the first three are kept, so a run is repeatable, but they can differ
+# from the first claims the API path reads. The same goes for the SAMPLE
+# picked for a person with several photos (P18), birth or death places
+# (P19/P20), or a place with several countries (P17): any one of them, not
+# necessarily the same one each time or the one the API path reads.
+
+BLOCK_SIZE = 200  # people per query, keeps the response well under the 60s timeout
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/'
+FILE_PATH_PREFIX = 'http://commons.wikimedia.org/wiki/Special:FilePath/'
+LIST_SEPARATOR = '\x1f'  # between the values of a GROUP_CONCAT, labels may contain anything printable
+PAIR_SEPARATOR = '='     # between a QID and its label
+QID_RE = re.compile(r'Q\d+')
+
+# Columns of the CSV response, one row per person
+COLUMNS = ['person', 'lastrevid', 'modified', 'personLabel', 'birth', 'death', 'photo', 'coords',
+           'genderPair', 'placeOfBirth', 'placeOfDeath', 'citizenships', 'occupations', 'articleTitle']
+
+# "QID=label" pairs keep each value next to its label through SAMPLE and
+# GROUP_CONCAT; places add "=country label" (empty without a direct P17).
+PEOPLE_QUERY = """
+SELECT ?person ?lastrevid ?modified
+  (SAMPLE(?personName) AS ?personLabel)
+  (SAMPLE(CONCAT(STR(?birthTime), "/", STR(?birthPrecision))) AS ?birth)
+  (SAMPLE(CONCAT(STR(?deathTime), "/", STR(?deathPrecision))) AS ?death)
+  (SAMPLE(?photoFile) AS ?photo)
+  (SAMPLE(?coordsValue) AS ?coords)
+  (SAMPLE(CONCAT(STRAFTER(STR(?gender), "entity/"), "=", ?genderLabel)) AS ?genderPair)
+  (SAMPLE(CONCAT(STRAFTER(STR(?birthPlace), "entity/"), "=", ?birthPlaceLabel, "=",
+                 COALESCE(?birthCountryLabel, ""))) AS ?placeOfBirth)
+  (SAMPLE(CONCAT(STRAFTER(STR(?deathPlace), "entity/"), "=", ?deathPlaceLabel, "=",
+                 COALESCE(?deathCountryLabel, ""))) AS ?placeOfDeath)
+  (GROUP_CONCAT(DISTINCT CONCAT(STRAFTER(STR(?citizenship), "entity/"), "=", ?citizenshipLabel);
+                separator="\\u001F") AS ?citizenships)
+  (GROUP_CONCAT(DISTINCT CONCAT(STRAFTER(STR(?occupation), "entity/"), "=", ?occupationLabel);
+                separator="\\u001F") AS ?occupations)
+  (SAMPLE(?enwikiTitle) AS ?articleTitle)
+WHERE {{
+  VALUES ?person {{ {ids} }}
+  ?person schema:version ?lastrevid; schema:dateModified ?modified.
+  OPTIONAL {{
+    ?person p:P569 ?birthStatement.
+    ?birthStatement a wikibase:BestRank; psv:P569 ?birthValue.
+    ?birthValue wikibase:timeValue ?birthTime; wikibase:timePrecision ?birthPrecision.
+  }}
+  OPTIONAL {{
+    ?person p:P570 ?deathStatement.
+    ?deathStatement a wikibase:BestRank; psv:P570 ?deathValue.
+    ?deathValue wikibase:timeValue ?deathTime; wikibase:timePrecision ?deathPrecision.
+  }}
+  OPTIONAL {{ ?person wdt:P18 ?photoFile. }}
+  OPTIONAL {{ ?person wdt:P625 ?coordsValue. }}
+  OPTIONAL {{ ?person wdt:P21 ?gender. }}
+  OPTIONAL {{
+    ?person wdt:P19 ?birthPlace.
+    OPTIONAL {{ ?birthPlace wdt:P17 ?birthCountry. }}
+  }}
+  OPTIONAL {{
+    ?person wdt:P20 ?deathPlace.
+    OPTIONAL {{ ?deathPlace wdt:P17 ?deathCountry. }}
+  }}
+  OPTIONAL {{ ?person wdt:P27 ?citizenship. }}
+  OPTIONAL {{ ?person wdt:P106 ?occupation. }}
+  OPTIONAL {{
+    ?enwiki schema:about ?person; schema:isPartOf <https://en.wikipedia.org/>; schema:name ?enwikiTitle.
+  }}
+  SERVICE wikibase:label {{
+    bd:serviceParam wikibase:language "en".
+    ?person rdfs:label ?personName.
+    ?gender rdfs:label ?genderLabel.
+    ?birthPlace rdfs:label ?birthPlaceLabel.
+    ?birthCountry rdfs:label ?birthCountryLabel.
+    ?deathPlace rdfs:label ?deathPlaceLabel.
+    ?deathCountry rdfs:label ?deathCountryLabel.
+    ?citizenship rdfs:label ?citizenshipLabel.
+    ?occupation rdfs:label ?occupationLabel.
+  }}
+}}
+GROUP BY ?person ?lastrevid ?modified
+"""
+
+def people_query(entity_ids):
+    return PEOPLE_QUERY.format(ids=' '.join(f"wd:{eid}" for eid in entity_ids))
+
+def label_or_blank(qid, label):
+    """The label service falls back to the bare QID when there is no English label"""
+    return '' if not label or label == qid else label
+
+def wikidata_time(value):
+    """"1952-03-11T00:00:00Z/11" (RDF value and precision) in the JSON form wbgetentities returns
+
+    RDF uses XSD 1.1 years, where 0 is 1 BC, while the JSON counts -1 as 1 BC.
+    Anything coarser than a day keeps zeros for the unknown month and day.
+    """
+    if not value:
+        return None
+    time, _, precision = value.rpartition('/')
+    date, _, clock = time.partition('T')
+    year, month, day = date.rsplit('-', 2)
+    year = int(year)
+    if year <= 0:
+        year -= 1
+    precision = int(precision or 11)
+    if precision < 11:
+        day = '00'
+    if precision < 10:
+        month = '00'
+    return f"{'+' if year > 0 else '-'}{abs(year):04d}-{month}-{day}T{clock or '00:00:00Z'}"
+
+def commons_file(value):
+    """File name from the Special:FilePath IRI wdt:P18 points at"""
+    if not value:
+        return None
+    return urllib.parse.unquote(value[len(FILE_PATH_PREFIX):]) if value.startswith(FILE_PATH_PREFIX) else value
+
+def wkt_point(value):
+    """"Point(lon lat)" formatted like extract_claim_value, dropping any non-Earth globe IRI"""
+    if not value:
+        return None
+    lon, lat = value[value.index('Point(') + len('Point('):].rstrip(')').split()
+    return f"Point({float(lon)} {float(lat)})"
+
+def split_pair(value):
+    qid, _, label = value.partition(PAIR_SEPARATOR)
+    return qid, label_or_blank(qid, label)
+
+def parse_row(row):
+    """One CSV row as the PersonClaims fields plus the labels and places it carries"""
+    entity_id = row['person'][len(ENTITY_PREFIX):]
+    labels = {}
+    places = {}
+
+    def item(value):
+        if not value:
+            return None
+        qid, label = split_pair(value)
+        labels[qid] = label
+        return qid
+
+    def items(value):
+        """The QIDs of a GROUP_CONCAT in QID order, which SPARQL does not keep from one query to the next"""
+        qids = [item(pair) for pair in value.split(LIST_SEPARATOR) if pair] if value else []
+        return tuple(sorted(qids, key=lambda qid: (0, int(qid[1:]), '') if QID_RE.fullmatch(qid) else (1, 0, qid)))
+
+    def place(value):
+        if not value:
+            return None
+        qid, _, rest = value.partition(PAIR_SEPARATOR)
+        place_label, _, country_label = rest.rpartition(PAIR_SEPARATOR)
+        # No direct P17 (or an unlabelled country): None tells the caller to
+        # walk P131 the way the API path does
+        has_country = country_label and not QID_RE.fullmatch(country_label)
+        places[qid] = (label_or_blank(qid, place_label), country_label) if has_country else None
+        return qid
+
+    article_title = row.get('articleTitle')
+    return {
+        'entity_id': entity_id,
+        'label': label_or_blank(entity_id, row.get('personLabel')),
+        'birth_date': wikidata_time(row.get('birth')),
+        'death_date': wikidata_time(row.get('death')),
+        'photo': commons_file(row.get('photo')),
+        'coords': wkt_point(row.get('coords')),
+        'place_of_birth': place(row.get('placeOfBirth')),
+        'place_of_death': place(row.get('placeOfDeath')),
+        'gender': item(row.get('genderPair')),
+        'citizenship': items(row.get('citizenships'))[:3],
+        'occupation': items(row.get('occupations'))[:3],
+        'has_sitelinks': True,
+        'article': f"https://en.wikipedia.org/wiki/{article_title.replace(' ', '_')}" if article_title else None,
+        'lastrevid': int(row['lastrevid']) if row.get('lastrevid') else None,
+        'modified': row.get('modified') or None,
+        'labels': labels,
+        'places': places,
+    }
+
+def fetch_people(entity_ids, session=None):
+    """Return {QID: person} for a block of people in one SPARQL query; unknown QIDs are left out"""
+    text = fetch_causes_of_death.run_query(people_query(entity_ids), post=True, session=session)
+    with metrics.stage('parse'):
+        people = {}
+        for row in csv.DictReader(io.StringIO(text)):
+            person = parse_row(row)
+            people[person['entity_id']] = person
+    return people
@@ -0,0 +1,38 @@
+import contextlib
+import io
+import json
+
+import fetch_enhanced_production as enrich
+from http_client import make_session
+from mock_wikidata import MockWikidata, make_synthetic_entities
+
+# Regression test for reading enwiki sitelinks from the batched entity fetch
+# (user-008): the article URLs must be byte-for-byte what the old one
+# wbgetentities call per person produced.
+
+TRICKY_TITLES = ["Émile Zola", "Conan O'Brien", "AC/DC (band)", "Sinéad O'Connor", "Lý Thường Kiệt"]
+
+def test_batched_sitelinks_match_per_person_lookup(monkeypatch):
+    entities, people = make_synthetic_entities(200)
+    for qid, title in zip(people, TRICKY_TITLES):
+        entities[qid]['sitelinks']['enwiki'] = {'site': 'enwiki', 'title': title}
+
+    with MockWikidata(entities) as mock:
+        monkeypatch.setattr(enrich, 'API_URL', mock.url)
+        session = make_session(pool_size=4)
+
+        # New path: the article comes with the batch fetch
+        enrich.reset_state()
+        processed = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _, _, batch_processed in enrich.enrich_batches(people, session, 25):
+                processed.update(batch_processed or {})
+        batched = {qid: record['article'] for qid, record in processed.items()}
+
+        # Old path: one sitelinks request per person
+        enrich.reset_state()
+        per_person = {qid: enrich.get_wikipedia_article(qid, session) or '' for qid in batched}
+
+    assert len(batched) > 100
+    assert any(batched[qid] for qid in people[:len(TRICKY_TITLES)])
+    assert json.dumps(batched, ensure_ascii=False) == json.dumps(per_person, ensure_ascii=False)
@@ -0,0 +1,53 @@
+import json
+
+import fetch_enhanced_production as enrich
+from compact_store import CompactStore, collect_newest, finish_processed, write_store
+
+# Compacting a progress snapshot together with a checkpoint log (user-024):
+# checkpoint records are raw enrichment output, so they must not strip the
+# cause of death from a snapshot record or bring in irrelevant people.
+
+CAUSE = {'causeOfDeath': 'http://www.wikidata.org/entity/Q3739104', 'causeOfDeathLabel': 'natural causes'}
+
+def person(qid, **fields):
+    record = {
+        'person': f"http://www.wikidata.org/entity/{qid}",
+        'personLabel': f"Person {qid}",
+        'birthDate': '+1952-03-11T00:00:00Z',
+        'deathDate': '+2001-05-11T00:00:00Z',
+        'gender': 'male',
+        'photo': 'https://commons.wikimedia.org/wiki/Special:FilePath/Example.jpg',
+        'coords': None,
+        'placeOfBirth': 'Cambridge, United Kingdom',
+        'placeOfDeath': 'Santa Barbara, United States',
+        'citizenship': 'United Kingdom',
+        'occupation': 'writer',
+        'article': f"https://en.wikipedia.org/wiki/{qid}",
+        'lastrevid': 100,
+        'modified': '2024-01-01T00:00:00Z',
+    }
+    record.update(fields)
+    return record
+
+def test_checkpoint_records_are_finished_before_they_win(tmp_path):
+    snapshot = tmp_path / 'humans_enhanced_progress_100.json'
+    snapshot.write_text(json.dumps([{**person('Q42'), **CAUSE}]))
+
+    # Same revision of Q42 as the snapshot, plus Q7 with no photo (not relevant) and a new Q5
+    checkpoint = tmp_path / 'humans_enhanced_checkpoint.jsonl'
+    processed = {'Q42': person('Q42'), 'Q7': person('Q7', photo=''), 'Q5': person('Q5')}
+    checkpoint.write_text(json.dumps({'ids': list(processed), 'processed': processed}) + '\n')
+
+    filtered = [{'person': f"http://www.wikidata.org/entity/{qid}", **CAUSE} for qid in ('Q42', 'Q7', 'Q5')]
+    _, cause_of_death_map = enrich.map_causes_of_death(filtered)
+
+    newest, read = collect_newest([str(snapshot), str(checkpoint)], finish_processed(cause_of_death_map))
+    write_store(newest, str(tmp_path / 'people.wgstore'))
+
+    with CompactStore(str(tmp_path / 'people.wgstore')) as store:
+        assert 'Q7' not in store
+        assert len(store) == 2
+        for qid in ('Q42', 'Q5'):
+            assert store.get(qid)['causeOfDeathLabel'] == 'natural causes'
+            assert store.get(qid)['causeOfDeath'] == CAUSE['causeOfDeath']
+    assert read == 3
@@ -0,0 +1,48 @@
+import contextlib
+import io
+
+import fetch_enhanced_production as enrich
+from http_client import make_session
+from mock_wikidata import MockWikidata, make_synthetic_entities, write_dump
+from wikidata_dump import DumpEntitySource, build_index
+
+# Dump mode (user-011) must build the same records as the API it replaces.
+# Every third person dies "at sea", an item with neither P17 nor P131, whose
+# label only pass 2 of build_index picks up.
+
+AT_SEA = 'Q1165981'
+
+def enrich_all(people, session):
+    enrich.reset_state()
+    processed = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _, _, batch_processed in enrich.enrich_batches(people, session, 25):
+            processed.update(batch_processed or {})
+    return processed
+
+def test_dump_records_match_api_records(tmp_path, monkeypatch):
+    entities, people = make_synthetic_entities(150)
+    entities[AT_SEA] = {'type': 'item', 'id': AT_SEA, 'labels': {'en': {'language': 'en', 'value': 'at sea'}},
+                        'claims': {}, 'sitelinks': {}, 'lastrevid': 1, 'modified': "2024-01-01T00:00:00Z"}
+    for qid in people[::3]:
+        entities[qid]['claims']['P20'] = [{'mainsnak': {'datavalue': {'value': {'id': AT_SEA}}}}]
+
+    dump_path = str(tmp_path / 'dump.json.gz')
+    index_path = str(tmp_path / 'index.sqlite')
+    write_dump(entities, dump_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        build_index(dump_path, people, index_path)
+
+    with MockWikidata(entities) as mock:
+        monkeypatch.setattr(enrich, 'API_URL', mock.url)
+        session = make_session(pool_size=4)
+        from_api = enrich_all(people, session)
+
+        mock.reset_counts()
+        monkeypatch.setattr(enrich, 'entity_source', DumpEntitySource(index_path))
+        from_dump = enrich_all(people, session)
+        assert mock.total_calls == 0
+
+    assert len(from_api) > 100
+    assert sum(record['placeOfDeath'] == 'at sea' for record in from_dump.values()) > 30
+    assert from_dump == from_api
@@ -0,0 +1,97 @@
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mock_wikidata import MockWikidata, make_synthetic_entities, people_to_rows
+
+# Local workers sharing one queue (user-022): a worker killed mid-batch stops
+# renewing its lease, the batch expires and is handed to another worker, and
+# the merge still comes out the same as a single-process run.
+
+WORK_QUEUE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'work_queue.py')
+
+def work_queue(directory, *args, **kwargs):
+    return subprocess.Popen([sys.executable, WORK_QUEUE, *args], cwd=directory,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+
+def run_options(mock, processes, lease):
+    return ['run', '--input', 'input.json', '--batch-size', '5', '--processes', str(processes),
+            '--lease', str(lease), '--rate', '0', '--no-cache', '--api-url', mock.url, '--output', 'out.json']
+
+def worker_pid(parent, worker_id):
+    """PID of the worker process `parent` started as `worker_id`, if it is running"""
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            with open(f"/proc/{name}/cmdline", 'rb') as f:
+                cmdline = f.read().split(b'\0')
+        except OSError:
+            continue
+        if ppid == parent and worker_id.encode() in cmdline:
+            return int(name)
+    return None
+
+def leased_by(queue_path, worker_id):
+    if not os.path.exists(queue_path):
+        return False
+    conn = sqlite3.connect(queue_path, timeout=60)
+    try:
+        return conn.execute("SELECT 1 FROM batches WHERE status = 'leased' AND worker = ?",
+                            (worker_id,)).fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+def read_outputs(directory):
+    with open(directory / 'out.json') as f:
+        people = json.load(f)
+    with open(directory / 'out_revisions.json') as f:
+        revisions = json.load(f)
+    return people, revisions
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason="finds worker processes through /proc")
+def test_killed_worker_batch_is_redelivered_and_merged(tmp_path):
+    entities, people = make_synthetic_entities(60)
+    single, several = tmp_path / 'single', tmp_path / 'several'
+    for directory in (single, several):
+        directory.mkdir()
+        (directory / 'input.json').write_text(json.dumps(people_to_rows(entities, people)))
+
+    with MockWikidata(entities, latency=0.05) as mock:
+        assert work_queue(single, *run_options(mock, 1, 30)).wait(timeout=300) == 0
+
+        run = work_queue(several, *run_options(mock, 3, 2))
+        deadline = time.time() + 60
+        while not leased_by(str(several / 'enrichment_queue.sqlite'), 'local-0'):
+            assert time.time() < deadline and run.poll() is None
+            time.sleep(0.05)
+        pid = worker_pid(run.pid, 'local-0')
+        assert pid is not None
+        os.kill(pid, signal.SIGKILL)
+
+        # run refuses to merge after a worker failed, but the others have finished its batch
+        assert run.wait(timeout=300) == 1
+        conn = sqlite3.connect(str(several / 'enrichment_queue.sqlite'))
+        statuses = dict(conn.execute("SELECT status, COUNT(*) FROM batches GROUP BY status").fetchall())
+        redelivered = conn.execute("SELECT COUNT(*) FROM batches WHERE attempts > 1").fetchone()[0]
+        conn.close()
+        assert statuses == {'done': 12}
+        assert redelivered >= 1
+
+        assert work_queue(several, 'merge', '--output', 'out.json').wait(timeout=60) == 0
+
+    expected_people, expected_revisions = read_outputs(single)
+    merged_people, merged_revisions = read_outputs(several)
+    assert len(expected_people) > 40
+    assert merged_people == expected_people
+    assert merged_revisions == expected_revisions
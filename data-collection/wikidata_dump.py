@@ -0,0 +1,245 @@
+import argparse
+import bz2
+import gzip
+import json
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+# Offline entity source built from a Wikidata JSON dump (latest-all.json.gz
+# or .bz2). One pass over the dump keeps the full claims of the people we
+# want plus a compact side index (English label, P17, P131) of every place
+# and administrative entity. A second, prefiltered pass picks up the labels
+# still missing (genders, occupations, ...). DumpEntitySource then answers
+# the same questions as wbgetentities without any network access.
+
+DEFAULT_INDEX_PATH = 'wikidata_dump_index.sqlite'
+
+# Claims process_entity_data and the place resolver read; everything else is dropped
+PERSON_PROPERTIES = ('P18', 'P19', 'P20', 'P21', 'P27', 'P106', 'P569', 'P570', 'P625')
+NODE_PROPERTIES = ('P17', 'P131')
+
+ID_RE = re.compile(rb'"id":"([QP]\d+)"')
+
+# Parallel decompressors, tried before falling back to the single-threaded modules
+DECOMPRESSORS = {
+    '.gz': ['pigz', 'unpigz'],
+    '.bz2': ['lbzip2', 'pbzip2'],
+}
+
+@contextmanager
+def open_dump(path):
+    """Open a (compressed) dump as a binary line stream, decompressing in parallel when possible"""
+    for suffix, tools in DECOMPRESSORS.items():
+        if not path.endswith(suffix):
+            continue
+        for tool in tools:
+            if shutil.which(tool):
+                process = subprocess.Popen([tool, '-dc', path], stdout=subprocess.PIPE, bufsize=1 << 20)
+                try:
+                    yield process.stdout
+                finally:
+                    process.stdout.close()
+                    process.kill()
+                    process.wait()
+                return
+        opener = gzip.open if suffix == '.gz' else bz2.open
+        with opener(path, 'rb') as f:
+            yield f
+        return
+
+    with open(path, 'rb') as f:
+        yield f
+
+def iter_dump_lines(path):
+    """Yield (QID, raw line) for every entity line in the dump"""
+    with open_dump(path) as f:
+        for line in f:
+            # The entity id is always among the first keys of its line
+            match = ID_RE.search(line, 0, 200)
+            if match:
+                yield match.group(1).decode('ascii'), line
+
+def parse_entity_line(line):
+    line = line.rstrip()
+    if line.endswith(b','):
+        line = line[:-1]
+    return json.loads(line)
+
+def get_en_label(entity):
+    return entity.get('labels', {}).get('en', {}).get('value')
+
+def compact_person(entity):
+    """Keep only the English label, the claims we read and the enwiki sitelink"""
+    claims = entity.get('claims', {})
+    sitelinks = entity.get('sitelinks', {})
+    compact = {
+        'type': entity.get('type', 'item'),
+        'id': entity['id'],
+        'labels': {'en': entity['labels']['en']} if 'en' in entity.get('labels', {}) else {},
+        'claims': {pid: claims[pid] for pid in PERSON_PROPERTIES + NODE_PROPERTIES if pid in claims},
+        'sitelinks': {'enwiki': sitelinks['enwiki']} if 'enwiki' in sitelinks else {},
+    }
+    if 'lastrevid' in entity:
+        compact['lastrevid'] = entity['lastrevid']
+    if 'modified' in entity:
+        compact['modified'] = entity['modified']
+    return compact
+
+def first_entity_id(claims, property_id):
+    try:
+        return claims[property_id][0]['mainsnak']['datavalue']['value']['id']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+def referenced_label_ids(claims):
+    """Label IDs process_entity_data will ask for (gender, places, first 3 citizenships and occupations)
+
+    The places matter for those with neither P17 nor P131 (historical
+    states, "at sea"), which pass 1 does not keep.
+    """
+    ids = [first_entity_id(claims, 'P21'), first_entity_id(claims, 'P19'), first_entity_id(claims, 'P20')]
+    for property_id in ('P27', 'P106'):
+        values = []
+        for claim in claims.get(property_id, []):
+            value = first_entity_id({property_id: [claim]}, property_id)
+            if value:
+                values.append(value)
+        ids.extend(values[:3])
+    return {qid for qid in ids if qid}
+
+def connect_index(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('CREATE TABLE IF NOT EXISTS people (qid TEXT PRIMARY KEY, entity TEXT NOT NULL)')
+    conn.execute('CREATE TABLE IF NOT EXISTS nodes (qid TEXT PRIMARY KEY, label TEXT, p17 TEXT, p131 TEXT)')
+    return conn
+
+def build_index(dump_path, wanted_ids, index_path=DEFAULT_INDEX_PATH, report_every=1_000_000):
+    """Scan the dump and write the people and side index tables, returning counts"""
+    wanted_ids = set(wanted_ids)
+    conn = connect_index(index_path)
+    needed_labels = set()
+    stats = {'lines': 0, 'people': 0, 'nodes': 0, 'labels': 0}
+    start = time.perf_counter()
+
+    # Pass 1: people we want in full, plus every entity that sits in a
+    # place hierarchy (has P17 or P131). Lines without either marker are
+    # skipped before json.loads, which is where the time goes.
+    for qid, line in iter_dump_lines(dump_path):
+        stats['lines'] += 1
+        if stats['lines'] % report_every == 0:
+            print(f"  -> {stats['lines']} lines, {stats['people']} people, {stats['nodes']} nodes "
+                  f"({time.perf_counter() - start:.0f}s)")
+
+        is_person = qid in wanted_ids
+        if not is_person and b'"P17"' not in line and b'"P131"' not in line:
+            continue
+
+        entity = parse_entity_line(line)
+        claims = entity.get('claims', {})
+        if is_person:
+            conn.execute('INSERT OR REPLACE INTO people VALUES (?, ?)',
+                         (qid, json.dumps(compact_person(entity), ensure_ascii=False)))
+            needed_labels |= referenced_label_ids(claims)
+            stats['people'] += 1
+        conn.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?)', (
+            qid, get_en_label(entity), first_entity_id(claims, 'P17'), first_entity_id(claims, 'P131')
+        ))
+        stats['nodes'] += 1
+    conn.commit()
+
+    # Pass 2: labels of referenced entities outside any place hierarchy
+    # (genders, occupations, places without P17/P131, ...), matched on the id alone
+    known = {row[0] for row in conn.execute('SELECT qid FROM nodes')}
+    needed_labels -= known
+    if needed_labels:
+        for qid, line in iter_dump_lines(dump_path):
+            if qid not in needed_labels:
+                continue
+            entity = parse_entity_line(line)
+            conn.execute('INSERT OR REPLACE INTO nodes VALUES (?, ?, NULL, NULL)', (qid, get_en_label(entity)))
+            stats['labels'] += 1
+            needed_labels.discard(qid)
+            if not needed_labels:
+                break
+        conn.commit()
+
+    conn.close()
+    return stats
+
+def entity_claim(qid):
+    return [{'mainsnak': {'snaktype': 'value', 'datavalue': {'value': {'id': qid}, 'type': 'wikibase-entityid'}}}]
+
+class DumpEntitySource:
+    """Drop-in for wbgetentities backed by an index built with build_index"""
+
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        self.conn = connect_index(index_path)
+        self.lock = threading.Lock()
+
+    def get_raw_people(self, entity_ids):
+        """Return {QID: entity JSON text} for the indexed people among entity_ids, in order"""
+        raw = {}
+        with self.lock:
+            for qid in dict.fromkeys(entity_ids):
+                row = self.conn.execute('SELECT entity FROM people WHERE qid = ?', (qid,)).fetchone()
+                if row:
+                    raw[qid] = row[0]
+        return raw
+
+    def get_entities(self, entity_ids, props='labels|claims'):
+        """Return {QID: entity} shaped like the wbgetentities 'entities' field"""
+        props = set(props.split('|'))
+        entities = {}
+        for qid in dict.fromkeys(entity_ids):
+            with self.lock:
+                row = self.conn.execute('SELECT entity FROM people WHERE qid = ?', (qid,)).fetchone()
+                if not row:
+                    node = self.conn.execute('SELECT label, p17, p131 FROM nodes WHERE qid = ?', (qid,)).fetchone()
+            if row:
+                entity = json.loads(row[0])
+            else:
+                row = node
+                if row is None:
+                    entities[qid] = {'id': qid, 'missing': ''}
+                    continue
+                label, p17, p131 = row
+                entity = {
+                    'type': 'item',
+                    'id': qid,
+                    'labels': {'en': {'language': 'en', 'value': label}} if label else {},
+                    'claims': {},
+                    'sitelinks': {},
+                }
+                if p17:
+                    entity['claims']['P17'] = entity_claim(p17)
+                if p131:
+                    entity['claims']['P131'] = entity_claim(p131)
+
+            # lastrevid and modified are what props=info adds to an entity
+            entities[qid] = {key: value for key, value in entity.items()
+                             if key in ('type', 'id') or key in props
+                             or ('info' in props and key in ('lastrevid', 'modified'))}
+        return entities
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an offline entity index from a Wikidata JSON dump")
+    parser.add_argument('dump', help="latest-all.json.gz / .bz2 (or an uncompressed dump)")
+    parser.add_argument('--people', default='humans_filtered_cleaned.json', help="People to keep in full")
+    parser.add_argument('--index', default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args()
+
+    with open(args.people, 'r') as f:
+        wanted = {item['person'].split('/')[-1] for item in json.load(f)}
+
+    print(f"Scanning {args.dump} for {len(wanted)} people...")
+    stats = build_index(args.dump, wanted, args.index)
+    print(f"✅ Indexed {stats['people']} people, {stats['nodes']} place nodes and "
+          f"{stats['labels']} extra labels from {stats['lines']} lines into {args.index}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import argparse
+import gzip
+import json
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+import requests
+
+from columnar import WIKIPEDIA_PREFIX
+from entity_cache import DEFAULT_CACHE_PATH, EntityCache
+from http_client import ApiError, get_json, make_session
+import instrumentation
+from instrumentation import metrics
+
+# Plaintext Wikipedia sections for the people in the enriched records, the
+# text the game shows under a card. Titles come from the `article` URLs that
+# process_entity_data writes, are resolved 50 at a time (redirects, missing
+# pages and current revision IDs in one query), and only pages whose revision
+# changed since they were cached are fetched, each in one parse request.
+#
+# The result is a gzipped JSONL store next to the records, one line per person:
+#   {"qid": "Q42", "title": "...", "revid": 123, "sections": [{"heading": ..., "text": ...}]}
+
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+MAX_TITLES_PER_REQUEST = 50  # action=query limit for non-bot clients
+
+HEADING_TAGS = {'h2', 'h3', 'h4', 'h5', 'h6'}
+BLOCK_TAGS = HEADING_TAGS | {'p', 'div', 'br', 'li', 'dd', 'dt', 'tr', 'table', 'ul', 'ol', 'dl',
+                             'blockquote', 'pre', 'figure', 'figcaption', 'caption'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source',
+             'track', 'wbr'}
+SKIPPED_TAGS = {'style', 'script', 'noscript', 'math'}
+# Edit links, citation markers, reference lists and navigation boxes are not article text
+SKIPPED_CLASSES = {'mw-editsection', 'reference', 'mw-references-wrap', 'reflist', 'navbox',
+                   'noprint', 'mw-empty-elt', 'metadata', 'hatnote', 'mw-cite-backlink'}
+
+def article_title(article_url):
+    """Page title (with spaces) from an `article` URL get_wikipedia_article builds"""
+    if not article_url or not article_url.startswith(WIKIPEDIA_PREFIX):
+        return None
+    return urllib.parse.unquote(article_url[len(WIKIPEDIA_PREFIX):]).replace('_', ' ')
+
+def store_path(records_path):
+    """Where the sections for a records file live, e.g. humans_enhanced_relevant_sections.jsonl.gz"""
+    stem = records_path.rsplit('.', 1)[0]
+    return f"{stem}_sections.jsonl.gz"
+
+class SectionParser(HTMLParser):
+    """Streaming splitter from rendered article HTML to [{heading, text}]
+
+    Feed it the page in as many pieces as convenient. Text before the first
+    heading (the lead and infobox) is dropped, as are the elements in
+    SKIPPED_TAGS and SKIPPED_CLASSES; block elements become line breaks.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.sections = []
+        self.heading = None  # text chunks while inside a heading
+        self.chunks = None   # text chunks of the current section
+        self.skip_tag = None
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.skip_tag:
+            if tag == self.skip_tag and tag not in VOID_TAGS:
+                self.skip_depth += 1
+            return
+        classes = set((dict(attrs).get('class') or '').split())
+        if tag in SKIPPED_TAGS or classes & SKIPPED_CLASSES:
+            if tag not in VOID_TAGS:
+                self.skip_tag, self.skip_depth = tag, 1
+            return
+
+        if tag in HEADING_TAGS:
+            self._finish_section()
+            self.heading = []
+        elif tag in BLOCK_TAGS:
+            self._text('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.skip_tag and tag in BLOCK_TAGS:
+            self._text('\n')
+
+    def handle_endtag(self, tag):
+        if self.skip_tag:
+            if tag == self.skip_tag:
+                self.skip_depth -= 1
+                if self.skip_depth == 0:
+                    self.skip_tag = None
+            return
+
+        if tag in HEADING_TAGS and self.heading is not None:
+            self.chunks = [' '.join(''.join(self.heading).split())]
+            self.heading = None
+        elif tag in BLOCK_TAGS:
+            self._text('\n')
+
+    def handle_data(self, data):
+        if not self.skip_tag:
+            self._text(data)
+
+    def _text(self, data):
+        if self.heading is not None:
+            self.heading.append(data)
+        elif self.chunks is not None:
+            self.chunks.append(data)
+
+    def _finish_section(self):
+        if self.chunks:
+            heading, body = self.chunks[0], ''.join(self.chunks[1:])
+            lines = (' '.join(line.split()) for line in body.split('\n'))
+            text = '\n'.join(line for line in lines if line)
+            if text:
+                self.sections.append({'heading': heading, 'text': text})
+        self.chunks = None
+
+    def close(self):
+        super().close()
+        self._finish_section()
+        return self.sections
+
+@metrics.stage('html')
+def split_sections(page_html):
+    """Split a rendered article into [{heading, text}] for every headed section"""
+    parser = SectionParser()
+    parser.feed(page_html)
+    return parser.close()
+
+@metrics.stage('sections')
+def resolve_titles(titles, session):
+    """Return {title: (page title, revid)} following redirects, None for missing pages"""
+    params = {
+        'action': 'query',
+        'titles': '|'.join(titles),
+        'prop': 'info',
+        'redirects': 1,
+        'format': 'json',
+        'formatversion': 2,
+    }
+    query = get_json(session, WIKIPEDIA_API_URL, params, timeout=30).get('query', {})
+
+    # Requested title -> normalised title -> redirect target -> page
+    renamed = {entry['from']: entry['to'] for entry in query.get('normalized', [])}
+    redirects = {entry['from']: entry['to'] for entry in query.get('redirects', [])}
+    pages = {page['title']: page for page in query.get('pages', [])}
+
+    resolved = {}
+    for title in titles:
+        name = renamed.get(title, title)
+        name = redirects.get(name, name)
+        page = pages.get(name)
+        if page is None or page.get('missing') or page.get('invalid'):
+            resolved[title] = None
+        else:
+            resolved[title] = (page['title'], page['lastrevid'])
+    return resolved
+
+@metrics.stage('sections')
+def fetch_page_html(revid, session):
+    """Rendered HTML of one page revision, or None if it no longer exists"""
+    params = {
+        'action': 'parse',
+        'oldid': revid,
+        'prop': 'text',
+        'disableeditsection': 1,
+        'disabletoc': 1,
+        'format': 'json',
+        'formatversion': 2,
+    }
+    try:
+        data = get_json(session, WIKIPEDIA_API_URL, params, timeout=30)
+    except ApiError as e:
+        if e.code in ('nosuchrevid', 'missingtitle', 'permissiondenied'):
+            return None  # deleted or suppressed revision
+        raise
+    return data['parse']['text']
+
+def fixture_filename(title):
+    return urllib.parse.quote(title.replace(' ', '_'), safe='') + '.html'
+
+def iter_sections(records, session, cache=None, batch_size=MAX_TITLES_PER_REQUEST, workers=4, save_html=None):
+    """Yield (record, entry) for every record, entry being None when there are no sections
+
+    Pages are fetched by a pool of at most `workers` threads, one batch of
+    titles at a time, so `records` can be a stream. Entries are cached under
+    "sections_<QID>" and reused while the page revision is unchanged.
+    `save_html` is a directory to keep the fetched HTML in as test fixtures.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield from _sections_batch(batch, session, cache, executor, save_html)
+                batch = []
+        if batch:
+            yield from _sections_batch(batch, session, cache, executor, save_html)
+
+def _sections_batch(records, session, cache, executor, save_html):
+    titles = {}
+    for record in records:
+        title = article_title(record.get('article'))
+        if title:
+            titles[record['person'].split('/')[-1]] = title
+
+    try:
+        resolved = resolve_titles(sorted(set(titles.values())), session) if titles else {}
+    except requests.exceptions.RequestException as e:
+        print(f"  -> Could not resolve {len(titles)} article titles, skipping them: {e}")
+        resolved = {}
+
+    entries = {}
+    to_fetch = []
+    for qid, title in titles.items():
+        page = resolved.get(title)
+        if page is None:
+            continue
+        cached = cache.get(f"sections_{qid}") if cache is not None else None
+        if cached is not None and cached['revid'] == page[1]:
+            entries[qid] = {'qid': qid, **cached}
+        else:
+            to_fetch.append((qid, page))
+
+    def fetch(item):
+        qid, (title, revid) = item
+        try:
+            page_html = fetch_page_html(revid, session)
+        except requests.exceptions.RequestException as e:
+            print(f"  -> Skipping {title}: {e}")
+            return qid, None
+        if page_html is None:
+            return qid, None
+        if save_html:
+            with open(os.path.join(save_html, fixture_filename(title)), 'w', encoding='utf-8') as f:
+                f.write(page_html)
+        return qid, {'title': title, 'revid': revid, 'sections': split_sections(page_html)}
+
+    for qid, entry in executor.map(fetch, to_fetch):
+        if entry is None:
+            continue
+        if cache is not None:
+            cache[f"sections_{qid}"] = entry
+        entries[qid] = {'qid': qid, **entry}
+
+    for record in records:
+        yield record, entries.get(record['person'].split('/')[-1])
+
+class SectionStore:
+    """Gzipped JSONL writer for section entries, only moved into place once complete"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.file = gzip.open(path + '.tmp', 'wt', encoding='utf-8')
+
+    def write(self, entry):
+        with metrics.stage('serialize'):
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.path + '.tmp')
+
+def load_store(path):
+    """Read a section store back as {QID: entry}"""
+    entries = {}
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry['qid']] = entry
+    return entries
+
+def build_store(records, path, session, cache=None, workers=4, save_html=None):
+    """Fetch sections for all records into the store at `path`, returning how many people have some"""
+    with SectionStore(path) as store:
+        for _, entry in iter_sections(records, session, cache, workers=workers, save_html=save_html):
+            if entry is not None:
+                store.write(entry)
+    return store.count
+
+def load_records(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract plaintext Wikipedia sections for enriched people")
+    parser.add_argument('input', nargs='?', default='humans_enhanced_relevant.json',
+                        help="Enriched records (.json list or .jsonl)")
+    parser.add_argument('--output', help="Section store to write (default: <input>_sections.jsonl.gz)")
+    parser.add_argument('--workers', type=int, default=4, help="Pages fetched concurrently")
+    parser.add_argument('--rate', type=float, default=10.0, help="Maximum Wikipedia requests per second")
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help="Persistent cache for sections")
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--save-html', metavar='DIR', help="Also save every fetched page here as an HTML fixture")
+    parser.add_argument('--html', metavar='FILE', help="Just split a saved HTML file and print its sections")
+    instrumentation.add_arguments(parser, 'sections_run_report.json')
+    args = parser.parse_args()
+
+    if args.html:
+        with open(args.html, 'r', encoding='utf-8') as f:
+            print(json.dumps(split_sections(f.read()), ensure_ascii=False, indent=2))
+        return
+
+    output = args.output or store_path(args.input)
+    if args.save_html:
+        os.makedirs(args.save_html, exist_ok=True)
+    records = load_records(args.input)
+    print(f"Extracting sections for {len(records)} people from {args.input}")
+
+    with instrumentation.instrumented_run(args.report, args.profile_path if args.profile else None):
+        cache = None if args.no_cache else EntityCache(args.cache)
+        session = make_session(pool_size=max(10, args.workers), rate=args.rate or None)
+        count = build_store(records, output, session, cache, args.workers, args.save_html)
+        if cache is not None:
+            cache.close()
+    print(f"✅ Saved sections for {count} people to {output}")
+
+if __name__ == "__main__":
+    main()
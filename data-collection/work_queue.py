@@ -0,0 +1,393 @@
+import argparse
+import glob
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import fetch_enhanced_production as enrich
+from entity_cache import DEFAULT_CACHE_PATH, EntityCache
+from http_client import make_session
+from instrumentation import CountingCache
+from wikidata_dump import DumpEntitySource
+
+# Split one enrichment run across several worker processes or machines.
+#
+#   enqueue   the coordinator cuts the input into QID batches in a SQLite queue
+#   worker    any number of workers (each with its own rate budget) lease a
+#             batch, enrich it and append the result to their own shard file
+#   merge     the coordinator reads every shard back and writes the same
+#             output files fetch_enhanced_production.py would have
+#
+# A lease runs out if a worker stops renewing it (crash, kill -9, lost host),
+# and the batch is handed to the next worker that asks. Batches that keep
+# failing are given up after --max-attempts and reported as dead letters.
+# Workers on other machines need the queue file and shard directory on a
+# shared filesystem that supports SQLite locking.
+
+DEFAULT_QUEUE_PATH = 'enrichment_queue.sqlite'
+DEFAULT_SHARD_DIR = 'enrichment_shards'
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 5
+RETRY_DELAY = 30  # seconds before a failed batch is handed out again
+
+class WorkQueue:
+    """SQLite table of QID batches that workers lease, complete or hand back"""
+
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        # Autocommit, with explicit BEGIN IMMEDIATE wherever a read decides a write
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS batches (
+                id INTEGER PRIMARY KEY,
+                ids TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                worker TEXT,
+                available_at REAL NOT NULL DEFAULT 0,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _transaction(self, func):
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = func()
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+        return result
+
+    def fill(self, entity_ids, batch_size, meta):
+        """Replace the queue with entity_ids cut into batches, remembering `meta` for the merge"""
+        def fill():
+            self.conn.execute('DELETE FROM batches')
+            self.conn.execute('DELETE FROM meta')
+            self.conn.executemany('INSERT INTO batches (id, ids) VALUES (?, ?)', (
+                (n, json.dumps(batch)) for n, batch in enumerate(enrich.iter_batches(entity_ids, batch_size), 1)
+            ))
+            self.conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)',
+                                  ((key, json.dumps(value)) for key, value in meta.items()))
+        self._transaction(fill)
+
+    def meta(self):
+        return {key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM meta')}
+
+    def lease(self, worker, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Claim the first available batch as (batch ID, entity IDs), or None if there is none right now"""
+        def lease():
+            now = time.time()
+            # Expired leases on their last attempt are given up instead of handed out again
+            self.conn.execute(
+                "UPDATE batches SET status = 'failed' WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, max_attempts)
+            )
+            row = self.conn.execute(
+                "SELECT id, ids FROM batches WHERE (status = 'pending' AND available_at <= ?) "
+                "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE batches SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (worker, now + lease_seconds, row[0])
+            )
+            return row[0], json.loads(row[1])
+        return self._transaction(lease)
+
+    def renew(self, batch_id, worker, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """Extend a lease, returning False if it has already passed to another worker"""
+        cursor = self.conn.execute(
+            "UPDATE batches SET lease_expires = ? WHERE id = ? AND status = 'leased' AND worker = ?",
+            (time.time() + lease_seconds, batch_id, worker)
+        )
+        return cursor.rowcount == 1
+
+    def complete(self, batch_id, worker):
+        """Mark a batch done; its result is in `worker`'s shard"""
+        # A worker whose lease expired mid-batch still finished the work, so
+        # it may complete the batch unless someone else already has
+        self.conn.execute(
+            "UPDATE batches SET status = 'done', worker = ?, lease_expires = NULL WHERE id = ? AND status != 'done'",
+            (worker, batch_id)
+        )
+
+    def release(self, batch_id, worker, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        """Hand a batch that failed back to the queue, or give up on it after max_attempts"""
+        self.conn.execute(
+            "UPDATE batches SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "available_at = ?, lease_expires = NULL WHERE id = ? AND status = 'leased' AND worker = ?",
+            (max_attempts, time.time() + retry_delay, batch_id, worker)
+        )
+
+    def counts(self):
+        return dict(self.conn.execute('SELECT status, COUNT(*) FROM batches GROUP BY status'))
+
+    def unfinished(self):
+        """True while any batch may still be handed out or is being worked on"""
+        return self.conn.execute(
+            "SELECT 1 FROM batches WHERE status IN ('pending', 'leased') LIMIT 1"
+        ).fetchone() is not None
+
+    def completed_by(self):
+        """{batch ID: worker whose shard holds the result} for every finished batch"""
+        return dict(self.conn.execute("SELECT id, worker FROM batches WHERE status = 'done'"))
+
+    def failed_ids(self):
+        ids = []
+        for (batch,) in self.conn.execute("SELECT ids FROM batches WHERE status = 'failed' ORDER BY id"):
+            ids.extend(json.loads(batch))
+        return ids
+
+    def close(self):
+        self.conn.close()
+
+class LeaseHeartbeat:
+    """Keeps renewing a lease from a background thread while its batch is being worked on"""
+
+    def __init__(self, queue_path, batch_id, worker, lease_seconds):
+        self.args = (batch_id, worker, lease_seconds)
+        self.queue_path = queue_path
+        self.interval = lease_seconds / 3
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        # sqlite3 connections belong to the thread that opened them
+        queue = WorkQueue(self.queue_path)
+        try:
+            while not self.stopped.wait(self.interval):
+                if not queue.renew(*self.args):
+                    return
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+def shard_path(shard_dir, worker):
+    return os.path.join(shard_dir, f"{worker}.jsonl")
+
+def enqueue(args):
+    with open(args.input, 'r') as f:
+        filtered_data = json.load(f)
+    if args.limit:
+        filtered_data = filtered_data[:args.limit]
+    entity_ids, _ = enrich.map_causes_of_death(filtered_data)
+    entity_ids = list(dict.fromkeys(entity_ids))
+
+    queue = WorkQueue(args.queue)
+    queue.fill(entity_ids, args.batch_size, {'input': args.input, 'limit': args.limit})
+    print(f"✅ Queued {len(entity_ids)} people in {queue.counts().get('pending', 0)} batches in {args.queue}")
+    queue.close()
+
+    # Shards of an earlier run would be merged into this one
+    for path in glob.glob(os.path.join(args.shards, '*.jsonl')):
+        os.remove(path)
+
+def work(args):
+    """Lease and enrich batches until the queue has nothing left to hand out"""
+    worker = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    if not args.no_cache:
+        enrich.label_cache = CountingCache(EntityCache(args.cache))
+    if args.dump_index:
+        enrich.entity_source = DumpEntitySource(args.dump_index)
+    enrich.use_sparql = args.backend == 'sparql'
+    if args.api_url:
+        enrich.API_URL = args.api_url
+    session = make_session(pool_size=10, rate=args.rate or None)
+
+    queue = WorkQueue(args.queue)
+    os.makedirs(args.shards, exist_ok=True)
+    done = 0
+    print(f"👷 Worker {worker} started")
+
+    with open(shard_path(args.shards, worker), 'a', encoding='utf-8') as shard:
+        while True:
+            leased = queue.lease(worker, args.lease, args.max_attempts)
+            if leased is None:
+                if not queue.unfinished():
+                    break
+                time.sleep(min(5, args.lease / 10))  # others still hold leases that may expire
+                continue
+
+            batch_id, batch = leased
+            with LeaseHeartbeat(args.queue, batch_id, worker, args.lease):
+                processed = enrich.enrich_batch(batch, session)
+
+            if processed is None:
+                queue.release(batch_id, worker, args.max_attempts)
+                print(f"  -> Batch {batch_id} failed, handed back to the queue")
+                continue
+
+            # The shard line goes to disk before the batch counts as done, so
+            # a crash in between only means the batch is done twice
+            revisions = {eid: enrich.entity_revisions.pop(eid, None) for eid in batch}
+            shard.write(json.dumps({'batch': batch_id, 'ids': batch, 'processed': processed,
+                                    'revisions': revisions}, ensure_ascii=False) + '\n')
+            shard.flush()
+            os.fsync(shard.fileno())
+            queue.complete(batch_id, worker)
+            if not args.no_cache:
+                enrich.label_cache.flush()  # one short write to the cache the other workers share
+            done += 1
+            print(f"  -> Batch {batch_id}: {len(processed)} people")
+
+    queue.close()
+    if not args.no_cache:
+        enrich.label_cache.close()
+    print(f"✅ Worker {worker} finished {done} batches")
+
+def read_shards(shard_dir):
+    """Yield (worker, entry) for every complete line in every shard, in a fixed order"""
+    for path in sorted(glob.glob(os.path.join(shard_dir, '*.jsonl'))):
+        worker = os.path.basename(path)[:-len('.jsonl')]
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line) if line.endswith(b'\n') else None
+                except json.JSONDecodeError:
+                    entry = None
+                if entry is not None:  # a worker killed mid-write leaves a torn last line
+                    yield worker, entry
+
+def merge(args):
+    queue = WorkQueue(args.queue)
+    counts = queue.counts()
+    if queue.unfinished() and not args.partial:
+        print(f"❌ Queue still has unfinished batches {counts}; wait for the workers or pass --partial")
+        sys.exit(1)
+    meta = queue.meta()
+    completed_by = queue.completed_by()
+    failed_ids = queue.failed_ids()
+    queue.close()
+
+    # Prefer the copy from the worker the queue credits with each batch, so a
+    # batch done twice (expired lease, crash before completing) merges the same way every time
+    results = {}
+    for worker, entry in read_shards(args.shards):
+        batch_id = entry['batch']
+        if batch_id not in results or completed_by.get(batch_id) == worker:
+            results[batch_id] = entry
+
+    with open(meta['input'], 'r') as f:
+        filtered_data = json.load(f)
+    if meta['limit']:
+        filtered_data = filtered_data[:meta['limit']]
+    all_ids, cause_of_death_map = enrich.map_causes_of_death(filtered_data)
+
+    all_processed = {}
+    revisions = {}
+    for batch_id in sorted(results):
+        all_processed.update(results[batch_id]['processed'])
+        revisions.update(results[batch_id]['revisions'])
+    all_processed = {eid: all_processed[eid] for eid in all_ids if eid in all_processed}
+    relevant_people = enrich.select_relevant(all_processed, cause_of_death_map)
+
+    output_file = args.output or (f"humans_enhanced_relevant_{meta['limit']}.json" if meta['limit']
+                                  else 'humans_enhanced_relevant.json')
+    revisions_file = output_file.replace('.json', '_revisions.json')
+    dead_letters_file = output_file.replace('.json', '_dead_letters.json')
+
+    with open(output_file, 'w') as f:
+        json.dump(relevant_people, f, indent=2, ensure_ascii=False)
+    with open(revisions_file, 'w') as f:
+        json.dump({eid: revisions[eid] for eid in dict.fromkeys(all_ids) if revisions.get(eid) is not None}, f)
+    if failed_ids:
+        with open(dead_letters_file, 'w') as f:
+            json.dump(failed_ids, f)
+        print(f"⚠️  {len(failed_ids)} people in failed batches, listed in {dead_letters_file}")
+
+    print(f"✅ Merged {len(results)} batches from {args.shards} into {output_file} "
+          f"({len(relevant_people)} relevant people)")
+
+def run_local(args):
+    """enqueue, run --processes workers on this machine and merge once they are done"""
+    enqueue(args)
+    command = [sys.executable, os.path.abspath(__file__), 'worker', '--queue', args.queue, '--shards', args.shards]
+    command += worker_options(args)
+    workers = [subprocess.Popen(command + ['--worker-id', f"local-{n}"]) for n in range(args.processes)]
+    failed = [f"local-{n}" for n, process in enumerate(workers) if process.wait() != 0]
+    if failed:
+        # Their unfinished batches are still in the queue for `worker` to pick up before a `merge`
+        print(f"❌ Worker(s) {', '.join(failed)} exited with an error, not merging")
+        sys.exit(1)
+    merge(args)
+
+def worker_options(args):
+    """The worker settings of `args` as command line options"""
+    options = ['--lease', str(args.lease), '--max-attempts', str(args.max_attempts), '--rate', str(args.rate),
+               '--cache', args.cache, '--backend', args.backend]
+    if args.no_cache:
+        options.append('--no-cache')
+    if args.dump_index:
+        options += ['--dump-index', args.dump_index]
+    if args.api_url:
+        options += ['--api-url', args.api_url]
+    return options
+
+def main():
+    parser = argparse.ArgumentParser(description="Split enrichment across worker processes with a SQLite work queue")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue', help="Cut the input into batches in a fresh queue")
+    worker_parser = subparsers.add_parser('worker', help="Lease and enrich batches until the queue is drained")
+    status_parser = subparsers.add_parser('status', help="Show how many batches are in each state")
+    merge_parser = subparsers.add_parser('merge', help="Merge the worker shards into the usual output files")
+    run_parser = subparsers.add_parser('run', help="enqueue, start local worker processes and merge")
+
+    for subparser in (enqueue_parser, worker_parser, status_parser, merge_parser, run_parser):
+        subparser.add_argument('--queue', default=DEFAULT_QUEUE_PATH)
+    for subparser in (enqueue_parser, worker_parser, merge_parser, run_parser):
+        subparser.add_argument('--shards', default=DEFAULT_SHARD_DIR, help="Directory of per-worker output shards")
+    for subparser in (enqueue_parser, run_parser):
+        subparser.add_argument('--input', default='humans_filtered_cleaned.json')
+        subparser.add_argument('--limit', type=int, help="Only queue the first N people")
+        subparser.add_argument('--batch-size', type=int, default=25)
+    for subparser in (merge_parser, run_parser):
+        subparser.add_argument('--output', help="Output file (default: what fetch_enhanced_production.py writes)")
+        subparser.add_argument('--partial', action='store_true', help="Merge even if batches are unfinished")
+    for subparser in (worker_parser, run_parser):
+        subparser.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS,
+                               help="Seconds a batch stays leased without a heartbeat")
+        subparser.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+        subparser.add_argument('--rate', type=float, default=10.0, help="This worker's API requests per second")
+        subparser.add_argument('--cache', default=DEFAULT_CACHE_PATH)
+        subparser.add_argument('--no-cache', action='store_true')
+        subparser.add_argument('--backend', choices=['api', 'sparql'], default='api')
+        subparser.add_argument('--dump-index', help="Read entities from a wikidata_dump.py index")
+        subparser.add_argument('--api-url', help="Wikidata API to use instead of www.wikidata.org")
+    worker_parser.add_argument('--worker-id', help="Name of this worker and its shard (default: host-pid)")
+    run_parser.add_argument('--processes', type=int, default=4, help="Local worker processes")
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        enqueue(args)
+    elif args.command == 'worker':
+        work(args)
+    elif args.command == 'status':
+        queue = WorkQueue(args.queue)
+        print(json.dumps(queue.counts()))
+        queue.close()
+    elif args.command == 'merge':
+        merge(args)
+    else:
+        run_local(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,89 @@
+import { base } from "$app/paths";
+
+// Static bundle written by data-collection/build_bundle.py into static/bundle/.
+// Person Q<id> lives in people/<id % shardCount>.json and their Wikipedia
+// sections in sections/<id % sectionShardCount>.json.
+
+export interface BundleIndex {
+	version: number;
+	generated: string;
+	shardCount: number;
+	sectionShardCount: number;
+	causes: string[];
+	// [QID number, index into causes]
+	people: [number, number][];
+}
 
-export async function getImageFromWikidata(entityUrl: string): Promise<string | null> {
-  const id = entityUrl.split('/').pop();
-  if (!id) {
-    return null;
-  }
-
-  const apiUrl = `https://www.wikidata.org/wiki/Special:EntityData/${id}.json`;
-  const res = await fetch(apiUrl);
-  const data = await res.json();
-
-  const entity = data.entities[id];
-  const imageClaim = entity?.claims?.P18?.[0]?.mainsnak?.datavalue?.value;
+export interface BundledPerson {
+	person: string;
+	personLabel: string;
+	birthDate: string;
+	gender: string;
+	placeOfBirth: string;
+	citizenship: string;
+	occupation: string;
+	causeOfDeath: string;
+	causeOfDeathLabel: string;
+	image?: string;
+	imageSrcset?: string;
+	article?: { title: string; url: string };
+}
 
-  if (!imageClaim) {
-    return null;
-  }
-  return `https://commons.wikimedia.org/wiki/Special:FilePath/${encodeURIComponent(imageClaim)}`;
+export interface WikipediaSection {
+	heading: string;
+	text: string;
 }
 
-export async function getWikipediaSections(entityUrl: string) {
-	const id = entityUrl.split('/').pop();
-	if (!id) {
-    return null
-  };
-
-	// Step 1: Fetch Wikidata entity
-	const wdRes = await fetch(`https://www.wikidata.org/wiki/Special:EntityData/${id}.json`);
-	const wdData = await wdRes.json();
-	const entity = wdData.entities[id];
-
-	// Step 2: Get English Wikipedia title
-	const title = entity.sitelinks?.enwiki?.title;
-	if (!title) {
-    return null
-  }
-
-	// Step 3: Fetch sections list
-	const sectionsRes = await fetch(
-		`https://en.wikipedia.org/w/api.php?action=parse&page=${encodeURIComponent(
-			title
-		)}&prop=sections&format=json&origin=*`
-	);
-	const sectionsData = await sectionsRes.json();
-	const sectionsList = sectionsData.parse.sections as { line: string; index: string }[];
+const shardCache = new Map<string, Promise<Record<string, unknown>>>();
 
-	const resultSections: { heading: string; text: string }[] = [];
+function loadShard<T>(path: string): Promise<Record<string, T>> {
+	let shard = shardCache.get(path);
+	if (!shard) {
+		shard = fetch(`${base}/bundle/${path}`).then((res) => {
+			if (!res.ok) {
+				throw new Error(`Failed to load bundle/${path}: ${res.status}`);
+			}
+			return res.json();
+		});
+		// Forget failed loads so the next round tries again
+		shard.catch(() => shardCache.delete(path));
+		shardCache.set(path, shard);
+	}
+	return shard as Promise<Record<string, T>>;
+}
 
-	// Step 4: Fetch plaintext for each section individually
-	for (const sec of sectionsList) {
-		const secRes = await fetch(
-			`https://en.wikipedia.org/w/api.php?action=parse&page=${encodeURIComponent(
-				title
-			)}&section=${sec.index}&prop=text&format=json&origin=*`
-		);
-		const secData = await secRes.json();
-		const textHtml = secData.parse.text['*'] as string;
+export async function loadBundleIndex(): Promise<BundleIndex> {
+	const res = await fetch(`${base}/bundle/index.json`);
+	if (!res.ok) {
+		throw new Error(`Failed to load bundle/index.json: ${res.status}`);
+	}
+	return res.json();
+}
 
-		// Strip HTML tags
-		const text = textHtml.replace(/<[^>]+>/g, '').replace(/\n\s*\n/g, '\n').trim();
+export async function getBundledPerson(index: BundleIndex, qid: number): Promise<BundledPerson> {
+	const shard = await loadShard<BundledPerson>(`people/${qid % index.shardCount}.json`);
+	const person = shard[`Q${qid}`];
+	if (!person) {
+		throw new Error(`Q${qid} is missing from its bundle shard`);
+	}
+	return person;
+}
 
-		resultSections.push({ heading: sec.line, text });
+// Title, URL and plaintext sections of a person's article, read from the bundle
+export async function getBundledSections(index: BundleIndex, person: BundledPerson) {
+	if (!person.article || !index.sectionShardCount) {
+		return null;
 	}
 
+	const qid = Number(person.person.split("/").pop()!.slice(1));
+	const shard = await loadShard<WikipediaSection[]>(
+		`sections/${qid % index.sectionShardCount}.json`
+	);
+
 	return {
-		title,
-		url: `https://en.wikipedia.org/wiki/${encodeURIComponent(title)}`,
-		sections: resultSections,
+		title: person.article.title,
+		url: person.article.url,
+		sections: shard[`Q${qid}`] ?? [],
 	};
 }
 